@@ -14,6 +14,8 @@
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
 #  */
+import atexit
+import json
 import os
 import subprocess
 from argparse import ArgumentParser
@@ -23,52 +25,198 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 
-from evaluation.local_utils import read_data, MEDICAL_SCORE
+from evaluation.constants import MEDICAL_SCORE, required_columns, project_columns
 from preprocessing.preprocess_UCC import preprocess
 
 DELETE_TEMP = False
 
+# columns of a sweep grid, one row per configuration
+SWEEP_COLUMNS = ['k', 'suppression_limit', 'metric', 'step_limit']
+METRICS = ['loss', 'entropy', 'precision', 'height', 'aecs', 'discernability']
+# prefix of the progress events the jar writes to stdout
+PROGRESS_PREFIX = "PROGRESS "
+# line of the jar in server mode ending a run, followed by the exit status
+SERVER_DONE_PREFIX = "DONE "
+
+# jar server of this process, see start_jar_server
+_JAR_SERVER = None
+
 
 def preprocess_ucc_file(df):
     """
     preprocesses the original highmed cardio data to conform with anonymization requirements
+    DF is not modified, the returned table shares its unconverted columns; missing values are written as NULL by to_csv
     :return:
     """
 
-    df.fillna("NULL", inplace=True)
+    converted = {}
     for column in ['age', 'sys_bp_m', 'smoking', 'diabetes', 'copd', 'hf_duration',
                    'hf_gt_18_months', 'mra', 'beta', 'furosemide1', 'statin', 'arni',
                    'acei_arb', 'lvef_m', 'sodium_m', 'creatinine_m', 'hb_m', 'egfr_m', 'ntprobnp_m', 'hstnt_m']:
+        if column not in df:
+            # projected away, see evaluation.constants.required_columns
+            continue
         try:
-            df[column] = np.where(df[column].astype(str).str.endswith(".0"),  # if value ends with .0
-                                  df[column].astype(str).str[:-2],  # column without .0
-                                  df[column].astype(str))  # normal value
-            # df[column] = df[column].astype(str).str.replace(".0","")
-            df[column] = df[column].astype(str).str.replace("nan", "NULL")
+            values = df[column].fillna("NULL").astype(str)
+            values = pd.Series(np.where(values.str.endswith(".0"),  # if value ends with .0
+                                        values.str[:-2],  # column without .0
+                                        values),  # normal value
+                               index=df.index)
+            converted[column] = values.str.replace("nan", "NULL")
         except:
             print(f"Preprocessing Problem for columns {column} during anonymization")
-    return df
+    return pd.DataFrame({column: converted.get(column, df[column]) for column in df.columns}, copy=False)
+
+
+def hierarchy_arguments(hierarchy_dir):
+    """Jar arguments for reusing the generalization hierarchies saved in HIERARCHY_DIR.  The jar only rebuilds
+    hierarchies that are missing or do not cover the values of the data, and saves them to HIERARCHY_DIR."""
+    if hierarchy_dir is None:
+        return []
+    Path(hierarchy_dir).mkdir(parents=True, exist_ok=True)
+    return ["--hierarchies", os.path.abspath(hierarchy_dir)]
+
+
+def warm_start_arguments(warm_start_dir, lineage):
+    """Jar arguments for starting from the optimum persisted in WARM_START_DIR
+    for the dataset LINEAGE, e.g. the monthly refreshes of one cohort."""
+    if warm_start_dir is None:
+        return []
+    return ["--warm_start", os.path.abspath(warm_start_dir), "--lineage", lineage]
+
+
+def print_progress(event):
+    """Default progress callback, prints every event except the fine-grained search progress."""
+    if event["event"] == "search":
+        if round(event["progress"] * 100) % 10 == 0:
+            print(f"ARX search {event['progress']:.0%} after {event['elapsed_ms'] / 1000:.1f} s.")
+    else:
+        details = ", ".join(f"{key}={value}" for key, value in event.items() if key not in ("event", "elapsed_ms"))
+        print(f"ARX {event['event']} after {event['elapsed_ms'] / 1000:.1f} s: {details}")
+
+
+def java_command(arguments, max_heap=None):
+    """Command running the ucc_anonymization.jar with ARGUMENTS, with the heap limited to MAX_HEAP bytes."""
+    jar_location = join(dirname(__file__), 'ucc_anonymization.jar')
+    heap_arguments = [] if max_heap is None else [f"-Xmx{max(int(max_heap) // 2 ** 20, 64)}m"]
+    return ["java"] + heap_arguments + ["-jar", f"{jar_location}"] + arguments
+
+
+def _handle_output(line, progress_callback):
+    if line.startswith(PROGRESS_PREFIX):
+        progress_callback(json.loads(line[len(PROGRESS_PREFIX):]))
+    else:
+        print(line, end="")
+
+
+class JarServer:
+    """The ucc_anonymization.jar in server mode: one JVM runs the
+    anonymizations one after another, so the start-up of the JVM, the warm-up
+    of its JIT compiler and the generalization hierarchies are shared by the
+    runs.  The heap of the JVM is fixed when it starts, a JVM that died (e.g.
+    out of memory) is restarted by the next run."""
+
+    def __init__(self, max_heap=None):
+        self.max_heap = max_heap
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(java_command(["--server"], self.max_heap), stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def run(self, arguments, progress_callback):
+        """Run the jar with ARGUMENTS, see run_jar."""
+        if any("\t" in argument or "\n" in argument for argument in arguments):
+            raise ValueError(f"The arguments of the jar server must not contain tabs or line breaks: {arguments}")
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        self.process.stdin.write("\t".join(arguments) + "\n")
+        self.process.stdin.flush()
+        for line in self.process.stdout:
+            if line.startswith(SERVER_DONE_PREFIX):
+                status = int(line[len(SERVER_DONE_PREFIX):])
+                if status != 0:
+                    raise subprocess.CalledProcessError(status, arguments)
+                return
+            _handle_output(line, progress_callback)
+        # the JVM exited during the run
+        raise subprocess.CalledProcessError(self.process.wait(), arguments)
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+        self.process = None
+
+
+def start_jar_server(max_heap=None):
+    """Run all anonymizations of this process in one JarServer, whose JVM is
+    started by the first anonymization.  MAX_HEAP then limits the heap of all
+    of them, the MAX_HEAP of the single runs is ignored."""
+    global _JAR_SERVER
+    if _JAR_SERVER is None:
+        _JAR_SERVER = JarServer(max_heap)
+        atexit.register(stop_jar_server)
+    return _JAR_SERVER
+
+
+def stop_jar_server():
+    global _JAR_SERVER
+    if _JAR_SERVER is not None:
+        _JAR_SERVER.close()
+        _JAR_SERVER = None
+
+
+def run_jar(arguments, time_limit=None, progress_callback=None, max_heap=None):
+    """Run the ucc_anonymization.jar with ARGUMENTS.  With a TIME_LIMIT in seconds,
+    the jar returns the best anonymization found within the budget.  The
+    progress events of the jar (search progress, loss of the found
+    transformation once the search is done, local recoding iterations) are passed as dictionaries to
+    PROGRESS_CALLBACK while the jar is running.  MAX_HEAP limits the heap of
+    the JVM to the given number of bytes, by default the JVM takes a quarter of
+    the physical memory.  After start_jar_server, the jar server of the
+    process runs the jar instead of a new JVM."""
+    if progress_callback is None:
+        progress_callback = print_progress
+    if time_limit is not None:
+        arguments = arguments + ["--time_limit", str(time_limit)]
+    if _JAR_SERVER is not None:
+        _JAR_SERVER.run(arguments, progress_callback)
+        return
+
+    command = java_command(arguments, max_heap)
+    with subprocess.Popen(command, stdout=subprocess.PIPE, text=True, bufsize=1) as process:
+        for line in process.stdout:
+            _handle_output(line, progress_callback)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
 
 
-def run_anonymization(anon_input_file, anon_output_file, anon_type:MEDICAL_SCORE):
+def run_anonymization(anon_input_file, anon_output_file, anon_type:MEDICAL_SCORE, hierarchy_dir=None,
+                      time_limit=None, progress_callback=None, warm_start_dir=None, lineage="default",
+                      max_heap=None):
     """
     Executes a subprocess to anonymize the input file and saves the result in the output file
     :param anon_type:
     :param anon_input_file: filepath to the preprocessed highmed cardio dataset
     :param anon_output_file: filepath to where the anonymized data should be saved to
+    :param hierarchy_dir: directory of saved generalization hierarchies to reuse, None to build them
+    :param time_limit: wall-clock budget in seconds, None for no limit
+    :param progress_callback: function called with every progress event of the jar, see run_jar
+    :param warm_start_dir: directory of persisted optima, None for a full search
+    :param lineage: name of the dataset lineage whose previous optimum is verified first
+    :param max_heap: maximum heap size of the JVM in bytes, None for the JVM default
     """
     if not os.path.isabs(anon_input_file):
         anon_input_file = os.path.join(os.getcwd(), anon_input_file.lstrip("./"))
     if not os.path.isabs(anon_output_file):
         anon_output_file = os.path.join(os.getcwd(), anon_output_file.lstrip("./"))
 
-    jar_location = join(dirname(__file__), 'ucc_anonymization.jar')
-
-    subprocess.run(["java",
-                    "-jar", f"{jar_location}",
-                    f"--{anon_type.value}",
-                    "-i", f"{anon_input_file}",
-                    "-o", f"{anon_output_file}"])
+    run_jar([f"--{anon_type.value}",
+             "-i", f"{anon_input_file}",
+             "-o", f"{anon_output_file}"] + hierarchy_arguments(hierarchy_dir)
+            + warm_start_arguments(warm_start_dir, lineage),
+            time_limit=time_limit, progress_callback=progress_callback, max_heap=max_heap)
 
     print("Anonymization statistics:")
     print(pd.read_csv(anon_output_file.replace(".csv", "_stats.csv"), sep=";", decimal=","))
@@ -76,22 +224,110 @@ def run_anonymization(anon_input_file, anon_output_file, anon_type:MEDICAL_SCORE
     return pd.read_csv(anon_output_file)
 
 
+def read_anonymization_stats(stats_file):
+    stats = pd.read_csv(stats_file, sep=";", decimal=",", skipinitialspace=True)
+    stats.columns = stats.columns.str.strip()
+    return stats
+
+
+def run_anonymization_sweep(anon_input_file, anon_output_file, grid_file, anon_type: MEDICAL_SCORE,
+                            hierarchy_dir=None, time_limit=None, progress_callback=None):
+    """
+    Executes a single subprocess running all configurations of the sweep grid on the input file
+    :param anon_input_file: filepath to the preprocessed highmed cardio dataset
+    :param anon_output_file: filepath of the anonymized data, configuration i is saved with the suffix _sweep<i>
+    :param grid_file: csv file with the columns SWEEP_COLUMNS
+    :param time_limit: wall-clock budget in seconds per configuration, None for no limit
+    :return: summary table with one row per configuration
+    """
+    anon_input_file, anon_output_file, grid_file = [os.path.abspath(path) for path in
+                                                    [anon_input_file, anon_output_file, grid_file]]
+    run_jar([f"--{anon_type.value}",
+             "-i", f"{anon_input_file}",
+             "-o", f"{anon_output_file}",
+             "--sweep", f"{grid_file}"] + hierarchy_arguments(hierarchy_dir),
+            time_limit=time_limit, progress_callback=progress_callback)
+
+    summary = pd.read_csv(anon_output_file.replace(".csv", "_sweep_summary.csv"), sep=";")
+    summary.columns = summary.columns.str.replace(" ", "_")
+    summary["output_file"] = [anon_output_file.replace(".csv", f"_sweep{i}.csv") for i in summary["configuration"]]
+    return summary.set_index("configuration")
+
+
+def anonymize_ucc_cardio_sweep(df, grid, temp_file="./temp/anon_input.csv", output_file="./temp/anon_output.csv",
+                               anon_type=MEDICAL_SCORE.FULL, hierarchy_dir=None, time_limit=None,
+                               progress_callback=None):
+    """
+    Anonymize the use case cardio dataset with every configuration of GRID in one run of the ucc_anonymization.jar
+    :param df: pandas table with the ucc data, it is not modified
+    :param grid: table or list of rows with the columns SWEEP_COLUMNS (k, suppression limit, metric, step limit)
+    :return: the anonymized data of all configurations in one table with the configuration and its parameters as
+        leading columns, and the summary table per configuration with the mean statistics over the quasi-identifiers
+    """
+    grid = pd.DataFrame(grid, columns=SWEEP_COLUMNS)
+    unknown_metrics = set(grid['metric']) - set(METRICS)
+    if unknown_metrics:
+        raise ValueError(f"Unknown metrics {unknown_metrics}, choose from {METRICS}.")
+
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    grid_file = output_file.replace(".csv", "_sweep_grid.csv")
+    grid.to_csv(grid_file, index=False)
+
+    # only the quasi-identifiers are written, ARX suppresses all other columns anyway
+    temp_data = preprocess_ucc_file(project_columns(df, required_columns(anon_type, "anonymization")))
+    temp_data.to_csv(temp_file, index=True, sep=",", na_rep='NULL')
+
+    summary = run_anonymization_sweep(temp_file, output_file, grid_file, anon_type, hierarchy_dir, time_limit,
+                                      progress_callback)
+
+    releases = []
+    for configuration, row in summary.iterrows():
+        stats = read_anonymization_stats(row["output_file"].replace(".csv", "_stats.csv"))
+        for statistic in ["result granularity", "result missings", "result non-uniform entropy"]:
+            summary.loc[configuration, f"mean_{statistic.replace(' ', '_')}"] = stats[statistic].mean()
+        release = pd.read_csv(row["output_file"])
+        release.insert(0, "configuration", configuration)
+        for position, column in enumerate(SWEEP_COLUMNS):
+            release.insert(position + 1, column, row[column])
+        releases.append(release)
+
+    print("Anonymization sweep:")
+    print(summary.drop(columns="output_file"))
+
+    if DELETE_TEMP:
+        os.remove(temp_file)
+
+    return pd.concat(releases, ignore_index=True), summary
+
+
 def anonymize_ucc_cardio_data(df, temp_file="./temp/anon_input.csv", output_file="./temp/anon_output.csv",
-                              anon_type=MEDICAL_SCORE.FULL):
+                              anon_type=MEDICAL_SCORE.FULL, hierarchy_dir=None, time_limit=None,
+                              progress_callback=None, warm_start_dir=None, lineage="default", max_heap=None):
     """
     Method to anonymize the use case cardio dataset using the ucc_anonymization.jar
-    :param df: pandas table with the ucc data
+    :param df: pandas table with the ucc data, it is not modified; only the quasi-identifiers of anon_type are
+        anonymized and returned, the other columns would be suppressed
     :param temp_file: filepath to a temporary file, that is preprocessed for the anonymization
     :param output_file: filepath to the anonymized use case cardio csv-file
+    :param hierarchy_dir: directory of saved generalization hierarchies to reuse, None to build them
+    :param time_limit: wall-clock budget in seconds, the best anonymization found within it is returned
+    :param progress_callback: function called with every progress event of the jar, see run_jar
+    :param warm_start_dir: directory of persisted optima; the optimum of the previous run of LINEAGE in this mode is
+        verified first and the full search only runs if it no longer satisfies the privacy model
+    :param lineage: name of the dataset lineage, e.g. the cohort name
+    :param max_heap: maximum heap size of the JVM in bytes, None for the JVM default
     """
 
     output_dir = os.path.dirname(os.path.abspath(output_file))
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
-    temp_data = preprocess_ucc_file(df)
+    # only the quasi-identifiers are written, ARX suppresses all other columns anyway
+    temp_data = preprocess_ucc_file(project_columns(df, required_columns(anon_type, "anonymization")))
     temp_data.to_csv(temp_file, index=True, sep=",", na_rep='NULL')
 
-    anonymized_data = run_anonymization(temp_file, output_file, anon_type)
+    anonymized_data = run_anonymization(temp_file, output_file, anon_type, hierarchy_dir, time_limit,
+                                        progress_callback, warm_start_dir, lineage, max_heap)
 
     if DELETE_TEMP:
         os.remove(temp_file)
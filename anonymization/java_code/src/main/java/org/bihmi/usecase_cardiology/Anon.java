@@ -17,16 +17,22 @@
 package org.bihmi.usecase_cardiology;
 
 import org.deidentifier.arx.*;
+import org.deidentifier.arx.ARXLattice.ARXNode;
 import org.deidentifier.arx.AttributeType.Hierarchy;
 import org.deidentifier.arx.AttributeType.Hierarchy.DefaultHierarchy;
 import org.deidentifier.arx.aggregates.HierarchyBuilderIntervalBased;
 import org.deidentifier.arx.aggregates.HierarchyBuilderIntervalBased.Range;
 import org.deidentifier.arx.criteria.KAnonymity;
 import org.deidentifier.arx.exceptions.RollbackRequiredException;
-import org.deidentifier.arx.metric.Metric;
 
+import java.io.BufferedWriter;
+import java.io.File;
+import java.io.FileWriter;
 import java.io.IOException;
 import java.util.Arrays;
+import java.util.List;
+import java.util.Locale;
+import java.util.Map;
 
 /**
  * Implements all anonymization processes, code was adapted from: <a href="https://github.com/BIH-MI/leoss-puf">LEOSS Repository</a>
@@ -36,113 +42,112 @@ import java.util.Arrays;
  */
 public class Anon {
 
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_AGE;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_GENDER;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_BMI;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_SYS_BP_M;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_NYHA;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_SMOKING;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_DIABETES;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_COPD;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_HF_GT_18;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_BETA;
+    /** Share of the time budget available to the heuristic search, the rest is used for local recoding */
+    private static final double SEARCH_BUDGET_SHARE = 0.5d;
 
     /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_FUROSEMIDE1;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_STATIN;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_ACEI_ARB;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_LVEF_M;
-    /**
-     * Transformation rule
-     */
-    private static Hierarchy RULE_CREATININE_M;
+     * Result of one anonymization run
+     *
+     * @param output         anonymized data
+     * @param optimum        global optimum of the search
+     * @param transformation generalization levels of the global optimum
+     * @param runtimeMillis  runtime of the search and the local recoding
+     */
+    public record AnonymizationResult(DataHandle output, ARXNode optimum, int[] transformation, long runtimeMillis) {
+
+        /**
+         * Number of suppressed records
+         *
+         * @return
+         */
+        public int getNumberOfSuppressedRecords() {
+            int suppressed = 0;
+            for (int row = 0; row < output.getNumRows(); row++) {
+                if (output.isOutlier(row)) {
+                    suppressed++;
+                }
+            }
+            return suppressed;
+        }
+
+        /**
+         * Share of suppressed records
+         *
+         * @return
+         */
+        public double getSuppressedShare() {
+            return output.getNumRows() == 0 ? 0d : (double) getNumberOfSuppressedRecords() / output.getNumRows();
+        }
+    }
+
     /**
-     * Transformation rule
+     * Anonymization for Use Case Cardiology HiGHmed Cardio Dataset
+     *
+     * @param data
+     * @return
+     * @throws IOException
      */
-    private static Hierarchy RULE_SODIUM_M;
+    public static DataHandle anonymizeUseCaseCardio(Data data, AnonymizationMode mode) throws IOException {
+        return anonymizeUseCaseCardio(data, mode, HierarchySet.create(data));
+    }
+
     /**
-     * Transformation rule
+     * Anonymization for Use Case Cardiology HiGHmed Cardio Dataset with given hierarchies
+     *
+     * @param data
+     * @param mode
+     * @param hierarchies
+     * @return
+     * @throws IOException
      */
-    private static Hierarchy RULE_HB_M;
+    public static DataHandle anonymizeUseCaseCardio(Data data, AnonymizationMode mode, HierarchySet hierarchies) throws IOException {
+        return anonymizeUseCaseCardio(data, mode, hierarchies, AnonymizationParameters.DEFAULT);
+    }
+
     /**
-     * Transformation rule
+     * Anonymization for Use Case Cardiology HiGHmed Cardio Dataset with given hierarchies and parameters
+     *
+     * @param data
+     * @param mode
+     * @param hierarchies
+     * @param parameters
+     * @return
+     * @throws IOException
      */
-    private static Hierarchy RULE_EGFR_M;
-
-    private static void createHierarchies(Data data) {
-
-        RULE_AGE = getAgeHierarchy(data);
-        RULE_GENDER = getGenderHierarchy();
-        RULE_BMI = getBMIHierarchy(data);
-        RULE_SYS_BP_M = getSysBpMHierarchy(data);
-        RULE_NYHA = getNyhaHierarchy();
-        RULE_SMOKING = getSmokingHierarchy();
-        RULE_DIABETES = getDiabetesHierarchy();
-        RULE_COPD = getCopdHierarchy();
-        RULE_HF_GT_18 = getHfGt18Hierarchy();
-        RULE_BETA = getBetaHierarchy();
-        RULE_FUROSEMIDE1 = getFurosemide1Hierarchy();
-        RULE_STATIN = getStatinHierarchy();
-        RULE_ACEI_ARB = getAceiArbHierarchy();
-        RULE_LVEF_M = getLvefMHierarchy(data);
-        RULE_CREATININE_M = getCreatinineMHierarchy(data);
-        RULE_SODIUM_M = getSodiumMHierarchy(data);
-        RULE_HB_M = getHbMHierarchy(data);
-        RULE_EGFR_M = getEgrfMHierarchy(data);
-
+    public static DataHandle anonymizeUseCaseCardio(Data data, AnonymizationMode mode, HierarchySet hierarchies,
+                                                    AnonymizationParameters parameters) throws IOException {
+        return anonymizeUseCaseCardio(data, mode, hierarchies, parameters, null);
     }
 
     /**
-     * Anonymization for Use Case Cardiology HiGHmed Cardio Dataset
+     * Anonymization for Use Case Cardiology HiGHmed Cardio Dataset, starting from a persisted optimum
      *
      * @param data
+     * @param mode
+     * @param hierarchies
+     * @param parameters
+     * @param warmStart   persisted optimum of the lineage, or null for a full search
      * @return
      * @throws IOException
      */
-    public static DataHandle anonymizeUseCaseCardio(Data data, AnonymizationMode mode) throws IOException {
+    public static DataHandle anonymizeUseCaseCardio(Data data, AnonymizationMode mode, HierarchySet hierarchies,
+                                                    AnonymizationParameters parameters, WarmStart warmStart) throws IOException {
+        prepareUseCaseCardio(data, mode, hierarchies);
+        if (warmStart == null) {
+            return anonymize(data, parameters).output();
+        }
+        return anonymize(data, parameters, warmStart).output();
+    }
 
-        createHierarchies(data);
+    /**
+     * Defines the attribute types with the given hierarchies, required once before one or more calls of
+     * {@link #anonymize(Data, AnonymizationParameters)}
+     *
+     * @param data
+     * @param mode
+     * @param hierarchies hierarchies covering the values of data
+     */
+    public static void prepareUseCaseCardio(Data data, AnonymizationMode mode, HierarchySet hierarchies) {
 
         // Define all as identifying attributes
         for (int i = 0; i < data.getHandle().getNumColumns(); i++) {
@@ -151,112 +156,289 @@ public class Anon {
 
         // Define quasi-identifiers
         switch (mode) {
-            case MAGGIC -> data = define_quasiidentifiers_maggic(data);
-            case BIO_HF -> data = define_quasiidentifiers_biohf(data);
-            case FULL -> data = define_quasiidentifiers_full(data);
-            default -> data = define_quasiidentifiers_full(data);
+            case MAGGIC -> define_quasiidentifiers_maggic(data, hierarchies);
+            case BIO_HF -> define_quasiidentifiers_biohf(data, hierarchies);
+            case FULL -> define_quasiidentifiers_full(data, hierarchies);
+            default -> define_quasiidentifiers_full(data, hierarchies);
         }
+    }
+
+    /**
+     * Anonymizes prepared data with the given parameters
+     *
+     * @param data       data prepared with {@link #prepareUseCaseCardio(Data, AnonymizationMode, HierarchySet)}
+     * @param parameters
+     * @return
+     * @throws IOException
+     */
+    public static AnonymizationResult anonymize(Data data, AnonymizationParameters parameters) throws IOException {
+
+        Progress progress = new Progress();
 
         // Prepare config
         ARXConfiguration config = ARXConfiguration.create();
 
         // Configure transformation model
-        config.setSuppressionLimit(1d);
-        config.addPrivacyModel(new KAnonymity(2));
-        config.setQualityModel(Metric.createLossMetric(0, Metric.AggregateFunction.GEOMETRIC_MEAN));
+        config.setSuppressionLimit(parameters.suppressionLimit);
+        config.addPrivacyModel(new KAnonymity(parameters.k));
+        config.setQualityModel(parameters.createMetric());
         config.setAlgorithm(ARXConfiguration.AnonymizationAlgorithm.BEST_EFFORT_BOTTOM_UP);
-        config.setHeuristicSearchStepLimit(50000);
+        config.setHeuristicSearchStepLimit(parameters.stepLimit);
+        if (parameters.timeLimitMillis > 0) {
+            // the remaining budget is used for local recoding
+            config.setHeuristicSearchTimeLimit(Math.max(1, (int) (parameters.timeLimitMillis * SEARCH_BUDGET_SHARE)));
+        }
 
-        // Anonymize
+        // Anonymize. ARX only reports the completed share of the search to the listener, the optimum and its loss
+        // are not accessible before the search has finished and are reported by search_done
         ARXAnonymizer anonymizer = new ARXAnonymizer();
+        anonymizer.setListener(new ARXListener() {
+            private int reported = -1;
+
+            @Override
+            public void progress(double value) {
+                int percent = (int) (value * 100d);
+                if (percent > reported) {
+                    reported = percent;
+                    progress.report("search", "progress", value);
+                }
+            }
+        });
         ARXResult result = anonymizer.anonymize(data, config);
+        if (result.getGlobalOptimum() == null) {
+            throw new IllegalStateException("No transformation satisfying the privacy model was found within the limits");
+        }
+
+        int[] transformation = result.getGlobalOptimum().getTransformation();
+        progress.report("search_done",
+                "transformation", transformation,
+                "loss", result.getGlobalOptimum().getHighestScore().toString());
 
         DataHandle output = result.getOutput();
         double oMin = 1d / 1000d;
         try {
-
-            result.optimizeIterativeFast(output, oMin);
+            if (parameters.timeLimitMillis > 0) {
+                // Iterate local recoding as optimizeIterativeFast does, but stop when the budget is exhausted
+                int iteration = 0;
+                int optimized = Integer.MAX_VALUE;
+                while (result.isOptimizable(output) && optimized > 0 &&
+                        progress.elapsedMillis() < parameters.timeLimitMillis) {
+                    optimized = result.optimizeFast(output, oMin);
+                    iteration++;
+                    progress.report("local_recoding", "iteration", iteration, "optimized_records", optimized);
+                }
+            } else {
+                result.optimizeIterativeFast(output, oMin);
+            }
         } catch (RollbackRequiredException e) {
             e.printStackTrace();
         }
 
-        System.out.println(Arrays.toString(result.getGlobalOptimum().getTransformation()));
+        System.out.println(Arrays.toString(transformation));
+        progress.report("done", "transformation", transformation);
 
         // Done
-        return output;
+        return new AnonymizationResult(output, result.getGlobalOptimum(), transformation, progress.elapsedMillis());
+    }
+
+    /**
+     * Anonymizes prepared data, starting from the optimum of a previous run of the same lineage. The previous
+     * optimum is verified first by restricting the search to that single transformation. It is kept if it
+     * satisfies the privacy model and suppresses at most {@link WarmStart#SUPPRESSION_TOLERANCE} more records than
+     * in the run that found it, otherwise the full search is run and its optimum is persisted.
+     *
+     * @param data       data prepared with {@link #prepareUseCaseCardio(Data, AnonymizationMode, HierarchySet)}
+     * @param parameters
+     * @param warmStart  persisted optimum of the lineage
+     * @return
+     * @throws IOException
+     */
+    public static AnonymizationResult anonymize(Data data, AnonymizationParameters parameters,
+                                                WarmStart warmStart) throws IOException {
+
+        DataDefinition definition = data.getDefinition();
+        Map<String, Integer> levels = warmStart.loadLevels(parameters, definition.getQuasiIdentifyingAttributes());
+        if (levels != null && !isValid(definition, levels)) {
+            // the hierarchies changed since the previous optimum was found
+            new Progress().report("warm_start", "accepted", false, "suppressed_share", null);
+            levels = null;
+        }
+        if (levels != null) {
+            for (Map.Entry<String, Integer> level : levels.entrySet()) {
+                definition.setMinimumGeneralization(level.getKey(), level.getValue());
+                definition.setMaximumGeneralization(level.getKey(), level.getValue());
+            }
+            AnonymizationResult result = null;
+            try {
+                result = anonymize(data, parameters);
+            } catch (Exception e) {
+                // the previous optimum does not satisfy the privacy model anymore or cannot be applied
+            }
+            if (result != null &&
+                    result.getSuppressedShare() <= warmStart.getSuppressedShare() + WarmStart.SUPPRESSION_TOLERANCE) {
+                new Progress().report("warm_start", "accepted", true, "suppressed_share", result.getSuppressedShare());
+                return result;
+            }
+            new Progress().report("warm_start", "accepted", false,
+                    "suppressed_share", result == null ? null : result.getSuppressedShare());
+
+            // Unlock the definition and open the search space again
+            if (result != null) {
+                result.output().release();
+            }
+            data.getHandle().release();
+            for (String attribute : levels.keySet()) {
+                definition.setMinimumGeneralization(attribute, 0);
+                definition.setMaximumGeneralization(attribute, definition.getHierarchy(attribute)[0].length - 1);
+            }
+        }
+
+        AnonymizationResult result = anonymize(data, parameters);
+        warmStart.save(parameters, result.optimum(), result.getSuppressedShare());
+        return result;
+    }
+
+    /**
+     * Whether the persisted levels are generalization levels of the current hierarchies
+     *
+     * @param definition
+     * @param levels     level per quasi-identifier
+     * @return
+     */
+    private static boolean isValid(DataDefinition definition, Map<String, Integer> levels) {
+        for (Map.Entry<String, Integer> level : levels.entrySet()) {
+            String[][] hierarchy = definition.getHierarchy(level.getKey());
+            if (hierarchy == null || hierarchy.length == 0 ||
+                    level.getValue() < 0 || level.getValue() >= hierarchy[0].length) {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    /**
+     * Runs all configurations of a sweep on the same data. Data and hierarchies are loaded and built once,
+     * the handles are released after each run. For configuration i, the anonymized data and its statistics
+     * are written to the output path with the suffix _sweep[i], a summary of all runs to _sweep_summary.csv.
+     *
+     * @param data
+     * @param mode
+     * @param hierarchies
+     * @param grid   configurations
+     * @param output output path of the anonymized data
+     * @throws IOException
+     */
+    public static void sweepUseCaseCardio(Data data, AnonymizationMode mode, HierarchySet hierarchies,
+                                          List<AnonymizationParameters> grid, String output) throws IOException {
+
+        prepareUseCaseCardio(data, mode, hierarchies);
+
+        File summaryFile = new File(output.replace(".csv", "_sweep_summary.csv"));
+        try (BufferedWriter summary = new BufferedWriter(new FileWriter(summaryFile.getAbsoluteFile()))) {
+            summary.write("configuration;k;suppression limit;metric;step limit;transformation;" +
+                    "suppressed records;runtime ms");
+            summary.newLine();
+
+            for (int i = 0; i < grid.size(); i++) {
+                AnonymizationParameters parameters = grid.get(i);
+                System.out.println("Sweep configuration " + i + ": " + parameters);
+                AnonymizationResult result = anonymize(data, parameters);
+
+                String configOutput = output.replace(".csv", "_sweep" + i + ".csv");
+                IO.writeOutput(Util.getData(result.output()), new File(configOutput));
+                IO.writeStatsOutput(data.getHandle(), result.output(),
+                        new File(configOutput.replace(".csv", "_stats.csv")));
+
+                summary.write(String.format(Locale.ROOT, "%d;%d;%s;%s;%d;%s;%d;%d",
+                        i,
+                        parameters.k,
+                        parameters.suppressionLimit,
+                        parameters.metric,
+                        parameters.stepLimit,
+                        Arrays.toString(result.transformation()),
+                        result.getNumberOfSuppressedRecords(),
+                        result.runtimeMillis()));
+                summary.newLine();
+                summary.flush();
+
+                // Unlock the input for the next configuration
+                result.output().release();
+                data.getHandle().release();
+            }
+        }
     }
 
-    private static Data define_quasiidentifiers_maggic(Data data) {
+    private static Data define_quasiidentifiers_maggic(Data data, HierarchySet hierarchies) {
         // Define quasi-identifiers
-        data.getDefinition().setAttributeType(IO.FIELD_AGE, RULE_AGE);
+        data.getDefinition().setAttributeType(IO.FIELD_AGE, hierarchies.get(IO.FIELD_AGE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_AGE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_GENDER, RULE_GENDER);
-        data.getDefinition().setAttributeType(IO.FIELD_BMI, RULE_BMI);
+        data.getDefinition().setAttributeType(IO.FIELD_GENDER, hierarchies.get(IO.FIELD_GENDER));
+        data.getDefinition().setAttributeType(IO.FIELD_BMI, hierarchies.get(IO.FIELD_BMI));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_BMI, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_SYS_BLOODPREASURE_MEASURE, RULE_SYS_BP_M);
+        data.getDefinition().setAttributeType(IO.FIELD_SYS_BLOODPREASURE_MEASURE, hierarchies.get(IO.FIELD_SYS_BLOODPREASURE_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_SYS_BLOODPREASURE_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_NYHA, RULE_NYHA);
-        data.getDefinition().setAttributeType(IO.FIELD_SMOKING, RULE_SMOKING);
-        data.getDefinition().setAttributeType(IO.FIELD_DIABETES, RULE_DIABETES);
-        data.getDefinition().setAttributeType(IO.FIELD_COPD, RULE_COPD);
-        data.getDefinition().setAttributeType(IO.FIELD_HEARTFAILURE_LONGER_18MONTH, RULE_HF_GT_18);
-        data.getDefinition().setAttributeType(IO.FIELD_BETA, RULE_BETA);
-        data.getDefinition().setAttributeType(IO.FIELD_ACEI_ARB, RULE_ACEI_ARB);
-        data.getDefinition().setAttributeType(IO.FIELD_LVEF_MEASURE, RULE_LVEF_M);
+        data.getDefinition().setAttributeType(IO.FIELD_NYHA, hierarchies.get(IO.FIELD_NYHA));
+        data.getDefinition().setAttributeType(IO.FIELD_SMOKING, hierarchies.get(IO.FIELD_SMOKING));
+        data.getDefinition().setAttributeType(IO.FIELD_DIABETES, hierarchies.get(IO.FIELD_DIABETES));
+        data.getDefinition().setAttributeType(IO.FIELD_COPD, hierarchies.get(IO.FIELD_COPD));
+        data.getDefinition().setAttributeType(IO.FIELD_HEARTFAILURE_LONGER_18MONTH, hierarchies.get(IO.FIELD_HEARTFAILURE_LONGER_18MONTH));
+        data.getDefinition().setAttributeType(IO.FIELD_BETA, hierarchies.get(IO.FIELD_BETA));
+        data.getDefinition().setAttributeType(IO.FIELD_ACEI_ARB, hierarchies.get(IO.FIELD_ACEI_ARB));
+        data.getDefinition().setAttributeType(IO.FIELD_LVEF_MEASURE, hierarchies.get(IO.FIELD_LVEF_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_LVEF_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_CREATININE_MEASURE, RULE_CREATININE_M);
+        data.getDefinition().setAttributeType(IO.FIELD_CREATININE_MEASURE, hierarchies.get(IO.FIELD_CREATININE_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_CREATININE_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
         return data;
     }
 
-    private static Data define_quasiidentifiers_biohf(Data data) {
+    private static Data define_quasiidentifiers_biohf(Data data, HierarchySet hierarchies) {
         // Define quasi-identifiers
-        data.getDefinition().setAttributeType(IO.FIELD_AGE, RULE_AGE);
+        data.getDefinition().setAttributeType(IO.FIELD_AGE, hierarchies.get(IO.FIELD_AGE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_AGE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_GENDER, RULE_GENDER);
-        data.getDefinition().setAttributeType(IO.FIELD_NYHA, RULE_NYHA);
-        data.getDefinition().setAttributeType(IO.FIELD_BETA, RULE_BETA);
-        data.getDefinition().setAttributeType(IO.FIELD_FUROSEMIDE1, RULE_FUROSEMIDE1);
-        data.getDefinition().setAttributeType(IO.FIELD_STATIN, RULE_STATIN);
-        data.getDefinition().setAttributeType(IO.FIELD_ACEI_ARB, RULE_ACEI_ARB);
-        data.getDefinition().setAttributeType(IO.FIELD_LVEF_MEASURE, RULE_LVEF_M);
+        data.getDefinition().setAttributeType(IO.FIELD_GENDER, hierarchies.get(IO.FIELD_GENDER));
+        data.getDefinition().setAttributeType(IO.FIELD_NYHA, hierarchies.get(IO.FIELD_NYHA));
+        data.getDefinition().setAttributeType(IO.FIELD_BETA, hierarchies.get(IO.FIELD_BETA));
+        data.getDefinition().setAttributeType(IO.FIELD_FUROSEMIDE1, hierarchies.get(IO.FIELD_FUROSEMIDE1));
+        data.getDefinition().setAttributeType(IO.FIELD_STATIN, hierarchies.get(IO.FIELD_STATIN));
+        data.getDefinition().setAttributeType(IO.FIELD_ACEI_ARB, hierarchies.get(IO.FIELD_ACEI_ARB));
+        data.getDefinition().setAttributeType(IO.FIELD_LVEF_MEASURE, hierarchies.get(IO.FIELD_LVEF_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_LVEF_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_SODIUM_MEASURE, RULE_SODIUM_M);
+        data.getDefinition().setAttributeType(IO.FIELD_SODIUM_MEASURE, hierarchies.get(IO.FIELD_SODIUM_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_SODIUM_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_HB_MEASURE, RULE_HB_M);
+        data.getDefinition().setAttributeType(IO.FIELD_HB_MEASURE, hierarchies.get(IO.FIELD_HB_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_HB_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_EGFR_MEASURE, RULE_EGFR_M);
+        data.getDefinition().setAttributeType(IO.FIELD_EGFR_MEASURE, hierarchies.get(IO.FIELD_EGFR_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_EGFR_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
         return data;
     }
 
-    private static Data define_quasiidentifiers_full(Data data) {
+    private static Data define_quasiidentifiers_full(Data data, HierarchySet hierarchies) {
         // Define quasi-identifiers
-        data.getDefinition().setAttributeType(IO.FIELD_AGE, RULE_AGE);
+        data.getDefinition().setAttributeType(IO.FIELD_AGE, hierarchies.get(IO.FIELD_AGE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_AGE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_GENDER, RULE_GENDER);
-        data.getDefinition().setAttributeType(IO.FIELD_BMI, RULE_BMI);
+        data.getDefinition().setAttributeType(IO.FIELD_GENDER, hierarchies.get(IO.FIELD_GENDER));
+        data.getDefinition().setAttributeType(IO.FIELD_BMI, hierarchies.get(IO.FIELD_BMI));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_BMI, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_SYS_BLOODPREASURE_MEASURE, RULE_SYS_BP_M);
+        data.getDefinition().setAttributeType(IO.FIELD_SYS_BLOODPREASURE_MEASURE, hierarchies.get(IO.FIELD_SYS_BLOODPREASURE_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_SYS_BLOODPREASURE_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_NYHA, RULE_NYHA);
-        data.getDefinition().setAttributeType(IO.FIELD_SMOKING, RULE_SMOKING);
-        data.getDefinition().setAttributeType(IO.FIELD_DIABETES, RULE_DIABETES);
-        data.getDefinition().setAttributeType(IO.FIELD_COPD, RULE_COPD);
-        data.getDefinition().setAttributeType(IO.FIELD_HEARTFAILURE_LONGER_18MONTH, RULE_HF_GT_18);
-        data.getDefinition().setAttributeType(IO.FIELD_BETA, RULE_BETA);
-        data.getDefinition().setAttributeType(IO.FIELD_FUROSEMIDE1, RULE_FUROSEMIDE1);
-        data.getDefinition().setAttributeType(IO.FIELD_STATIN, RULE_STATIN);
-        data.getDefinition().setAttributeType(IO.FIELD_ACEI_ARB, RULE_ACEI_ARB);
-        data.getDefinition().setAttributeType(IO.FIELD_LVEF_MEASURE, RULE_LVEF_M);
+        data.getDefinition().setAttributeType(IO.FIELD_NYHA, hierarchies.get(IO.FIELD_NYHA));
+        data.getDefinition().setAttributeType(IO.FIELD_SMOKING, hierarchies.get(IO.FIELD_SMOKING));
+        data.getDefinition().setAttributeType(IO.FIELD_DIABETES, hierarchies.get(IO.FIELD_DIABETES));
+        data.getDefinition().setAttributeType(IO.FIELD_COPD, hierarchies.get(IO.FIELD_COPD));
+        data.getDefinition().setAttributeType(IO.FIELD_HEARTFAILURE_LONGER_18MONTH, hierarchies.get(IO.FIELD_HEARTFAILURE_LONGER_18MONTH));
+        data.getDefinition().setAttributeType(IO.FIELD_BETA, hierarchies.get(IO.FIELD_BETA));
+        data.getDefinition().setAttributeType(IO.FIELD_FUROSEMIDE1, hierarchies.get(IO.FIELD_FUROSEMIDE1));
+        data.getDefinition().setAttributeType(IO.FIELD_STATIN, hierarchies.get(IO.FIELD_STATIN));
+        data.getDefinition().setAttributeType(IO.FIELD_ACEI_ARB, hierarchies.get(IO.FIELD_ACEI_ARB));
+        data.getDefinition().setAttributeType(IO.FIELD_LVEF_MEASURE, hierarchies.get(IO.FIELD_LVEF_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_LVEF_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_CREATININE_MEASURE, RULE_CREATININE_M);
+        data.getDefinition().setAttributeType(IO.FIELD_CREATININE_MEASURE, hierarchies.get(IO.FIELD_CREATININE_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_CREATININE_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_SODIUM_MEASURE, RULE_SODIUM_M);
+        data.getDefinition().setAttributeType(IO.FIELD_SODIUM_MEASURE, hierarchies.get(IO.FIELD_SODIUM_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_SODIUM_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_HB_MEASURE, RULE_HB_M);
+        data.getDefinition().setAttributeType(IO.FIELD_HB_MEASURE, hierarchies.get(IO.FIELD_HB_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_HB_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
-        data.getDefinition().setAttributeType(IO.FIELD_EGFR_MEASURE, RULE_EGFR_M);
+        data.getDefinition().setAttributeType(IO.FIELD_EGFR_MEASURE, hierarchies.get(IO.FIELD_EGFR_MEASURE));
         data.getDefinition().setMicroAggregationFunction(IO.FIELD_EGFR_MEASURE, AttributeType.MicroAggregationFunction.createGeometricMean(), true);
         return data;
     }
@@ -266,7 +448,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getBinaryHierarchy() {
+    static Hierarchy getBinaryHierarchy() {
         DefaultHierarchy hierarchy = Hierarchy.create();
         hierarchy.add("0", "*");
         hierarchy.add("1", "*");
@@ -279,7 +461,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getAgeHierarchy(Data data) {
+    static Hierarchy getAgeHierarchy(Data data) {
 
         HierarchyBuilderIntervalBased<Double> hierarchyBuilder = HierarchyBuilderIntervalBased.create(
                 DataType.DECIMAL,
@@ -304,7 +486,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getGenderHierarchy() {
+    static Hierarchy getGenderHierarchy() {
         DefaultHierarchy hierarchy = Hierarchy.create();
         hierarchy.add("NULL");
         hierarchy.add("f");
@@ -317,7 +499,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getBMIHierarchy(Data data) {
+    static Hierarchy getBMIHierarchy(Data data) {
 
         HierarchyBuilderIntervalBased<Double> hierarchyBuilder = HierarchyBuilderIntervalBased.create(
                 DataType.DECIMAL,
@@ -348,7 +530,7 @@ public class Anon {
      *
      * @return Systolic Blood Preasure hierarchy
      */
-    private static Hierarchy getSysBpMHierarchy(Data data) {
+    static Hierarchy getSysBpMHierarchy(Data data) {
 
         HierarchyBuilderIntervalBased<Long> hierarchyBuilder = HierarchyBuilderIntervalBased.create(
                 DataType.INTEGER,
@@ -374,7 +556,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getNyhaHierarchy() {
+    static Hierarchy getNyhaHierarchy() {
         DefaultHierarchy hierarchy = Hierarchy.create();
         hierarchy.add("I", "{I,II}");
         hierarchy.add("II", "{I,II}");
@@ -389,7 +571,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getSmokingHierarchy() {
+    static Hierarchy getSmokingHierarchy() {
         return getBinaryHierarchy();
     }
 
@@ -398,7 +580,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getDiabetesHierarchy() {
+    static Hierarchy getDiabetesHierarchy() {
         return getBinaryHierarchy();
     }
 
@@ -407,7 +589,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getCopdHierarchy() {
+    static Hierarchy getCopdHierarchy() {
         return getBinaryHierarchy();
     }
 
@@ -416,7 +598,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getBetaHierarchy() {
+    static Hierarchy getBetaHierarchy() {
         return getBinaryHierarchy();
     }
 
@@ -425,7 +607,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getFurosemide1Hierarchy() {
+    static Hierarchy getFurosemide1Hierarchy() {
         return getBinaryHierarchy();
     }
 
@@ -434,7 +616,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getHfGt18Hierarchy() {
+    static Hierarchy getHfGt18Hierarchy() {
         return getBinaryHierarchy();
     }
 
@@ -443,7 +625,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getStatinHierarchy() {
+    static Hierarchy getStatinHierarchy() {
         return getBinaryHierarchy();
     }
 
@@ -452,7 +634,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getAceiArbHierarchy() {
+    static Hierarchy getAceiArbHierarchy() {
         return getBinaryHierarchy();
     }
 
@@ -461,7 +643,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getLvefMHierarchy(Data data) {
+    static Hierarchy getLvefMHierarchy(Data data) {
 
         HierarchyBuilderIntervalBased<Double> hierarchyBuilder = HierarchyBuilderIntervalBased.create(
                 DataType.DECIMAL,
@@ -489,7 +671,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getCreatinineMHierarchy(Data data) {
+    static Hierarchy getCreatinineMHierarchy(Data data) {
         HierarchyBuilderIntervalBased<Double> hierarchyBuilder = HierarchyBuilderIntervalBased.create(
                 DataType.DECIMAL,
                 new Range<Double>(0d, 0d, 0d),
@@ -512,7 +694,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getSodiumMHierarchy(Data data) {
+    static Hierarchy getSodiumMHierarchy(Data data) {
 
         HierarchyBuilderIntervalBased<Double> hierarchyBuilder = HierarchyBuilderIntervalBased.create(
                 DataType.DECIMAL,
@@ -538,7 +720,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getHbMHierarchy(Data data) {
+    static Hierarchy getHbMHierarchy(Data data) {
 
         HierarchyBuilderIntervalBased<Double> hierarchyBuilder = HierarchyBuilderIntervalBased.create(
                 DataType.DECIMAL,
@@ -564,7 +746,7 @@ public class Anon {
      *
      * @return
      */
-    private static Hierarchy getEgrfMHierarchy(Data data) {
+    static Hierarchy getEgrfMHierarchy(Data data) {
 
         HierarchyBuilderIntervalBased<Double> hierarchyBuilder = HierarchyBuilderIntervalBased.create(
                 DataType.DECIMAL,
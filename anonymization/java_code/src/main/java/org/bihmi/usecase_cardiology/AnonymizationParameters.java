@@ -0,0 +1,127 @@
+/**
+ * Use Case Cardiology HiGHmed Data Anonymisation
+ * Copyright (C) 2024 - Berlin Institute of Health
+ * <p>
+ * Licensed under the Academic Free License v3.0;
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ * <p>
+ * https://license.md/licenses/academic-free-license-v3-0/
+ * <p>
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.bihmi.usecase_cardiology;
+
+import org.deidentifier.arx.metric.Metric;
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileReader;
+import java.io.IOException;
+import java.util.ArrayList;
+import java.util.List;
+
+/**
+ * Parameters of one anonymization run: privacy model, suppression limit, quality model and search limit.
+ * A sweep grid is a csv file with the header <code>k,suppression_limit,metric,step_limit</code> and one
+ * configuration per line.
+ */
+public class AnonymizationParameters {
+
+    /** Header of a sweep grid file */
+    public static final String GRID_HEADER = "k,suppression_limit,metric,step_limit";
+
+    /** Parameters of the default anonymization */
+    public static final AnonymizationParameters DEFAULT = new AnonymizationParameters(2, 1d, "loss", 50000);
+
+    /** k of the k-anonymity privacy model */
+    public final int k;
+    /** Maximal share of suppressed records */
+    public final double suppressionLimit;
+    /** Name of the quality model, see {@link #createMetric()} */
+    public final String metric;
+    /** Step limit of the heuristic search */
+    public final int stepLimit;
+    /** Wall-clock budget of search and local recoding in milliseconds, 0 for none */
+    public final int timeLimitMillis;
+
+    public AnonymizationParameters(int k, double suppressionLimit, String metric, int stepLimit) {
+        this(k, suppressionLimit, metric, stepLimit, 0);
+    }
+
+    public AnonymizationParameters(int k, double suppressionLimit, String metric, int stepLimit, int timeLimitMillis) {
+        this.k = k;
+        this.suppressionLimit = suppressionLimit;
+        this.metric = metric;
+        this.stepLimit = stepLimit;
+        this.timeLimitMillis = timeLimitMillis;
+        createMetric();
+    }
+
+    /**
+     * Same parameters with a wall-clock budget
+     *
+     * @param timeLimitMillis budget in milliseconds, 0 for none
+     * @return
+     */
+    public AnonymizationParameters withTimeLimit(int timeLimitMillis) {
+        return new AnonymizationParameters(k, suppressionLimit, metric, stepLimit, timeLimitMillis);
+    }
+
+    /**
+     * Quality model by name
+     *
+     * @return
+     */
+    public Metric<?> createMetric() {
+        return switch (metric) {
+            case "loss" -> Metric.createLossMetric(0, Metric.AggregateFunction.GEOMETRIC_MEAN);
+            case "entropy" -> Metric.createEntropyMetric();
+            case "precision" -> Metric.createPrecisionMetric();
+            case "height" -> Metric.createHeightMetric();
+            case "aecs" -> Metric.createAECSMetric();
+            case "discernability" -> Metric.createDiscernabilityMetric();
+            default -> throw new IllegalArgumentException("Unknown metric " + metric +
+                    ", choose one of loss, entropy, precision, height, aecs, discernability");
+        };
+    }
+
+    /**
+     * Read a sweep grid
+     *
+     * @param gridFile csv file with one configuration per line
+     * @return configurations in file order
+     * @throws IOException
+     */
+    public static List<AnonymizationParameters> loadGrid(File gridFile) throws IOException {
+        List<AnonymizationParameters> grid = new ArrayList<>();
+        try (BufferedReader reader = new BufferedReader(new FileReader(gridFile))) {
+            String header = reader.readLine();
+            if (header == null || !header.trim().equals(GRID_HEADER)) {
+                throw new IOException("Sweep grid " + gridFile + " must start with the header " + GRID_HEADER);
+            }
+            String line;
+            while ((line = reader.readLine()) != null) {
+                if (line.isBlank()) {
+                    continue;
+                }
+                String[] values = line.split(",");
+                grid.add(new AnonymizationParameters(Integer.parseInt(values[0].trim()),
+                        Double.parseDouble(values[1].trim()),
+                        values[2].trim(),
+                        Integer.parseInt(values[3].trim())));
+            }
+        }
+        return grid;
+    }
+
+    @Override
+    public String toString() {
+        return String.format("k=%d, suppression limit=%s, metric=%s, step limit=%d, time limit=%d ms",
+                k, suppressionLimit, metric, stepLimit, timeLimitMillis);
+    }
+}
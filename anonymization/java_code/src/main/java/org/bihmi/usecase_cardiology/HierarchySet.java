@@ -0,0 +1,208 @@
+/**
+ * Use Case Cardiology HiGHmed Data Anonymisation
+ * Copyright (C) 2024 - Berlin Institute of Health
+ * <p>
+ * Licensed under the Academic Free License v3.0;
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ * <p>
+ * https://license.md/licenses/academic-free-license-v3-0/
+ * <p>
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.bihmi.usecase_cardiology;
+
+import org.deidentifier.arx.AttributeType.Hierarchy;
+import org.deidentifier.arx.Data;
+import org.deidentifier.arx.DataHandle;
+
+import java.io.File;
+import java.io.IOException;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.HashSet;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.Set;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.function.Function;
+
+/**
+ * Generalization hierarchies of one anonymization. Hierarchies are immutable once built and can be shared:
+ * built hierarchies are cached in memory by attribute and domain (the distinct values of the column), and a set
+ * can be saved to and loaded from a directory with one csv file per attribute.
+ */
+public class HierarchySet {
+
+    /** Delimiter of the hierarchy files, the interval labels contain commas */
+    private static final char DELIMITER = ';';
+
+    /** Builders of all hierarchies by attribute */
+    private static final Map<String, Function<Data, Hierarchy>> BUILDERS = new LinkedHashMap<>();
+
+    static {
+        BUILDERS.put(IO.FIELD_AGE, Anon::getAgeHierarchy);
+        BUILDERS.put(IO.FIELD_GENDER, data -> Anon.getGenderHierarchy());
+        BUILDERS.put(IO.FIELD_BMI, Anon::getBMIHierarchy);
+        BUILDERS.put(IO.FIELD_SYS_BLOODPREASURE_MEASURE, Anon::getSysBpMHierarchy);
+        BUILDERS.put(IO.FIELD_NYHA, data -> Anon.getNyhaHierarchy());
+        BUILDERS.put(IO.FIELD_SMOKING, data -> Anon.getSmokingHierarchy());
+        BUILDERS.put(IO.FIELD_DIABETES, data -> Anon.getDiabetesHierarchy());
+        BUILDERS.put(IO.FIELD_COPD, data -> Anon.getCopdHierarchy());
+        BUILDERS.put(IO.FIELD_HEARTFAILURE_LONGER_18MONTH, data -> Anon.getHfGt18Hierarchy());
+        BUILDERS.put(IO.FIELD_BETA, data -> Anon.getBetaHierarchy());
+        BUILDERS.put(IO.FIELD_FUROSEMIDE1, data -> Anon.getFurosemide1Hierarchy());
+        BUILDERS.put(IO.FIELD_STATIN, data -> Anon.getStatinHierarchy());
+        BUILDERS.put(IO.FIELD_ACEI_ARB, data -> Anon.getAceiArbHierarchy());
+        BUILDERS.put(IO.FIELD_LVEF_MEASURE, Anon::getLvefMHierarchy);
+        BUILDERS.put(IO.FIELD_CREATININE_MEASURE, Anon::getCreatinineMHierarchy);
+        BUILDERS.put(IO.FIELD_SODIUM_MEASURE, Anon::getSodiumMHierarchy);
+        BUILDERS.put(IO.FIELD_HB_MEASURE, Anon::getHbMHierarchy);
+        BUILDERS.put(IO.FIELD_EGFR_MEASURE, Anon::getEgrfMHierarchy);
+    }
+
+    /** Built hierarchies by attribute and sorted domain */
+    private static final Map<List<String>, Hierarchy> CACHE = new ConcurrentHashMap<>();
+
+    /** Hierarchies by attribute */
+    private final Map<String, Hierarchy> hierarchies = new LinkedHashMap<>();
+
+    /** Attributes whose hierarchy was built for this set, i.e. not taken from the cache or a file */
+    private final List<String> built = new ArrayList<>();
+
+    private HierarchySet() {
+    }
+
+    /**
+     * Hierarchies covering the values of data, taken from the in-memory cache or built. Attributes that are not
+     * columns of data, e.g. of a projection to the quasi-identifiers of one score, have no hierarchy.
+     *
+     * @param data
+     * @return
+     */
+    public static HierarchySet create(Data data) {
+        HierarchySet set = new HierarchySet();
+        for (Map.Entry<String, Function<Data, Hierarchy>> builder : BUILDERS.entrySet()) {
+            String attribute = builder.getKey();
+            if (!hasColumn(data, attribute)) {
+                continue;
+            }
+            Hierarchy hierarchy = CACHE.computeIfAbsent(domainKey(data.getHandle(), attribute), key -> {
+                set.built.add(attribute);
+                return builder.getValue().apply(data);
+            });
+            set.hierarchies.put(attribute, hierarchy);
+        }
+        return set;
+    }
+
+    /**
+     * Hierarchies from the files in directory, if they cover the values of data. Missing hierarchies and
+     * hierarchies not covering all values are taken from the cache or built, see {@link #create(Data)}.
+     *
+     * @param directory
+     * @param data
+     * @return
+     * @throws IOException
+     */
+    public static HierarchySet load(File directory, Data data) throws IOException {
+        HierarchySet set = new HierarchySet();
+        for (String attribute : BUILDERS.keySet()) {
+            File file = hierarchyFile(directory, attribute);
+            if (hasColumn(data, attribute) && file.exists()) {
+                Hierarchy hierarchy = Hierarchy.create(file, StandardCharsets.UTF_8, DELIMITER);
+                if (covers(hierarchy, data.getHandle(), attribute)) {
+                    set.hierarchies.put(attribute, hierarchy);
+                }
+            }
+        }
+        HierarchySet missing = null;
+        for (String attribute : BUILDERS.keySet()) {
+            if (hasColumn(data, attribute) && !set.hierarchies.containsKey(attribute)) {
+                if (missing == null) {
+                    missing = create(data);
+                }
+                set.hierarchies.put(attribute, missing.get(attribute));
+                if (missing.built.contains(attribute)) {
+                    set.built.add(attribute);
+                }
+            }
+        }
+        System.out.println("Hierarchies built: " + set.built);
+        return set;
+    }
+
+    /**
+     * Saves all hierarchies to directory, one csv file per attribute
+     *
+     * @param directory
+     * @throws IOException
+     */
+    public void save(File directory) throws IOException {
+        if (!directory.exists() && !directory.mkdirs()) {
+            throw new IOException("Could not create hierarchy directory " + directory);
+        }
+        for (Map.Entry<String, Hierarchy> hierarchy : hierarchies.entrySet()) {
+            hierarchy.getValue().save(hierarchyFile(directory, hierarchy.getKey()), DELIMITER);
+        }
+    }
+
+    /**
+     * Hierarchy of an attribute
+     *
+     * @param attribute
+     * @return
+     */
+    public Hierarchy get(String attribute) {
+        return hierarchies.get(attribute);
+    }
+
+    /**
+     * Attributes whose hierarchy had to be built
+     *
+     * @return
+     */
+    public List<String> getBuiltAttributes() {
+        return built;
+    }
+
+    /**
+     * Whether the attribute is a column of data
+     */
+    private static boolean hasColumn(Data data, String attribute) {
+        return data.getHandle().getColumnIndexOf(attribute) >= 0;
+    }
+
+    private static File hierarchyFile(File directory, String attribute) {
+        return new File(directory, attribute + ".csv");
+    }
+
+    /**
+     * Cache key: attribute followed by the sorted distinct values of its column
+     */
+    private static List<String> domainKey(DataHandle handle, String attribute) {
+        String[] domain = handle.getDistinctValues(handle.getColumnIndexOf(attribute)).clone();
+        Arrays.sort(domain);
+        List<String> key = new ArrayList<>(domain.length + 1);
+        key.add(attribute);
+        key.addAll(Arrays.asList(domain));
+        return key;
+    }
+
+    /**
+     * Whether all values of the column are leaves of the hierarchy
+     */
+    private static boolean covers(Hierarchy hierarchy, DataHandle handle, String attribute) {
+        Set<String> leaves = new HashSet<>();
+        for (String[] row : hierarchy.getHierarchy()) {
+            leaves.add(row[0]);
+        }
+        return leaves.containsAll(Arrays.asList(handle.getDistinctValues(handle.getColumnIndexOf(attribute))));
+    }
+}
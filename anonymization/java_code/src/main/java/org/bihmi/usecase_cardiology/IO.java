@@ -22,11 +22,15 @@ import org.deidentifier.arx.DataSource;
 import org.deidentifier.arx.DataType;
 import org.deidentifier.arx.io.CSVDataOutput;
 
+import java.io.BufferedReader;
 import java.io.BufferedWriter;
 import java.io.File;
+import java.io.FileReader;
 import java.io.FileWriter;
 import java.io.IOException;
 import java.nio.charset.StandardCharsets;
+import java.util.LinkedHashMap;
+import java.util.Map;
 import java.util.Set;
 
 /**
@@ -109,57 +113,91 @@ public class IO {
     /** Final field */
     public static final String FIELD_HSTNT_UNIT            = "hstnt_u";
 
+    /** Data types of all known columns, in the order of the original extract */
+    private static final Map<String, DataType<?>> COLUMN_TYPES = new LinkedHashMap<>();
+
+    static {
+        COLUMN_TYPES.put(FIELD_INDEX, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_ALIAS, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_SITE, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_AGE, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_GENDER, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_TREATMENT, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_BMI, DataType.DECIMAL);
+        COLUMN_TYPES.put(FIELD_SYS_BLOODPREASURE_MEASURE, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_SYS_BLOODPREASURE_UNIT, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_NYHA, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_SMOKING, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_DIABETES, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_COPD, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_HEARTFAILURE_DURATION, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_HEARTFAILURE_LONGER_18MONTH, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_MRA, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_BETA, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_FUROSEMIDE1, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_STATIN, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_ARNI, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_ACEI_ARB, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_LVEF_MEASURE, DataType.DECIMAL);
+        COLUMN_TYPES.put(FIELD_LVEF_UNIT, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_CREATININE_MEASURE, DataType.DECIMAL);
+        COLUMN_TYPES.put(FIELD_CREATININE_UNIT, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_SODIUM_MEASURE, DataType.DECIMAL);
+        COLUMN_TYPES.put(FIELD_SODIUM_UNIT, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_HB_MEASURE, DataType.DECIMAL);
+        COLUMN_TYPES.put(FIELD_HB_UNIT, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_EGFR_MEASURE, DataType.DECIMAL);
+        COLUMN_TYPES.put(FIELD_EGFR_UNIT, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_NTPROBNP_MEASURE, DataType.INTEGER);
+        COLUMN_TYPES.put(FIELD_NTPROBNP_UNIT, DataType.STRING);
+        COLUMN_TYPES.put(FIELD_HSTNT_MEASURE, DataType.DECIMAL);
+        COLUMN_TYPES.put(FIELD_HSTNT_UNIT, DataType.STRING);
+    }
+
     /**
-     * File loading
+     * File loading. The columns are found by the names in the header, so the input may contain any subset of
+     * the known columns in any order (e.g. only the quasi-identifiers of a score); unknown columns are skipped.
      * @param inputFile File Handle for the input data
      * @return loaded data file as Data Object
      * @throws IOException Will be raised in case the File could not be found or imported
      */
     public static Data loadData(File inputFile) throws IOException {
-        
+
         // Import process
         DataSource sourceSpecification = DataSource.createCSVSource(inputFile, StandardCharsets.UTF_8, ',', true);
-        
+
         // Clean columns
-        sourceSpecification.addColumn(0,FIELD_INDEX, DataType.INTEGER);
-        sourceSpecification.addColumn(1,FIELD_ALIAS, DataType.STRING);
-        sourceSpecification.addColumn(2,FIELD_SITE, DataType.STRING);
-        sourceSpecification.addColumn(3,FIELD_AGE, DataType.INTEGER);
-        sourceSpecification.addColumn(4,FIELD_GENDER, DataType.STRING);
-        sourceSpecification.addColumn(5,FIELD_TREATMENT, DataType.STRING);
-        sourceSpecification.addColumn(6,FIELD_BMI, DataType.DECIMAL);
-        sourceSpecification.addColumn(7,FIELD_SYS_BLOODPREASURE_MEASURE, DataType.INTEGER);
-        sourceSpecification.addColumn(8,FIELD_SYS_BLOODPREASURE_UNIT, DataType.STRING);
-        sourceSpecification.addColumn(9,FIELD_NYHA, DataType.STRING);
-        sourceSpecification.addColumn(10,FIELD_SMOKING, DataType.INTEGER);
-        sourceSpecification.addColumn(11,FIELD_DIABETES, DataType.INTEGER);
-        sourceSpecification.addColumn(12,FIELD_COPD, DataType.INTEGER);
-        sourceSpecification.addColumn(13,FIELD_HEARTFAILURE_DURATION, DataType.INTEGER);
-        sourceSpecification.addColumn(14,FIELD_HEARTFAILURE_LONGER_18MONTH, DataType.INTEGER);
-        sourceSpecification.addColumn(15,FIELD_MRA, DataType.INTEGER);
-        sourceSpecification.addColumn(16,FIELD_BETA, DataType.INTEGER);
-        sourceSpecification.addColumn(17,FIELD_FUROSEMIDE1, DataType.INTEGER);
-        sourceSpecification.addColumn(18,FIELD_STATIN, DataType.INTEGER);
-        sourceSpecification.addColumn(19,FIELD_ARNI, DataType.INTEGER);
-        sourceSpecification.addColumn(20,FIELD_ACEI_ARB, DataType.INTEGER);
-        sourceSpecification.addColumn(21,FIELD_LVEF_MEASURE, DataType.DECIMAL);
-        sourceSpecification.addColumn(22,FIELD_LVEF_UNIT, DataType.STRING);
-        sourceSpecification.addColumn(23,FIELD_CREATININE_MEASURE, DataType.DECIMAL);
-        sourceSpecification.addColumn(24,FIELD_CREATININE_UNIT, DataType.STRING);
-        sourceSpecification.addColumn(25,FIELD_SODIUM_MEASURE, DataType.DECIMAL);
-        sourceSpecification.addColumn(26,FIELD_SODIUM_UNIT, DataType.STRING);
-        sourceSpecification.addColumn(27,FIELD_HB_MEASURE, DataType.DECIMAL);
-        sourceSpecification.addColumn(28,FIELD_HB_UNIT, DataType.STRING);
-        sourceSpecification.addColumn(29,FIELD_EGFR_MEASURE, DataType.DECIMAL);
-        sourceSpecification.addColumn(30,FIELD_EGFR_UNIT, DataType.STRING);
-        sourceSpecification.addColumn(31,FIELD_NTPROBNP_MEASURE, DataType.INTEGER);
-        sourceSpecification.addColumn(32,FIELD_NTPROBNP_UNIT, DataType.STRING);
-        sourceSpecification.addColumn(33,FIELD_HSTNT_MEASURE, DataType.DECIMAL);
-        sourceSpecification.addColumn(34,FIELD_HSTNT_UNIT, DataType.STRING);
+        String[] header = readHeader(inputFile);
+        for (int index = 0; index < header.length; index++) {
+            DataType<?> type = COLUMN_TYPES.get(header[index]);
+            if (type != null) {
+                sourceSpecification.addColumn(index, header[index], type);
+            }
+        }
 
         return Data.create(sourceSpecification);
     }
 
+    /**
+     * Column names of a csv file, as written by pandas
+     * @param inputFile File Handle for the input data
+     * @return names of the columns, without quotes
+     * @throws IOException Will be raised in case the File could not be read or is empty
+     */
+    private static String[] readHeader(File inputFile) throws IOException {
+        try (BufferedReader reader = new BufferedReader(new FileReader(inputFile, StandardCharsets.UTF_8))) {
+            String line = reader.readLine();
+            if (line == null) {
+                throw new IOException("The input file " + inputFile + " is empty");
+            }
+            String[] header = line.split(",", -1);
+            for (int index = 0; index < header.length; index++) {
+                header[index] = header[index].trim().replaceAll("^\"|\"$", "");
+            }
+            return header;
+        }
+    }
+
     /**
      * Writes the data, shuffles rows
      * @param original
@@ -20,8 +20,13 @@ import org.apache.commons.cli.*;
 import org.deidentifier.arx.Data;
 import org.deidentifier.arx.DataHandle;
 
+import java.io.BufferedReader;
 import java.io.File;
 import java.io.IOException;
+import java.io.InputStreamReader;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.List;
 
 /**
  * Main entry point, code was adapted from: <a href="https://github.com/BIH-MI/leoss-puf">LEOSS Repository</a>
@@ -30,6 +35,12 @@ import java.io.IOException;
  */
 public class Main {
 
+    /** Single argument starting the server mode */
+    public static final String SERVER = "--server";
+
+    /** Prefix of the line ending a run in server mode, followed by the exit status */
+    public static final String DONE_PREFIX = "DONE ";
+
     /** Mode*/
     private static final Option MODE_MAGGIC = Option.builder().longOpt("MAGGIC")
             .desc("Risk assessment mode. If chosen, the following options must be present as well: riskAssessmentConfig, dataConfig, anonymizationConfig, name")
@@ -63,12 +74,86 @@ public class Main {
             .required(true)
             .build();
 
+    /** Parameter */
+    private static final Option PARAMETER_SWEEP_GRID = Option.builder().longOpt("sweep")
+            .desc("Path to a csv grid of configurations (" + AnonymizationParameters.GRID_HEADER + "), each is run on the same data")
+            .hasArg(true)
+            .required(false)
+            .build();
+
+    /** Parameter */
+    private static final Option PARAMETER_HIERARCHIES = Option.builder().longOpt("hierarchies")
+            .desc("Directory of saved generalization hierarchies, reused if they cover the data. Missing hierarchies are built and saved")
+            .hasArg(true)
+            .required(false)
+            .build();
+
+    /** Parameter */
+    private static final Option PARAMETER_TIME_LIMIT = Option.builder().longOpt("time_limit")
+            .desc("Wall-clock budget in seconds per anonymization, the best result found within the budget is returned")
+            .hasArg(true)
+            .required(false)
+            .build();
+
+    /** Parameter */
+    private static final Option PARAMETER_WARM_START = Option.builder().longOpt("warm_start")
+            .desc("Directory of persisted optima. The optimum of the previous run of the lineage is verified first, the full search only runs if it is not kept")
+            .hasArg(true)
+            .required(false)
+            .build();
+
+    /** Parameter */
+    private static final Option PARAMETER_LINEAGE = Option.builder().longOpt("lineage")
+            .desc("Name of the dataset lineage for the warm start, e.g. the cohort name (default: default)")
+            .hasArg(true)
+            .required(false)
+            .build();
+
     /**
      * Main entry point
-     * @param args Should include anonymization mode, input and output paths
+     * @param args Should include anonymization mode, input and output paths, or only --server
      * @throws IOException
      */
     public static void main(String[] args) throws IOException {
+        if (args != null && args.length == 1 && args[0].equals(SERVER)) {
+            serve();
+            return;
+        }
+        run(args);
+    }
+
+    /**
+     * Server mode: every line of standard input holds the arguments of one run, separated by tabs. The runs share
+     * the JVM, so its start-up and the warm-up of the JIT compiler are paid once. The end of every run is reported
+     * with a line <code>DONE {status}</code>, the status is 0 if the run succeeded.
+     * @throws IOException
+     */
+    private static void serve() throws IOException {
+        BufferedReader reader = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = reader.readLine()) != null) {
+            if (line.isBlank()) {
+                continue;
+            }
+            int status;
+            try {
+                status = run(line.split("\t")) ? 0 : 1;
+            } catch (Exception e) {
+                e.printStackTrace();
+                status = 1;
+            }
+            System.out.println(DONE_PREFIX + status);
+            System.out.flush();
+        }
+    }
+
+    /**
+     * Runs the anonymization or the sweep given by the arguments
+     * @param args Should include anonymization mode, input and output paths
+     * @return false if the arguments are invalid
+     * @throws IOException
+     */
+    private static boolean run(String[] args) throws IOException {
 
         // Prepare options
         Options options = new Options();
@@ -79,7 +164,7 @@ public class Main {
         // Check args
         if (args == null || args.length == 0) {
             help(options, "No parameters provided");
-            return;
+            return false;
         }
 
         // Prepare parsing
@@ -91,7 +176,7 @@ public class Main {
             cmd = parser.parse(options, args, true);
         } catch (Exception e) {
             help(options, e.getMessage());
-            return;
+            return false;
         }
 
         // set anonymization mode
@@ -107,13 +192,18 @@ public class Main {
         }
         if (mode == null){
             help(options, "No known option provided");
-            return;
+            return false;
         }
 
         // Parse again with specific options
         options = new Options();
         options.addOption(PARAMETER_INPUT_PATH);
         options.addOption(PARAMETER_OUTPUT_PATH);
+        options.addOption(PARAMETER_SWEEP_GRID);
+        options.addOption(PARAMETER_HIERARCHIES);
+        options.addOption(PARAMETER_TIME_LIMIT);
+        options.addOption(PARAMETER_WARM_START);
+        options.addOption(PARAMETER_LINEAGE);
         switch (mode){
             case MAGGIC -> options.addOption(MODE_MAGGIC);
             case BIO_HF -> options.addOption(MODE_BIOHF);
@@ -124,7 +214,7 @@ public class Main {
             cmd = parser.parse(options, args, false);
         } catch (Exception e) {
             help(options, e.getMessage());
-            return;
+            return false;
         }
 
         // define Input and output file paths
@@ -136,15 +226,51 @@ public class Main {
         // Parse Data
         Data data = IO.loadData(new File(input));
 
+        // Load or build hierarchies
+        HierarchySet hierarchies;
+        if (cmd.hasOption(PARAMETER_HIERARCHIES)) {
+            File hierarchyDirectory = new File(cmd.getOptionValue(PARAMETER_HIERARCHIES));
+            hierarchies = HierarchySet.load(hierarchyDirectory, data);
+            if (!hierarchies.getBuiltAttributes().isEmpty()) {
+                hierarchies.save(hierarchyDirectory);
+            }
+        } else {
+            hierarchies = HierarchySet.create(data);
+        }
+
+        // Time budget
+        int timeLimitMillis = 0;
+        if (cmd.hasOption(PARAMETER_TIME_LIMIT)) {
+            timeLimitMillis = (int) (Double.parseDouble(cmd.getOptionValue(PARAMETER_TIME_LIMIT)) * 1000d);
+        }
+
+        // Sweep over configurations
+        if (cmd.hasOption(PARAMETER_SWEEP_GRID)) {
+            List<AnonymizationParameters> grid = new ArrayList<>();
+            for (AnonymizationParameters parameters : AnonymizationParameters.loadGrid(new File(cmd.getOptionValue(PARAMETER_SWEEP_GRID)))) {
+                grid.add(parameters.withTimeLimit(timeLimitMillis));
+            }
+            Anon.sweepUseCaseCardio(data, mode, hierarchies, grid, output);
+            return true;
+        }
+
+        // Persisted optimum of the lineage
+        WarmStart warmStart = null;
+        if (cmd.hasOption(PARAMETER_WARM_START)) {
+            warmStart = new WarmStart(new File(cmd.getOptionValue(PARAMETER_WARM_START)),
+                    cmd.getOptionValue(PARAMETER_LINEAGE, "default"), mode);
+        }
+
         // Anonymize
-        DataHandle data_anon = Anon.anonymizeUseCaseCardio(data, mode);
+        DataHandle data_anon = Anon.anonymizeUseCaseCardio(data, mode, hierarchies,
+                AnonymizationParameters.DEFAULT.withTimeLimit(timeLimitMillis), warmStart);
 
         // Write
         File output_file = new File(output);
         File output_stats_file = new File(output_stats);
         IO.writeOutput(Util.getData(data_anon), output_file);
         IO.writeStatsOutput(data.getHandle(), data_anon, output_stats_file);
-
+        return true;
     }
 
     /**
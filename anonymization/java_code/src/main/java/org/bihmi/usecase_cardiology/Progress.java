@@ -0,0 +1,71 @@
+/**
+ * Use Case Cardiology HiGHmed Data Anonymisation
+ * Copyright (C) 2024 - Berlin Institute of Health
+ * <p>
+ * Licensed under the Academic Free License v3.0;
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ * <p>
+ * https://license.md/licenses/academic-free-license-v3-0/
+ * <p>
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.bihmi.usecase_cardiology;
+
+import java.util.Arrays;
+import java.util.Locale;
+
+/**
+ * Progress events on standard output, one line <code>PROGRESS {json}</code> per event, for the Python wrapper
+ */
+public class Progress {
+
+    /** Prefix of progress lines */
+    public static final String PREFIX = "PROGRESS ";
+
+    /** Start of the run */
+    private final long start = System.currentTimeMillis();
+
+    /**
+     * Milliseconds since the start of the run
+     *
+     * @return
+     */
+    public long elapsedMillis() {
+        return System.currentTimeMillis() - start;
+    }
+
+    /**
+     * Prints an event with the elapsed time and the given key value pairs
+     *
+     * @param event     name of the event
+     * @param keyValues alternating keys and values (numbers, strings or int arrays)
+     */
+    public synchronized void report(String event, Object... keyValues) {
+        StringBuilder json = new StringBuilder();
+        json.append("{\"event\": \"").append(event).append("\", \"elapsed_ms\": ").append(elapsedMillis());
+        for (int i = 0; i + 1 < keyValues.length; i += 2) {
+            json.append(", \"").append(keyValues[i]).append("\": ").append(toJson(keyValues[i + 1]));
+        }
+        json.append("}");
+        System.out.println(PREFIX + json);
+        System.out.flush();
+    }
+
+    private static String toJson(Object value) {
+        if (value == null) {
+            return "null";
+        } else if (value instanceof int[] array) {
+            return Arrays.toString(array);
+        } else if (value instanceof Double number) {
+            return number.isNaN() || number.isInfinite() ? "null" : String.format(Locale.ROOT, "%s", number);
+        } else if (value instanceof Number || value instanceof Boolean) {
+            return value.toString();
+        }
+        return "\"" + value.toString().replace("\\", "\\\\").replace("\"", "\\\"") + "\"";
+    }
+}
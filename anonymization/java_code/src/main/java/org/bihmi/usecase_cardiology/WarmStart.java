@@ -0,0 +1,132 @@
+/**
+ * Use Case Cardiology HiGHmed Data Anonymisation
+ * Copyright (C) 2024 - Berlin Institute of Health
+ * <p>
+ * Licensed under the Academic Free License v3.0;
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ * <p>
+ * https://license.md/licenses/academic-free-license-v3-0/
+ * <p>
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.bihmi.usecase_cardiology;
+
+import org.deidentifier.arx.ARXLattice.ARXNode;
+
+import java.io.File;
+import java.io.FileReader;
+import java.io.FileWriter;
+import java.io.IOException;
+import java.io.Reader;
+import java.io.Writer;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.Properties;
+import java.util.Set;
+
+/**
+ * Persisted optimum of a previous anonymization of the same dataset lineage (e.g. monthly refreshes of a cohort)
+ * in the same mode. Stores the generalization level of every quasi-identifier, the parameters it was found with
+ * and the share of records suppressed in that run.
+ */
+public class WarmStart {
+
+    /** Property keys */
+    private static final String KEY_K = "parameter.k";
+    private static final String KEY_SUPPRESSION_LIMIT = "parameter.suppression_limit";
+    private static final String KEY_METRIC = "parameter.metric";
+    private static final String KEY_SUPPRESSED_SHARE = "suppressed_share";
+    private static final String PREFIX_LEVEL = "level.";
+
+    /** The previous optimum is only kept if at most this many more records are suppressed */
+    public static final double SUPPRESSION_TOLERANCE = 0.01d;
+
+    /** State file of the lineage and mode */
+    private final File stateFile;
+
+    public WarmStart(File directory, String lineage, AnonymizationMode mode) {
+        this.stateFile = new File(directory, lineage + "_" + mode.name() + ".properties");
+    }
+
+    /**
+     * Generalization levels of the previous optimum, if it was found with the same parameters and quasi-identifiers
+     *
+     * @param parameters
+     * @param quasiIdentifiers
+     * @return levels by attribute, or null (also if the state file is corrupt)
+     * @throws IOException
+     */
+    public Map<String, Integer> loadLevels(AnonymizationParameters parameters, Set<String> quasiIdentifiers) throws IOException {
+        Properties state = load();
+        if (state == null ||
+                !String.valueOf(parameters.k).equals(state.getProperty(KEY_K)) ||
+                !String.valueOf(parameters.suppressionLimit).equals(state.getProperty(KEY_SUPPRESSION_LIMIT)) ||
+                !parameters.metric.equals(state.getProperty(KEY_METRIC))) {
+            return null;
+        }
+        Map<String, Integer> levels = new HashMap<>();
+        for (String key : state.stringPropertyNames()) {
+            if (key.startsWith(PREFIX_LEVEL)) {
+                try {
+                    levels.put(key.substring(PREFIX_LEVEL.length()), Integer.parseInt(state.getProperty(key)));
+                } catch (NumberFormatException e) {
+                    return null;
+                }
+            }
+        }
+        return levels.keySet().equals(quasiIdentifiers) ? levels : null;
+    }
+
+    /**
+     * Share of suppressed records of the run that found the previous optimum
+     *
+     * @return
+     * @throws IOException
+     */
+    public double getSuppressedShare() throws IOException {
+        Properties state = load();
+        return state == null ? Double.NaN : Double.parseDouble(state.getProperty(KEY_SUPPRESSED_SHARE, "NaN"));
+    }
+
+    /**
+     * Persists a new optimum
+     *
+     * @param parameters
+     * @param optimum
+     * @param suppressedShare
+     * @throws IOException
+     */
+    public void save(AnonymizationParameters parameters, ARXNode optimum, double suppressedShare) throws IOException {
+        Properties state = new Properties();
+        state.setProperty(KEY_K, String.valueOf(parameters.k));
+        state.setProperty(KEY_SUPPRESSION_LIMIT, String.valueOf(parameters.suppressionLimit));
+        state.setProperty(KEY_METRIC, parameters.metric);
+        state.setProperty(KEY_SUPPRESSED_SHARE, String.valueOf(suppressedShare));
+        for (String attribute : optimum.getQuasiIdentifyingAttributes()) {
+            state.setProperty(PREFIX_LEVEL + attribute, String.valueOf(optimum.getGeneralization(attribute)));
+        }
+        File directory = stateFile.getAbsoluteFile().getParentFile();
+        if (!directory.exists() && !directory.mkdirs()) {
+            throw new IOException("Could not create warm start directory " + directory);
+        }
+        try (Writer writer = new FileWriter(stateFile)) {
+            state.store(writer, "Optimum of the previous anonymization");
+        }
+    }
+
+    private Properties load() throws IOException {
+        if (!stateFile.exists()) {
+            return null;
+        }
+        Properties state = new Properties();
+        try (Reader reader = new FileReader(stateFile)) {
+            state.load(reader);
+        }
+        return state;
+    }
+}
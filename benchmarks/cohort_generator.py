@@ -0,0 +1,142 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Vectorized generator of random UCC heart failure cohorts.
+
+The generated data follow the input layout of the README (the column order
+expected by the ARX jar) and the column types of ASyH_scripts/metadata.json.
+Values are drawn from clinically plausible marginal distributions; a small
+share of values is missing or outside the plausibility limits of
+preprocess_UCC, so that every pipeline stage has work to do.  The data carry no
+information about real patients and are meant for benchmarking only.
+"""
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['alias', 'site', 'age', 'gender', 'treatment', 'bmi', 'sys_bp_m', 'sys_bp_u', 'nyha', 'smoking',
+           'diabetes', 'copd', 'hf_duration', 'hf_gt_18_months', 'mra', 'beta', 'furosemide1', 'statin', 'arni',
+           'acei_arb', 'lvef_m', 'lvef_u', 'creatinine_m', 'creatinine_u', 'sodium_m', 'sodium_u', 'hb_m', 'hb_u',
+           'egfr_m', 'egfr_u', 'ntprobnp_m', 'ntprobnp_u', 'hstnt_m', 'hstnt_u']
+
+SITES = ['H', 'HD', 'WU', 'B', 'G', 'L', 'M', 'W']
+NYHA_CLASSES = ['I', 'II', 'III', 'IV']
+NYHA_PROBABILITIES = [0.15, 0.45, 0.32, 0.08]
+UNITS = {'sys_bp_u': ['mm[Hg]'],
+         'lvef_u': ['%'],
+         'creatinine_u': ['µmol/l', 'mg/dL'],
+         'sodium_u': ['mmol/l', 'mmol/L'],
+         'hb_u': ['g/dl', 'g/dL'],
+         'egfr_u': ['ml/min/1.73', 'mL/min/{1.73_m2}', 'ml/min /1,73qm'],
+         'ntprobnp_u': ['pg/ml', 'ng/l', 'ng/L'],
+         'hstnt_u': ['pg/ml', 'pg/mL', 'ng/l']}
+# prevalence of the binary comorbidities and medications
+PREVALENCES = {'smoking': 0.18, 'diabetes': 0.35, 'copd': 0.15, 'mra': 0.45, 'beta': 0.85,
+               'furosemide1': 0.6, 'statin': 0.55, 'arni': 0.15, 'acei_arb': 0.7}
+# columns which may be missing, i.e. everything but the identifiers and the units
+NULLABLE_COLUMNS = ['age', 'gender', 'bmi', 'sys_bp_m', 'nyha', 'smoking', 'diabetes', 'copd', 'hf_duration',
+                    'hf_gt_18_months', 'mra', 'beta', 'furosemide1', 'statin', 'arni', 'acei_arb', 'lvef_m',
+                    'creatinine_m', 'sodium_m', 'hb_m', 'egfr_m', 'ntprobnp_m', 'hstnt_m']
+INTEGER_COLUMNS = ['age', 'sys_bp_m', 'hf_duration', 'hf_gt_18_months', 'lvef_m', 'ntprobnp_m'] + list(PREVALENCES)
+# columns with plausibility limits in preprocess_UCC
+LIMITED_COLUMNS = ['age', 'bmi', 'sys_bp_m', 'lvef_m', 'creatinine_m', 'sodium_m', 'hb_m', 'egfr_m']
+
+
+def generate_cohort(n_rows, seed=0, missing_rate=0.02, implausible_rate=0.005, alias_offset=0):
+    """Random UCC cohort with N_ROWS patients as a DataFrame.
+
+    MISSING_RATE is the share of missing values in every nullable column,
+    IMPLAUSIBLE_RATE the share of values outside the plausibility limits in
+    the columns checked by preprocessing.  ALIAS_OFFSET shifts the patient
+    aliases, so that cohorts generated in chunks have unique aliases.
+    """
+    rng = np.random.default_rng(seed)
+
+    def choice(values, p=None):
+        # indexing an object array is much faster than converting numpy strings for pandas
+        return np.asarray(values, dtype=object)[rng.choice(len(values), n_rows, p=p)]
+
+    age = np.clip(rng.normal(68, 12, n_rows), 18, 100).round()
+    # heart failure duration in months, at most 12 months per year of age
+    hf_duration = np.minimum(rng.exponential(40, n_rows), age * 12).round()
+    data = {
+        'alias': np.array([f'ID{i}' for i in range(alias_offset, alias_offset + n_rows)], dtype=object),
+        'site': choice(SITES),
+        'age': age,
+        'gender': choice(['m', 'f'], p=[0.65, 0.35]),
+        'treatment': choice(['inpatient', 'outpatient']),
+        'bmi': np.clip(rng.normal(28, 5, n_rows), 15, 59).round(1),
+        'sys_bp_m': np.clip(rng.normal(125, 20, n_rows), 75, 240).round(),
+        'nyha': choice(NYHA_CLASSES, p=NYHA_PROBABILITIES),
+        'hf_duration': hf_duration,
+        'hf_gt_18_months': (hf_duration > 18).astype(float),
+        'lvef_m': np.clip(rng.normal(40, 12, n_rows), 5, 80).round(),
+        'creatinine_m': np.clip(rng.lognormal(np.log(105), 0.35, n_rows), 30, 1300).round(3),
+        'sodium_m': np.clip(rng.normal(139, 3.5, n_rows), 121, 149).round(3),
+        'hb_m': np.clip(rng.normal(13.2, 1.8, n_rows), 6, 19).round(3),
+        'egfr_m': np.clip(rng.normal(60, 20, n_rows), 6, 119).round(3),
+        'ntprobnp_m': rng.lognormal(np.log(1800), 1.0, n_rows).round(),
+        'hstnt_m': rng.lognormal(np.log(25), 0.8, n_rows).round(3),
+    }
+    for column, prevalence in PREVALENCES.items():
+        data[column] = (rng.random(n_rows) < prevalence).astype(float)
+    for column, units in UNITS.items():
+        data[column] = choice(units)
+
+    # values outside the plausibility limits (e.g. typing errors), caught by preprocessing
+    for column in LIMITED_COLUMNS:
+        implausible = rng.random(n_rows) < implausible_rate
+        data[column][implausible] *= 10
+
+    for column in NULLABLE_COLUMNS:
+        missing = rng.random(n_rows) < missing_rate
+        data[column][missing] = None if data[column].dtype == object else np.nan
+
+    # integer columns as in the original data, e.g. "64" and not "64.0" in the csv file
+    for column in INTEGER_COLUMNS:
+        missing = np.isnan(data[column])
+        data[column] = pd.arrays.IntegerArray(np.where(missing, 0, data[column]).astype(np.int64), missing)
+
+    cohort = pd.DataFrame(data, columns=COLUMNS)
+    cohort.index = cohort.index + alias_offset
+    return cohort
+
+
+def write_cohort(output_file, n_rows, seed=0, chunk_size=1000000, **kwargs):
+    """Write a random cohort of N_ROWS patients to the csv file OUTPUT_FILE in
+    the layout of the original data.  The cohort is generated in chunks of
+    CHUNK_SIZE rows with independent random streams, so memory stays bounded
+    and the result depends only on N_ROWS, SEED and CHUNK_SIZE."""
+    chunk_seeds = np.random.SeedSequence(seed).spawn(max(1, -(-n_rows // chunk_size)))
+    for chunk_number, chunk_seed in enumerate(chunk_seeds):
+        offset = chunk_number * chunk_size
+        chunk = generate_cohort(min(chunk_size, n_rows - offset), seed=chunk_seed, alias_offset=offset, **kwargs)
+        chunk.to_csv(output_file, mode='w' if chunk_number == 0 else 'a', header=chunk_number == 0)
+    return output_file
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Write a random UCC heart failure cohort for benchmarking.')
+    argparser.add_argument('--rows', '-n', type=int, default=1000,
+                           help='number of patients')
+    argparser.add_argument('--output', '-o', type=str, required=True,
+                           help='output csv file')
+    argparser.add_argument('--seed', type=int, default=0,
+                           help='random seed')
+    args = argparser.parse_args()
+
+    write_cohort(args.output, args.rows, seed=args.seed)
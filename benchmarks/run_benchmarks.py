@@ -0,0 +1,241 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Scaling benchmark of the pipeline stages on random cohorts.
+
+For every cohort size, a random cohort is generated (see cohort_generator) and
+the stages are run in pipeline order, each timed with the Profiler.  A stage
+whose backend is not available (e.g. no JVM or R) is recorded as failed and the
+stages depending on its output are skipped.  The results are written as JSON
+together with the git commit, so runs of different commits can be compared:
+
+    python -m benchmarks.run_benchmarks --sizes 1000 10000 100000 --output bench.json
+    python -m benchmarks.run_benchmarks --compare old.json new.json
+"""
+import json
+import os
+import platform
+import subprocess
+import traceback
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from benchmarks.cohort_generator import write_cohort
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS, get_attributes
+from preprocessing.preprocess_UCC import drop_column_cleanup, drop_score_columns
+from profiling.instrumentation import Profiler
+
+STAGES = ['preprocess', 'filter', 'arx', 'gaussian_copula', 'scoring', 'comparison_statistics', 'anonymeter', 'dcr']
+# stage -> stages whose output it needs
+DEPENDENCIES = {'preprocess': [],
+                'filter': ['preprocess'],
+                'arx': ['filter'],
+                'gaussian_copula': ['filter'],
+                'scoring': ['filter', 'gaussian_copula'],
+                'comparison_statistics': ['scoring'],
+                'anonymeter': ['scoring'],
+                'dcr': ['scoring']}
+# stage -> input dataset, used for the row count of the stage
+STAGE_INPUTS = {'filter': 'cleaned', 'arx': 'filtered', 'gaussian_copula': 'filtered', 'scoring': 'filtered',
+                'comparison_statistics': 'original_scored', 'anonymeter': 'original_scored',
+                'dcr': 'original_scored'}
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_preprocess(state, medical_score):
+    from preprocessing.preprocess_UCC import preprocess
+    state['cleaned'] = preprocess(pd.read_csv(state['input_file']))
+    return state['cleaned']
+
+
+def _run_filter(state, medical_score):
+    from preprocessing.filtering import select_score_subsample
+    state['filtered'] = drop_column_cleanup(select_score_subsample(state['cleaned'], medical_score))
+    return state['filtered']
+
+
+def _run_arx(state, medical_score):
+    from anonymization.anonymization_script import anonymize_ucc_cardio_data
+    state['anonymized'] = anonymize_ucc_cardio_data(drop_score_columns(state['filtered']),
+                                                    anon_type=medical_score)
+    return state['anonymized']
+
+
+def _run_gaussian_copula(state, medical_score):
+    from synthetization.synthetization_script import synthesize_ucc_cardio_data
+    state['synthetic'] = synthesize_ucc_cardio_data(state['filtered'])
+    return state['synthetic']
+
+
+def _run_scoring(state, medical_score):
+    from score_calculation.score_calculation import calculate_scores
+    state['original_scored'] = drop_column_cleanup(calculate_scores(state['filtered']))
+    state['synthetic_scored'] = drop_column_cleanup(calculate_scores(state['synthetic']))
+    return state['original_scored']
+
+
+def _run_comparison_statistics(state, medical_score):
+    from evaluation.statistics import compare_datasets
+    return compare_datasets(state['original_scored'], state['synthetic_scored'],
+                            FEATURE_SETS[medical_score]["continuous"], FEATURE_SETS[medical_score]["categorical"],
+                            ["original", "synthetic"], ignore_error=True)
+
+
+def _holdout_split(state, medical_score):
+    columns = get_attributes(medical_score) + ["alias"]
+    original = state['original_scored'][columns]
+    _, control = train_test_split(original, test_size=0.5, random_state=0)
+    return original, state['synthetic_scored'][columns], control
+
+
+def _run_anonymeter(state, medical_score):
+    from evaluation.privacy_evaluation_script import anonymeter_evaluation
+    return anonymeter_evaluation(*_holdout_split(state, medical_score))
+
+
+def _run_dcr(state, medical_score):
+    from evaluation.privacy_metrics import mostly_privacy_metrics
+    original, synthetic, control = _holdout_split(state, medical_score)
+    training = original.loc[~original["alias"].isin(control["alias"])]
+    return mostly_privacy_metrics(training, control, synthetic)
+
+
+STAGE_FUNCTIONS = {'preprocess': _run_preprocess,
+                   'filter': _run_filter,
+                   'arx': _run_arx,
+                   'gaussian_copula': _run_gaussian_copula,
+                   'scoring': _run_scoring,
+                   'comparison_statistics': _run_comparison_statistics,
+                   'anonymeter': _run_anonymeter,
+                   'dcr': _run_dcr}
+
+
+def benchmark_size(n_rows, stages, medical_score, work_dir, seed=0):
+    """Run STAGES on a random cohort of N_ROWS patients, return one result
+    dictionary per stage."""
+    input_file = os.path.join(work_dir, f"cohort_{n_rows}_{seed}.csv")
+    if not os.path.exists(input_file):
+        print(f"Generating cohort with {n_rows} rows.")
+        write_cohort(input_file, n_rows, seed=seed)
+
+    state = {'input_file': input_file}
+    profiler = Profiler(f"benchmark_{n_rows}")
+    results = []
+    failed = set()
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        result = {'size': n_rows, 'stage': stage, 'status': 'ok'}
+        missing = [dependency for dependency in DEPENDENCIES[stage] if dependency in failed or
+                   dependency not in stages]
+        if missing:
+            result.update(status='skipped', error=f"requires {missing}")
+            failed.add(stage)
+            results.append(result)
+            continue
+        try:
+            with profiler.stage(stage, state.get(STAGE_INPUTS.get(stage))) as record:
+                record.set_output(STAGE_FUNCTIONS[stage](state, medical_score))
+        except Exception as excpt:
+            traceback.print_exc()
+            result.update(status='failed', error=repr(excpt))
+            failed.add(stage)
+        record = profiler.stages[-1]
+        result.update({key: value for key, value in record.to_dict().items()
+                       if key not in ('name', 'depth', 'start', 'error')})
+        results.append(result)
+    return results
+
+
+def run_benchmarks(sizes, stages, medical_score, work_dir, output_file, seed=0):
+    work_dir = os.path.abspath(work_dir)
+    output_file = os.path.abspath(output_file)
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+
+    # the pipeline functions write their temporary files relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        results = []
+        for n_rows in sizes:
+            results += benchmark_size(n_rows, stages, medical_score, work_dir, seed)
+    finally:
+        os.chdir(cwd)
+
+    benchmark = {'commit': git_commit(),
+                 'date': datetime.now().isoformat(timespec='seconds'),
+                 'host': platform.node(),
+                 'python': platform.python_version(),
+                 'cpu_count': os.cpu_count(),
+                 'medical_score': medical_score.value,
+                 'seed': seed,
+                 'results': results}
+    with open(output_file, 'w') as json_file:
+        json.dump(benchmark, json_file, indent=2)
+    return benchmark
+
+
+def compare_benchmarks(baseline_file, candidate_file):
+    """Table of the wall times of two benchmark files and their ratio per stage
+    and size; ratios above 1 mean the candidate is slower."""
+    tables = []
+    for benchmark_file in [baseline_file, candidate_file]:
+        with open(benchmark_file) as json_file:
+            benchmark = json.load(json_file)
+        table = pd.DataFrame(benchmark['results'])
+        table = table[table['status'] == 'ok'].set_index(['stage', 'size'])['wall_s']
+        tables.append(table.rename(benchmark['commit'] or benchmark_file))
+    comparison = pd.concat(tables, axis=1)
+    comparison['ratio'] = comparison.iloc[:, 1] / comparison.iloc[:, 0]
+    return comparison
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Time the pipeline stages on random cohorts of increasing size.')
+    argparser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                           help='cohort sizes (number of patients)')
+    argparser.add_argument('--stages', type=str, nargs='+', default=STAGES, choices=STAGES,
+                           help='stages to run')
+    argparser.add_argument('--score', type=str, default=MEDICAL_SCORE.MAGGIC.value,
+                           choices=[MEDICAL_SCORE.MAGGIC.value, MEDICAL_SCORE.BIOHF.value],
+                           help='medical score defining the subsample and feature set')
+    argparser.add_argument('--work_dir', type=str, default=os.path.join('temp', 'benchmarks'),
+                           help='directory for the generated cohorts and temporary files')
+    argparser.add_argument('--output', '-o', type=str,
+                           default=f"benchmark_{datetime.now().strftime('%Y-%m-%d')}.json",
+                           help='JSON result file')
+    argparser.add_argument('--seed', type=int, default=0,
+                           help='random seed of the generated cohorts')
+    argparser.add_argument('--compare', type=str, nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                           help='compare two result files instead of running the benchmark')
+    args = argparser.parse_args()
+
+    if args.compare:
+        print(compare_benchmarks(*args.compare).to_string())
+    else:
+        run_benchmarks(args.sizes, args.stages, MEDICAL_SCORE(args.score), args.work_dir, args.output, args.seed)
@@ -0,0 +1,127 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Start-up time of the entry points and of the modules imported by workers.
+
+Every module is imported in a fresh interpreter, several times, and the import
+time, the wall time of the whole process and the heavy backends it loaded (R,
+plotting, ASyH, anonymeter) are recorded.  The modules needed by process-pool
+workers and short command line calls should load none of these:
+
+    python -m benchmarks.startup_benchmark --repeats 5 --output startup.json
+    python -m benchmarks.startup_benchmark --modules evaluation.constants --max_ms 200
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+MODULES = ['evaluation.constants',
+           'preprocessing.preprocess_UCC',
+           'preprocessing.filtering',
+           'preprocessing.chunked_processing',
+           'evaluation.local_utils',
+           'evaluation.plots',
+           'evaluation.evaluation_script',
+           'evaluation.privacy_evaluation_script',
+           'score_calculation.score_calculation',
+           'synthetization.synthetization_script',
+           'anonymization.anonymization_script',
+           'pipeline.partitioned',
+           'script_utility_analysis',
+           'script_risk_analysis']
+# modules that are expensive to load and only needed by some stages
+HEAVY_MODULES = ['rpy2', 'ASyH', 'sdv', 'seaborn', 'matplotlib', 'magic', 'anonymeter']
+
+# run in the child interpreter, prints the import time and the loaded heavy modules as JSON
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+import_s = time.perf_counter() - start
+print(json.dumps({{'import_s': import_s,
+                  'heavy': sorted(name for name in {heavy!r} if name in sys.modules)}}))
+"""
+
+
+def measure_import(module, repeats=5):
+    """Median import and process wall time of MODULE in fresh interpreters,
+    and the heavy modules it loads."""
+    root = Path(__file__).parent.parent
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(root),
+                                                                            os.environ.get('PYTHONPATH')])))
+    import_times, wall_times = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                   capture_output=True, text=True, cwd=root, env=environment)
+        wall_times.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            return {'module': module, 'status': 'failed', 'error': completed.stderr.strip().splitlines()[-1:]}
+        probe = json.loads(completed.stdout.strip().splitlines()[-1])
+        import_times.append(probe['import_s'])
+    return {'module': module, 'status': 'ok',
+            'import_ms': 1000 * float(pd.Series(import_times).median()),
+            'process_ms': 1000 * float(pd.Series(wall_times).median()),
+            'heavy_modules': probe['heavy']}
+
+
+def run_startup_benchmark(modules=MODULES, repeats=5):
+    baseline = measure_import('sys', repeats)
+    print(f"Interpreter start-up: {baseline['process_ms']:.0f} ms")
+    results = []
+    for module in modules:
+        result = measure_import(module, repeats)
+        results.append(result)
+        if result['status'] == 'ok':
+            print(f"{module}: import {result['import_ms']:.0f} ms, process {result['process_ms']:.0f} ms, "
+                  f"heavy modules {result['heavy_modules'] or 'none'}")
+        else:
+            print(f"{module}: failed {result['error']}")
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'interpreter_ms': baseline['process_ms'],
+            'repeats': repeats,
+            'results': results}
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Measure the start-up time of the entry points and worker modules.')
+    argparser.add_argument('--modules', type=str, nargs='+', default=MODULES,
+                           help='modules to import')
+    argparser.add_argument('--repeats', type=int, default=5,
+                           help='fresh interpreters per module, the median is reported')
+    argparser.add_argument('--output', '-o', type=str,
+                           help='JSON result file')
+    argparser.add_argument('--max_ms', type=float,
+                           help='exit with an error if an import takes longer (in milliseconds) or fails')
+    args = argparser.parse_args()
+
+    benchmark = run_startup_benchmark(args.modules, args.repeats)
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(benchmark, json_file, indent=2)
+    if args.max_ms is not None:
+        slow = [result['module'] for result in benchmark['results']
+                if result['status'] != 'ok' or result['import_ms'] > args.max_ms]
+        if slow:
+            sys.exit(f"Import of {slow} failed or took longer than {args.max_ms} ms.")
@@ -0,0 +1,93 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Medical scores and their feature sets.
+
+Kept free of plotting and R dependencies, so that entry points and worker
+processes can import them without starting R or matplotlib.
+"""
+from enum import Enum
+
+
+class MEDICAL_SCORE(Enum):
+    BIOHF = "BIOHF"
+    MAGGIC = "MAGGIC"
+    FULL = "FULL"
+
+
+def get_attributes(risk_score: MEDICAL_SCORE):
+    return FEATURE_SETS[risk_score]["all"]
+
+
+FEATURE_SETS = {MEDICAL_SCORE.BIOHF:
+                    {'continuous': ['age', 'lvef_m', 'sodium_m', 'hb_m', 'egfr_m', 'biohf_v1_1', 'biohf_v1_3'],
+                     'categorical': ['gender', 'nyha', 'beta', 'furosemide1', 'statin', 'acei_arb'],
+                     'all': ['age', 'lvef_m', 'sodium_m', 'hb_m', 'gender', 'nyha', 'beta', 'furosemide1',
+                             'statin', 'acei_arb', 'egfr_m']},
+                MEDICAL_SCORE.MAGGIC:
+                    {'continuous': ['age', 'bmi', 'sys_bp_m', 'lvef_m', 'creatinine_m', 'maggic_score_1',
+                                    'maggic_score_3'],
+                     'categorical': ['gender', 'nyha', 'smoking', 'diabetes', 'copd', 'hf_gt_18_months', 'beta',
+                                     'acei_arb'],
+                     'all': ['age', 'bmi', 'sys_bp_m', 'lvef_m', 'creatinine_m', 'gender', 'nyha', 'smoking',
+                             'diabetes', 'copd', 'hf_gt_18_months', 'beta', 'acei_arb']}}
+
+# quasi-identifiers of the anonymization, as defined in Anon.define_quasiidentifiers_*
+QUASI_IDENTIFIERS = {MEDICAL_SCORE.MAGGIC: ['age', 'gender', 'bmi', 'sys_bp_m', 'nyha', 'smoking', 'diabetes', 'copd',
+                                            'hf_gt_18_months', 'beta', 'acei_arb', 'lvef_m', 'creatinine_m'],
+                     MEDICAL_SCORE.BIOHF: ['age', 'gender', 'nyha', 'beta', 'furosemide1', 'statin', 'acei_arb',
+                                           'lvef_m', 'sodium_m', 'hb_m', 'egfr_m'],
+                     MEDICAL_SCORE.FULL: ['age', 'gender', 'bmi', 'sys_bp_m', 'nyha', 'smoking', 'diabetes', 'copd',
+                                          'hf_gt_18_months', 'beta', 'furosemide1', 'statin', 'acei_arb', 'lvef_m',
+                                          'creatinine_m', 'sodium_m', 'hb_m', 'egfr_m']}
+
+# stages of the pipeline with their own column requirements, see required_columns
+PIPELINE_STAGES = ["input", "anonymization", "synthetization", "scoring"]
+
+
+def required_columns(medical_score: MEDICAL_SCORE, stage="input"):
+    """Columns of the cohort that STAGE of the pipeline uses for
+    MEDICAL_SCORE, or None if it uses all columns (FULL).  The anonymization
+    only needs the quasi-identifiers, all other columns are suppressed; the
+    synthetization and the input need the features and the alias; the
+    scoring needs the inputs of the score, the inputs of the other score are
+    added as missing values.  Columns the stages add themselves (the scores)
+    are not part of the requirements."""
+    if stage not in PIPELINE_STAGES:
+        raise ValueError(f"Unknown stage {stage}, choose one of {PIPELINE_STAGES}.")
+    if medical_score not in FEATURE_SETS:
+        return None
+    match stage:
+        case "anonymization":
+            return list(QUASI_IDENTIFIERS[medical_score])
+        case "scoring":
+            return list(FEATURE_SETS[medical_score]['all'])
+    return ['alias'] + FEATURE_SETS[medical_score]['all']
+
+
+def project_columns(data, columns):
+    """DATA reduced to those of COLUMNS it has, DATA itself if COLUMNS is None."""
+    if columns is None:
+        return data
+    return data[[column for column in columns if column in data]]
+
+
+def column_filter(columns):
+    """usecols argument of pandas.read_csv reading only those of COLUMNS a file has, None for all columns."""
+    if columns is None:
+        return None
+    columns = set(columns)
+    return lambda column: column in columns
@@ -17,8 +17,12 @@
 from argparse import ArgumentParser
 from datetime import datetime
 
-from evaluation.local_utils import read_data, MEDICAL_SCORE, FEATURE_SETS
-from evaluation.plots import violin_plots, ecdf_plot
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS
+from evaluation.plot_summaries import plot_summary
+from evaluation.multivariate_fidelity import pairwise_fidelity
+from evaluation.pca_projection import pca_projections, MAX_POINTS
+from evaluation.plots import violin_plots, ecdf_plot, pca_plot, qq_plot, render_plots, IMAGE_FORMATS
+from evaluation.quantile_sketch import DatasetSketches, ks_table
 from evaluation.statistics import compare_datasets
 import pandas as pd
 
@@ -33,14 +37,18 @@ def evaluate_datasets(dataset_original: pd.DataFrame,
                       dataset_anon: pd.DataFrame,
                       dataset_combined: pd.DataFrame,
                       output_path: str,
-                      medical_score:MEDICAL_SCORE):
-
-    dataset_original["anonymized"] = "Original"
-    dataset_anon["anonymized"] = "Anonymized"
-    dataset_synth["anonymized"] = "Synthetic"
-    dataset_combined["anonymized"] = "Combined"
-    data = pd.concat([dataset_original, dataset_anon, dataset_synth], axis=0)
-    data.reset_index(inplace=True)
+                      medical_score:MEDICAL_SCORE,
+                      image_format: str = "eps",
+                      max_workers: int = None,
+                      plot_summary_mode: str = "auto",
+                      pca_max_points: int = MAX_POINTS,
+                      executor=None):
+    """Write the comparison statistics and plots of the datasets to OUTPUT_PATH.
+    The datasets are only read.  At most PCA_MAX_POINTS records per dataset
+    are drawn in the PCA projection plot.  The plots are rendered in a new
+    pool of MAX_WORKERS processes, or submitted to the process pool EXECUTOR
+    of the caller, then the futures of the plot files are returned and the
+    caller waits for them."""
 
     ### question 1 + 2: statistical comparisons dataset and medical scores
     comparison_original_synth, comparison_original_synth_cat = compare_datasets(dataset_original, dataset_synth,
@@ -67,26 +75,70 @@ def evaluate_datasets(dataset_original: pd.DataFrame,
     stats_cont.to_csv(f"{output_path}/{DATE_TODAY}_comparison_statistics_{medical_score.name}_cont.csv")
     stats_cat.to_csv(f"{output_path}/{DATE_TODAY}_comparison_statistics_{medical_score.name}_cat.csv")
 
+    # dependencies of all feature pairs (correlations, Cramér's V, mutual information) compared to the original
+    pairs, pairs_summary, _ = pairwise_fidelity({'Original': dataset_original, 'Anonymized': dataset_anon,
+                                                 'Synthetic': dataset_synth, 'Combined': dataset_combined},
+                                                medical_score)
+    print(pairs_summary.to_string())
+    pairs.to_csv(f"{output_path}/{DATE_TODAY}_pairwise_fidelity_{medical_score.name}.csv", index=False)
+    pairs_summary.to_csv(f"{output_path}/{DATE_TODAY}_pairwise_fidelity_summary_{medical_score.name}.csv")
+
+    # quantile sketches of the continuous features, mergeable with those of other chunks, partitions or replicates
+    datasets = {'Original': dataset_original, 'Anonymized': dataset_anon,
+                'Synthetic': dataset_synth, 'Combined': dataset_combined}
+    sketches = {label: DatasetSketches.of(data, FEATURE_SETS[medical_score]["continuous"])
+                for label, data in datasets.items()}
+    for label, dataset_sketches in sketches.items():
+        dataset_sketches.save(f"{output_path}/{DATE_TODAY}_sketches_{medical_score.name}_{label.lower()}.json")
+    pd.concat({label: dataset_sketches.percentiles() for label, dataset_sketches in sketches.items()}) \
+        .to_csv(f"{output_path}/{DATE_TODAY}_sketch_percentiles_{medical_score.name}.csv")
+    pd.concat({label: ks_table(sketches["Original"], sketches[label], ("original", "release"))
+               for label in ['Synthetic', 'Anonymized', 'Combined']}) \
+        .to_csv(f"{output_path}/{DATE_TODAY}_sketch_ks_{medical_score.name}.csv")
+
     ### 3. question: visual comparisons medical scores
-    IMAGE_SUFFIX = "eps"
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format {image_format}, choose one of {IMAGE_FORMATS}.")
     SCORES = {'maggic_score_1': 'MAGGIC score 1 year mortality',
                'biohf_v1_1': 'Barcelona Heart Failure score 1 year mortality'}
 
+    plot_jobs = []
     for score in SCORES:
         if not medical_score.value.lower() in score:
             continue
 
-        orig_values = dataset_original[score].dropna().astype(float).values
-        anon_values = dataset_anon[score].dropna().astype(float).values
-        synth_values = dataset_synth[score].dropna().astype(float).values
-        combined_values = dataset_combined[score].dropna().astype(float).values
+        # large datasets are summarized once here, so only the fixed-size summaries are sent to the plot workers
+        orig_values = plot_summary(dataset_original[score].dropna().astype(float).values, plot_summary_mode)
+        anon_values = plot_summary(dataset_anon[score].dropna().astype(float).values, plot_summary_mode)
+        synth_values = plot_summary(dataset_synth[score].dropna().astype(float).values, plot_summary_mode)
+        combined_values = plot_summary(dataset_combined[score].dropna().astype(float).values, plot_summary_mode)
 
-        ecdf_plot(orig_values, anon_values, synth_values, combined_values,
-                        xlabel=SCORES[score],
-                        save_to=f'{output_path}/{DATE_TODAY}_ecdf_orig_anon_synth-{score}.{IMAGE_SUFFIX}')
+        plot_jobs.append((ecdf_plot,
+                          (orig_values, anon_values, synth_values, combined_values),
+                          {'xlabel': SCORES[score],
+                           'save_to': f'{output_path}/{DATE_TODAY}_ecdf_orig_anon_synth-{score}.{image_format}'}))
 
         # violin plots
-        violin_plots(orig_values, anon_values, synth_values, combined_values,
-                           score,
-                           save_to=f'{output_path}/{DATE_TODAY}_violin_anon_orig_synth-{score}.{IMAGE_SUFFIX}')
-
+        plot_jobs.append((violin_plots,
+                          (orig_values, anon_values, synth_values, combined_values, score),
+                          {'save_to': f'{output_path}/{DATE_TODAY}_violin_anon_orig_synth-{score}.{image_format}'}))
+
+        # quantile-quantile plot from the sketches
+        plot_jobs.append((qq_plot,
+                          ({label: dataset_sketches.sketches[score] for label, dataset_sketches in sketches.items()
+                            if dataset_sketches.sketches[score].n > 0},),
+                          {'xlabel': SCORES[score],
+                           'save_to': f'{output_path}/{DATE_TODAY}_qq_orig_anon_synth-{score}.{image_format}'}))
+
+    # PCA projection onto the principal components of the original, only the projected points go to the plot workers
+    projections, explained_variance_ratio = pca_projections({'Original': dataset_original,
+                                                             'Anonymized': dataset_anon,
+                                                             'Synthetic': dataset_synth,
+                                                             'Combined': dataset_combined},
+                                                            medical_score, max_points=pca_max_points)
+    plot_jobs.append((pca_plot,
+                      (projections, explained_variance_ratio),
+                      {'title': medical_score.value,
+                       'save_to': f'{output_path}/{DATE_TODAY}_pca_orig_anon_synth.{image_format}'}))
+
+    return render_plots(plot_jobs, max_workers=max_workers, executor=executor)
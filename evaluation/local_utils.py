@@ -1,46 +1,24 @@
-from enum import Enum
-
 import os
 from pathlib import Path
 import pandas
 import numpy
-import matplotlib
-import matplotlib.pyplot as pyplot
-import seaborn
 import re
-import magic
-import rpy2.robjects as robj
-
-
-seaborn.set(rc={'axes.facecolor': 'lightgrey'})
-
-
-class MEDICAL_SCORE(Enum):
-    BIOHF = "BIOHF"
-    MAGGIC = "MAGGIC"
-    FULL = "FULL"
-
 
-def get_attributes(risk_score: MEDICAL_SCORE):
-    return FEATURE_SETS[risk_score]["all"]
+# the constants are defined in evaluation.constants, which imports neither R nor matplotlib
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS, get_attributes
 
 
-FEATURE_SETS = {MEDICAL_SCORE.BIOHF:
-                    {'continuous': ['age', 'lvef_m', 'sodium_m', 'hb_m', 'egfr_m', 'biohf_v1_1', 'biohf_v1_3'],
-                     'categorical': ['gender', 'nyha', 'beta', 'furosemide1', 'statin', 'acei_arb'],
-                     'all': ['age', 'lvef_m', 'sodium_m', 'hb_m', 'gender', 'nyha', 'beta', 'furosemide1',
-                             'statin', 'acei_arb', 'egfr_m']},
-                MEDICAL_SCORE.MAGGIC:
-                    {'continuous': ['age', 'bmi', 'sys_bp_m', 'lvef_m', 'creatinine_m', 'maggic_score_1',
-                                    'maggic_score_3'],
-                     'categorical': ['gender', 'nyha', 'smoking', 'diabetes', 'copd', 'hf_gt_18_months', 'beta',
-                                     'acei_arb'],
-                     'all': ['age', 'bmi', 'sys_bp_m', 'lvef_m', 'creatinine_m', 'gender', 'nyha', 'smoking',
-                             'diabetes', 'copd', 'hf_gt_18_months', 'beta', 'acei_arb']}}
+def _pyplot():
+    """matplotlib.pyplot with the seaborn style, imported on first use."""
+    import matplotlib.pyplot as pyplot
+    import seaborn
+    seaborn.set(rc={'axes.facecolor': 'lightgrey'})
+    return pyplot
 
 
 # input csv and/or xls(x)
 def read_data(datafile, **kwargs):
+    import magic
     filetype = magic.from_file(datafile)
     if re.compile(".*Excel.*").match(filetype):
         return pandas.read_excel(datafile, **kwargs)
@@ -57,6 +35,7 @@ def read_data(datafile, **kwargs):
 
 def qqplot(ground_truth, y, numquant=None, ax=None, title='', ylabel='', save_to='qq-plot.png'):
     'Quantile-quantile plot for two empirical distributions.'
+    pyplot = _pyplot()
     pyplot.clf()
     if ax is None:
         ax = pyplot.gca()
@@ -89,6 +68,7 @@ def ecdf_plot(orig, anon, synth, xlabel='', save_to='ecdf_plot.png'):
     x_anon, y_anon = ecdf_values(anon.dropna().to_numpy())
     x_synth, y_synth = ecdf_values(synth.dropna().to_numpy())
 
+    pyplot = _pyplot()
     pyplot.clf()
     _, ax = pyplot.subplots()
 
@@ -107,6 +87,8 @@ def ecdf_plot(orig, anon, synth, xlabel='', save_to='ecdf_plot.png'):
 
 
 def violin_plots(anon, orig, synth, plot_parm, save_to='violin_plots.png'):
+    import matplotlib.ticker
+    pyplot = _pyplot()
     pyplot.clf()
     ax = pyplot.gca()
     datalist = [anon, orig, synth]
@@ -126,36 +108,19 @@ def violin_plots(anon, orig, synth, plot_parm, save_to='violin_plots.png'):
     return ax
 
 
-R_SCRIPT_PATH = os.path.dirname(__file__)
-
-def pca_plot_R(orig_file, synth_file, output_image, score_name):
-    """Python wrapper for the R script used to produce PCA 2-d projections.
-    This function expects the ORIG_FILE to contain as many data records as
-    SYNTH_FILE, which contains the synthetic data to compare to.
-
-    The R script will split continuous and categorical data according to
-    FEATURE_SETS, convert any non-boolean columns to one-hot, re-centre the
-    data, execute the PCA and project the data records onto the plane of the two
-    largest principal components.
-
-    This script is not integrated into any pipeline, but provided for
-    completeness of methods used in the publication (cf. figs. S1 and S2,
-    supplementary document).
-
-    """
-    cwd = os.getcwd()
+def pca_plot_files(orig_file, synth_file, output_image, score_name, max_points=None):
+    """PCA 2-d projection of the records of ORIG_FILE and SYNTH_FILE onto the
+    plane of the two largest principal components of the original data, see
+    evaluation.pca_projection (cf. figs. S1 and S2, supplementary document).
+    The files may contain different numbers of records."""
+    from evaluation.pca_projection import pca_projections, MAX_POINTS
+    from evaluation.plots import pca_plot
 
     # creating any temporary directory
     output_file = os.path.abspath(output_image)
-    output_dir = os.path.dirname(output_file)
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
-
-    robj.r['source'](rf'{R_SCRIPT_PATH}/pca_projections.R')
-    r_pca_projection = robj.globalenv['pca_projection']
-    r_pca_projection(orig_file,
-                     synth_file,
-                     output_image,
-                     cwd,
-                     str(score_name),
-                     FEATURE_SETS[score_name]['all'],
-                     FEATURE_SETS[score_name]['categorical'])
+    Path(os.path.dirname(output_file)).mkdir(parents=True, exist_ok=True)
+
+    projections, explained_variance_ratio = pca_projections(
+        {'original': pandas.read_csv(orig_file), 'synthetic': pandas.read_csv(synth_file)}, score_name,
+        max_points=MAX_POINTS if max_points is None else max_points)
+    return pca_plot(projections, explained_variance_ratio, title=score_name.value, save_to=output_file)
@@ -0,0 +1,178 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Pairwise dependency metrics of all features, computed with matrix products.
+
+For the continuous features of a score, the Pearson and Spearman correlation
+matrices are computed from pairwise complete observations with a handful of
+matrix products (the Spearman ranks of a column are taken over all its present
+values).  For the categorical features, all pairwise contingency tables are
+blocks of the Gram matrix of the one-hot encoding, from which Cramér's V and
+the mutual information of all pairs are summed up block-wise.  The category
+codes are fitted once to the original data and reused for the released
+datasets; values the original does not have (e.g. generalized values of the
+anonymized data) share one code, missing values another.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from evaluation.constants import FEATURE_SETS
+
+METRICS = ['pearson', 'spearman', 'cramers_v', 'mutual_information']
+OTHER = "<other>"
+MISSING = "<missing>"
+
+
+def as_category(values):
+    """VALUES as strings, numbers in a canonical format, so that e.g. 1, 1.0 and "1" are the same category."""
+    numeric = pd.to_numeric(values, errors='coerce')
+    return pd.Series(np.where(numeric.notna(), numeric.map(repr), values.astype(str)),
+                     index=values.index).where(values.notna())
+
+
+def _pairwise_correlation(values):
+    """Pearson correlations of the columns of VALUES over the rows where both are present."""
+    present = (~np.isnan(values)).astype(float)
+    filled = np.nan_to_num(values)
+    counts = present.T @ present
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # [i, j]: sums over the rows in which columns i and j are both present
+        sums = filled.T @ present
+        squares = (filled ** 2).T @ present
+        products = filled.T @ filled
+        mean_i, mean_j = sums / counts, sums.T / counts
+        covariance = products / counts - mean_i * mean_j
+        variance_i, variance_j = squares / counts - mean_i ** 2, squares.T / counts - mean_j ** 2
+        correlation = covariance / np.sqrt(variance_i * variance_j)
+    return np.clip(correlation, -1, 1)
+
+
+class FidelityEncoder:
+    """Numeric matrices and category codes of the features of MEDICAL_SCORE,
+    with the categories of the ORIGINAL data."""
+
+    def __init__(self, original, medical_score):
+        categorical = FEATURE_SETS[medical_score]['categorical']
+        self.continuous = [column for column in FEATURE_SETS[medical_score]['continuous'] if column in original]
+        self.categorical = [column for column in categorical if column in original]
+        self.categories = {column: list(np.sort(as_category(original[column]).dropna().unique())) + [OTHER, MISSING]
+                           for column in self.categorical}
+        self.offsets = np.cumsum([0] + [len(self.categories[column]) for column in self.categorical])
+        self._cache = {}
+
+    def numeric(self, data):
+        """Continuous features of DATA as float matrix, non-numeric values are missing."""
+        return np.column_stack([pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=float)
+                                if column in data else np.full(len(data), np.nan)
+                                for column in self.continuous]) if self.continuous else np.empty((len(data), 0))
+
+    def codes(self, data):
+        """Integer codes of the categorical features of DATA, one column per feature."""
+        codes = np.empty((len(data), len(self.categorical)), dtype=int)
+        for i, column in enumerate(self.categorical):
+            categories = self.categories[column]
+            values = as_category(data[column]) if column in data else pd.Series(np.nan, index=data.index)
+            coded = pd.Categorical(values, categories=categories[:-2]).codes
+            codes[:, i] = np.where(values.isna(), len(categories) - 1, np.where(coded < 0, len(categories) - 2, coded))
+        return codes
+
+    def metrics(self, data, label=None):
+        """Dependency matrices of DATA.  With a LABEL, the result is cached, so
+        the original is only encoded once per encoder."""
+        if label is not None and label in self._cache:
+            return self._cache[label]
+        numeric = self.numeric(data)
+        ranks = pd.DataFrame(numeric).rank().to_numpy()
+        result = {'pearson': _pairwise_correlation(numeric),
+                  'spearman': _pairwise_correlation(ranks),
+                  **self._categorical_dependencies(self.codes(data))}
+        if label is not None:
+            self._cache[label] = result
+        return result
+
+    def _categorical_dependencies(self, codes):
+        """Cramér's V and mutual information (in nats) of all pairs of categorical features."""
+        n_rows, n_features = codes.shape
+        if n_rows == 0 or n_features == 0:
+            empty = np.full((n_features, n_features), np.nan)
+            return {'cramers_v': empty, 'mutual_information': empty.copy()}
+        one_hot = sparse.csr_matrix((np.ones(codes.size), (np.repeat(np.arange(n_rows), n_features),
+                                                           (codes + self.offsets[:-1]).ravel())),
+                                    shape=(n_rows, self.offsets[-1]))
+        # block (i, j) of the Gram matrix is the contingency table of features i and j
+        joint = (one_hot.T @ one_hot).toarray() / n_rows
+        marginal = np.diag(joint)
+        expected = np.outer(marginal, marginal)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            chi2_terms = np.where(expected > 0, joint ** 2 / expected, 0)
+            mi_terms = np.where(joint > 0, joint * np.log(joint / expected), 0)
+
+        def block_sums(matrix):
+            starts = self.offsets[:-1]
+            return np.add.reduceat(np.add.reduceat(matrix, starts, axis=0), starts, axis=1)
+
+        phi2 = block_sums(chi2_terms) - 1
+        observed_categories = np.add.reduceat((marginal > 0).astype(int), self.offsets[:-1])
+        dof = np.minimum.outer(observed_categories, observed_categories) - 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cramers_v = np.sqrt(np.clip(phi2, 0, None) / dof)
+        cramers_v[dof <= 0] = np.nan
+        return {'cramers_v': cramers_v, 'mutual_information': block_sums(mi_terms)}
+
+    def features(self, metric):
+        return self.categorical if metric in ('cramers_v', 'mutual_information') else self.continuous
+
+
+def _upper_triangle(matrix):
+    return matrix[np.triu_indices(len(matrix), k=1)]
+
+
+def pairwise_fidelity(datasets, medical_score, encoder=None):
+    """Dependency metrics of all feature pairs of the labelled DATASETS (label
+    -> DataFrame, the original first) and the summaries of their differences
+    to the original.  Returns the table of all pairs (one column per
+    dataset), the summary table (one row per released dataset and metric) and
+    the encoder, which can be passed in again for further releases."""
+    labels = list(datasets)
+    if encoder is None:
+        encoder = FidelityEncoder(datasets[labels[0]], medical_score)
+    metrics = {label: encoder.metrics(data, label=label if label == labels[0] else None)
+               for label, data in datasets.items()}
+
+    pairs, summaries = [], []
+    for metric in METRICS:
+        features = encoder.features(metric)
+        first, second = np.triu_indices(len(features), k=1)
+        table = pd.DataFrame({'metric': metric,
+                              'feature_1': np.asarray(features, dtype=object)[first],
+                              'feature_2': np.asarray(features, dtype=object)[second]})
+        for label in labels:
+            table[label] = _upper_triangle(metrics[label][metric])
+        pairs.append(table)
+
+        reference = _upper_triangle(metrics[labels[0]][metric])
+        for label in labels[1:]:
+            difference = np.abs(_upper_triangle(metrics[label][metric]) - reference)
+            worst = np.nanargmax(difference) if np.isfinite(difference).any() else None
+            summaries.append({'dataset': label, 'metric': metric,
+                              'n_pairs': int(np.isfinite(difference).sum()),
+                              'mean_abs_difference': np.nanmean(difference) if worst is not None else np.nan,
+                              'max_abs_difference': difference[worst] if worst is not None else np.nan,
+                              'frobenius_norm_difference': np.sqrt(2 * np.nansum(difference ** 2)),
+                              'max_difference_pair': f"{table['feature_1'][worst]} - {table['feature_2'][worst]}"
+                              if worst is not None else None})
+    return pd.concat(pairs, ignore_index=True), pd.DataFrame(summaries).set_index(['dataset', 'metric']), encoder
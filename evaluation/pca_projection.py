@@ -0,0 +1,96 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Projection of the datasets onto the first two principal components.
+
+The principal components are fitted to the original data with an incremental
+PCA, batch by batch, so that the one-hot encoded cohort is never held in
+memory as a whole.  Continuous features are standardized with the mean and
+standard deviation of the original data, categorical features are one-hot
+encoded with the categories of the original data, and missing or generalized
+values are imputed with the original mean (zero after standardization) or no
+category.  The released datasets are projected onto the components of the
+original, so their sizes do not have to match, and at most MAX_POINTS
+randomly drawn records per dataset are projected and plotted.
+"""
+import numpy as np
+import pandas as pd
+
+from evaluation.constants import FEATURE_SETS
+from evaluation.multivariate_fidelity import as_category
+
+N_COMPONENTS = 2
+BATCH_SIZE = 10000
+# records per dataset in the scatter plot
+MAX_POINTS = 5000
+
+
+class OneHotScaler:
+    """Standardized continuous and one-hot encoded categorical features of the
+    feature set of a medical score, with the statistics of the original data."""
+
+    def __init__(self, original, medical_score):
+        categorical = FEATURE_SETS[medical_score]['categorical']
+        self.continuous = [column for column in FEATURE_SETS[medical_score]['all'] if column not in categorical]
+        self.categorical = [column for column in categorical if column in original]
+        numbers = original[self.continuous].apply(pd.to_numeric, errors='coerce')
+        self.mean = numbers.mean().fillna(0).to_numpy()
+        self.std = numbers.std().replace(0, np.nan).fillna(1).to_numpy()
+        self.categories = {column: np.sort(as_category(original[column]).dropna().unique())
+                           for column in self.categorical}
+        self.features = self.continuous + [f"{column}_{category}" for column in self.categorical
+                                           for category in self.categories[column]]
+
+    def transform(self, data):
+        """Feature matrix of DATA, missing columns and values are imputed."""
+        numbers = np.column_stack([pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=float)
+                                   if column in data else np.full(len(data), np.nan)
+                                   for column in self.continuous])
+        parts = [np.nan_to_num((numbers - self.mean) / self.std)]
+        for column in self.categorical:
+            values = as_category(data[column]) if column in data else pd.Series(np.nan, index=data.index)
+            parts.append((values.to_numpy()[:, None] == self.categories[column][None, :]).astype(float))
+        return np.hstack(parts)
+
+
+def fit_pca(original, medical_score, n_components=N_COMPONENTS, batch_size=BATCH_SIZE):
+    """Encoder and incremental PCA of ORIGINAL, fitted in batches of BATCH_SIZE records."""
+    from sklearn.decomposition import IncrementalPCA
+    encoder = OneHotScaler(original, medical_score)
+    pca = IncrementalPCA(n_components=n_components)
+    for start in range(0, len(original), batch_size):
+        batch = encoder.transform(original.iloc[start:start + batch_size])
+        if len(batch) >= n_components:
+            pca.partial_fit(batch)
+    return encoder, pca
+
+
+def project(data, encoder, pca, max_points=MAX_POINTS, seed=0):
+    """Projection of at most MAX_POINTS randomly drawn records of DATA onto the principal components."""
+    if len(data) > max_points:
+        data = data.iloc[np.sort(np.random.default_rng(seed).choice(len(data), max_points, replace=False))]
+    return pca.transform(encoder.transform(data))
+
+
+def pca_projections(datasets, medical_score, max_points=MAX_POINTS, batch_size=BATCH_SIZE, seed=0):
+    """Fit the PCA to the first of the labelled DATASETS (a dictionary label ->
+    DataFrame, the original first) and project all of them.  Returns the
+    dictionary label -> projected points and the explained variance ratios of
+    the components."""
+    original = next(iter(datasets.values()))
+    encoder, pca = fit_pca(original, medical_score, batch_size=batch_size)
+    projections = {label: project(data, encoder, pca, max_points, seed) for label, data in datasets.items()}
+    return projections, pca.explained_variance_ratio_
@@ -0,0 +1,137 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Fixed-size summaries of large value arrays for the ECDF and violin plots.
+
+Plotting every point of an ECDF and running a full Gaussian KDE for every
+violin does not scale to synthetic datasets with millions of rows.  A
+DistributionSummary is computed once per dataset and holds everything the
+plots need: the ECDF on a fixed quantile grid, a binned FFT-based kernel
+density estimate and the box plot statistics.  Its size, and hence render time
+and output file size, does not depend on the number of rows.
+"""
+import numpy as np
+
+SUMMARY_MODES = ["auto", "exact", "summary"]
+
+# in 'auto' mode, datasets with at most this many values are plotted exactly
+EXACT_THRESHOLD = 10000
+GRID_SIZE = 512
+MAX_FLIERS = 200
+
+
+class DistributionSummary:
+    """Quantile grid ECDF, binned KDE and box plot statistics of VALUES."""
+
+    def __init__(self, values, grid_size=GRID_SIZE, max_fliers=MAX_FLIERS):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.n = len(values)
+        self.ecdf_x, self.ecdf_y = quantile_grid_ecdf(values, grid_size)
+        self.violin = binned_kde_violin_stats(values, grid_size)
+        self.box = box_stats(values, max_fliers)
+
+
+def plot_summary(values, mode="auto", threshold=EXACT_THRESHOLD, grid_size=GRID_SIZE, max_fliers=MAX_FLIERS):
+    """Return VALUES unchanged for exact plotting, or their DistributionSummary.
+
+    MODE 'exact' always keeps the raw values, 'summary' always summarizes and
+    'auto' summarizes only if there are more than THRESHOLD values.
+    """
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"Unknown plot summary mode {mode}, choose one of {SUMMARY_MODES}.")
+    if mode == "exact" or (mode == "auto" and len(values) <= threshold):
+        return values
+    return DistributionSummary(values, grid_size=grid_size, max_fliers=max_fliers)
+
+
+def quantile_grid_ecdf(values, grid_size=GRID_SIZE):
+    """ECDF of VALUES evaluated on GRID_SIZE equally spaced probabilities."""
+    if len(values) == 0:
+        return np.array([]), np.array([])
+    probabilities = np.linspace(0, 1, grid_size)
+    return np.quantile(values, probabilities), probabilities
+
+
+def scott_bandwidth(values):
+    """Kernel bandwidth by Scott's rule, as used by scipy's gaussian_kde and
+    therefore by matplotlib's violinplot."""
+    return np.std(values, ddof=1) * len(values) ** (-1 / 5)
+
+
+def binned_kde(values, grid, bandwidth=None):
+    """Gaussian kernel density estimate of VALUES on the equally spaced GRID.
+
+    The values are linearly binned onto the grid, the bin counts are then
+    convolved with the sampled Gaussian kernel using the FFT.  The cost is
+    O(n + m log m) for n values and m grid points.
+    """
+    n_grid = len(grid)
+    if bandwidth is None:
+        bandwidth = scott_bandwidth(values)
+    delta = grid[1] - grid[0]
+
+    # linear binning
+    position = np.clip((values - grid[0]) / delta, 0, n_grid - 1)
+    lower = np.minimum(np.floor(position).astype(int), n_grid - 2)
+    fraction = position - lower
+    counts = np.bincount(lower, weights=1 - fraction, minlength=n_grid) \
+        + np.bincount(lower + 1, weights=fraction, minlength=n_grid)
+
+    # kernel sampled on the grid, truncated at 4 bandwidths
+    half_width = int(min(n_grid - 1, np.ceil(4 * bandwidth / delta)))
+    offsets = np.arange(-half_width, half_width + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (np.sqrt(2 * np.pi) * bandwidth * len(values))
+
+    fft_size = int(2 ** np.ceil(np.log2(n_grid + 2 * half_width + 1)))
+    density = np.fft.irfft(np.fft.rfft(counts, fft_size) * np.fft.rfft(kernel, fft_size), fft_size)
+    return np.maximum(density[half_width:half_width + n_grid], 0)
+
+
+def binned_kde_violin_stats(values, grid_size=GRID_SIZE):
+    """Violin statistics as expected by matplotlib's Axes.violin."""
+    if len(values) == 0:
+        return {'coords': np.array([0.]), 'vals': np.array([0.]),
+                'mean': np.nan, 'median': np.nan, 'min': np.nan, 'max': np.nan}
+    value_min, value_max = values.min(), values.max()
+    bandwidth = scott_bandwidth(values) if len(values) > 1 else 0.
+    if value_min == value_max or bandwidth == 0:
+        coords = np.array([value_min, value_max])
+        vals = np.ones(2)
+    else:
+        coords = np.linspace(value_min, value_max, grid_size)
+        vals = binned_kde(values, coords, bandwidth)
+    return {'coords': coords, 'vals': vals,
+            'mean': values.mean(), 'median': np.median(values), 'min': value_min, 'max': value_max}
+
+
+def box_stats(values, max_fliers=MAX_FLIERS, whis=1.5):
+    """Box plot statistics as expected by matplotlib's Axes.bxp.  At most
+    MAX_FLIERS outliers are kept, evenly spaced in rank and always including
+    the most extreme ones."""
+    if len(values) == 0:
+        return {'med': np.nan, 'q1': np.nan, 'q3': np.nan, 'whislo': np.nan, 'whishi': np.nan,
+                'mean': np.nan, 'fliers': np.array([])}
+    q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - whis * iqr) & (values <= q3 + whis * iqr)]
+    fliers = np.sort(values[(values < q1 - whis * iqr) | (values > q3 + whis * iqr)])
+    if len(fliers) > max_fliers:
+        fliers = fliers[np.linspace(0, len(fliers) - 1, max_fliers).astype(int)]
+    return {'med': median, 'q1': q1, 'q3': q3,
+            'whislo': inside.min() if len(inside) else q1,
+            'whishi': inside.max() if len(inside) else q3,
+            'mean': values.mean(), 'fliers': fliers}
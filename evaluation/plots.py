@@ -1,7 +1,11 @@
-import matplotlib
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
+from evaluation.plot_summaries import DistributionSummary
+
+IMAGE_FORMATS = ["eps", "pdf", "png", "svg"]
+
 
 def ecdf_values(value_list):
     x_ecdf = np.sort(value_list)
@@ -9,14 +13,41 @@ def ecdf_values(value_list):
     return x_ecdf, y_ecdf
 
 
+def ecdf_curve(values):
+    """ECDF of raw VALUES, or the quantile grid ECDF of a DistributionSummary."""
+    if isinstance(values, DistributionSummary):
+        return values.ecdf_x, values.ecdf_y
+    return ecdf_values(values)
+
+
+def new_figure():
+    """Create a figure that is not registered with pyplot, so it does not touch
+    any global state and is freed as soon as it is no longer referenced."""
+    # matplotlib is imported on first use, the module is also imported by processes that do not plot
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def save_figure(fig, save_to):
+    """Write FIG to SAVE_TO (the format is taken from the file suffix) and
+    release the figure's resources."""
+    try:
+        fig.savefig(save_to)
+    finally:
+        fig.clear()
+
+
 def ecdf_plot(orig, anon, synth, combined, xlabel='', save_to='ecdf_plot.png'):
-    x_orig, y_orig = ecdf_values(orig)
-    x_anon, y_anon = ecdf_values(anon)
-    x_synth, y_synth = ecdf_values(synth)
-    x_combined, y_combined = ecdf_values(combined)
+    x_orig, y_orig = ecdf_curve(orig)
+    x_anon, y_anon = ecdf_curve(anon)
+    x_synth, y_synth = ecdf_curve(synth)
+    x_combined, y_combined = ecdf_curve(combined)
 
-    plt.clf()
-    _, ax = plt.subplots()
+    fig = new_figure()
+    ax = fig.subplots()
 
     ax.plot(x_orig, y_orig, ls='solid', label='Original')
     ax.plot(x_anon, y_anon, ls='solid', label='Anonymized')
@@ -25,30 +56,114 @@ def ecdf_plot(orig, anon, synth, combined, xlabel='', save_to='ecdf_plot.png'):
 
     ax.legend()
 
-    plt.xlabel(xlabel)
-    plt.ylabel(f'ECD({xlabel})')
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(f'ECD({xlabel})')
 
-    plt.savefig(save_to)
+    save_figure(fig, save_to)
 
-    return ax
+    return save_to
 
 
 def violin_plots(orig, anon, synth, combined, plot_parm, save_to='violin_plots.png'):
-    plt.clf()
-    ax = plt.gca()
+    from matplotlib.ticker import FixedLocator
+    fig = new_figure()
+    ax = fig.subplots()
     datalist = [orig, anon, synth, combined]
-    ax.violinplot(datalist,
+    if any(isinstance(data, DistributionSummary) for data in datalist):
+        # summaries may be mixed with raw values (e.g. a small original dataset)
+        summaries = [data if isinstance(data, DistributionSummary) else DistributionSummary(data)
+                     for data in datalist]
+        ax.violin([summary.violin for summary in summaries],
                   widths=0.85,
                   showmeans=False,
                   showmedians=False,
                   showextrema=False)
-    ax.boxplot(datalist, widths=0.15, showcaps=False)
-    ax.xaxis.set_major_locator(matplotlib.ticker.FixedLocator([1, 2, 3, 4]))
+        ax.bxp([summary.box for summary in summaries], widths=0.15, showcaps=False)
+    else:
+        ax.violinplot(datalist,
+                      widths=0.85,
+                      showmeans=False,
+                      showmedians=False,
+                      showextrema=False)
+        ax.boxplot(datalist, widths=0.15, showcaps=False)
+    ax.xaxis.set_major_locator(FixedLocator([1, 2, 3, 4]))
     ax.set_ylabel(plot_parm)
     labels = ['Original', 'Anonymized', 'Synthetic', 'Combined']
     ax.set_xticklabels(labels)
 
-    plt.savefig(save_to)
+    save_figure(fig, save_to)
+
+    return save_to
+
+
+def sketch_ecdf_plot(sketches, xlabel='', save_to='ecdf_plot.png'):
+    """Approximate ECDFs of the quantile SKETCHES, a dictionary label -> KLLSketch."""
+    fig = new_figure()
+    ax = fig.subplots()
+    for label, sketch in sketches.items():
+        x_ecdf, y_ecdf = sketch.ecdf()
+        ax.plot(x_ecdf, y_ecdf, ls='solid', label=f'{label} (rank error {sketch.rank_error():.1%})')
+    ax.legend()
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(f'ECD({xlabel})')
+
+    save_figure(fig, save_to)
+
+    return save_to
+
+
+def qq_plot(sketches, xlabel='', save_to='qq_plot.png', grid_size=99):
+    """Quantile-quantile plot of the quantile SKETCHES (label -> KLLSketch)
+    against the first of them, on GRID_SIZE equally spaced probabilities."""
+    probabilities = np.linspace(0, 1, grid_size + 2)[1:-1]
+    reference_label, reference = next(iter(sketches.items()))
+    x_quantiles = reference.quantile(probabilities)
+    fig = new_figure()
+    ax = fig.subplots()
+    for label, sketch in list(sketches.items())[1:]:
+        ax.plot(x_quantiles, sketch.quantile(probabilities), ls='-', marker='.', label=label)
+    ax.axline((x_quantiles[0], x_quantiles[0]), slope=1, color='r', ls='-')
+    ax.legend()
+    ax.set_xlabel(f'{xlabel} ({reference_label})')
+    ax.set_ylabel(xlabel)
+
+    save_figure(fig, save_to)
+
+    return save_to
+
+
+def pca_plot(projections, explained_variance_ratio, title='', save_to='pca_plot.png'):
+    """Scatter plot of the PCA PROJECTIONS, a dictionary label -> points."""
+    fig = new_figure()
+    ax = fig.subplots()
+    for label, points in projections.items():
+        ax.scatter(points[:, 0], points[:, 1], s=4, alpha=0.3, label=label)
+    ax.legend()
+    ax.set_title(title)
+    ax.set_xlabel(f'PC1 - explaining {100 * explained_variance_ratio[0]:.1f} % of variability')
+    ax.set_ylabel(f'PC2 - explaining {100 * explained_variance_ratio[1]:.1f} % of variability')
+
+    save_figure(fig, save_to)
+
+    return save_to
+
+
+def _render(job):
+    plot_function, args, kwargs = job
+    return plot_function(*args, **kwargs)
 
-    return ax
 
+def render_plots(jobs, max_workers=None, executor=None):
+    """Render all plot JOBS, each a tuple (plot_function, args, kwargs), in a
+    pool of worker processes.  Returns the list of written files in the order
+    of JOBS.  With MAX_WORKERS=1 the plots are rendered in this process.
+    With an EXECUTOR owned by the caller (e.g. shared by the evaluations of
+    all scores), the jobs are submitted to it and the list of futures of the
+    written files is returned without waiting for them.
+    """
+    if executor is not None:
+        return [executor.submit(_render, job) for job in jobs]
+    if max_workers == 1 or len(jobs) <= 1:
+        return [_render(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_render, jobs))
@@ -17,15 +17,19 @@
 
 import os
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
-from anonymeter.evaluators import LinkabilityEvaluator, InferenceEvaluator, SinglingOutEvaluator
 
-from evaluation.local_utils import read_data
 from evaluation.privacy_metrics import mostly_privacy_metrics
+from evaluation.shared_dataset import SharedDatasets, attach_datasets, attached_dataset
+
+# labels of the datasets shared with the workers of the inference attacks
+INFERENCE_DATASETS = ["origin", "processed", "control"]
 
 
 def run_anonymeter_linkability(data_origin, data_processed, data_control, aux_columns):
+    from anonymeter.evaluators import LinkabilityEvaluator
 
     n_attacks = len(data_processed.index)
 
@@ -56,25 +60,44 @@ def run_anonymeter_linkability(data_origin, data_processed, data_control, aux_co
     results_df["can_be_used"] = results_df["baseline_rate success_rate"] < results_df["attack_rate success_rate"]
     return results_df.transpose()
 
-def run_anonymeter_attribute_inference(data_origin, data_processed, data_control):
-    columns = list(set(data_origin.columns).intersection(data_processed.columns))
-    results = []
-    risks = []
+def _infer_secret(data_origin, data_processed, data_control, columns, secret, n_jobs=-2):
+    from anonymeter.evaluators import InferenceEvaluator
+    aux_cols = [col for col in columns if col != secret]
+
+    evaluator = InferenceEvaluator(ori=data_origin,
+                                   syn=data_processed,
+                                   control=data_control,
+                                   aux_cols=aux_cols,
+                                   secret=secret,
+                                   n_attacks=400)
+    evaluator.evaluate(n_jobs=n_jobs)
+    return evaluator.results(), evaluator.risk()
 
-    n_attacks = len(data_processed.index)
 
-    for secret in columns:
-        aux_cols = [col for col in columns if col != secret]
+def _inference_job(job):
+    """Inference attack on one secret in a worker, on the datasets attached by attach_datasets."""
+    columns, secret = job
+    datasets = [attached_dataset(label).frame() for label in INFERENCE_DATASETS]
+    return _infer_secret(*datasets, columns, secret, n_jobs=1)
+
+
+def run_anonymeter_attribute_inference(data_origin, data_processed, data_control, max_workers=1):
+    """Inference attack on every shared column.  With MAX_WORKERS other than
+    1 (None: number of CPUs), the secrets are attacked in parallel worker
+    processes, which attach to the datasets in shared memory instead of
+    getting copies of them."""
+    columns = list(set(data_origin.columns).intersection(data_processed.columns))
 
-        evaluator = InferenceEvaluator(ori=data_origin,
-                                       syn=data_processed,
-                                       control=data_control,
-                                       aux_cols=aux_cols,
-                                       secret=secret,
-                                       n_attacks=400)
-        evaluator.evaluate(n_jobs=-2)
-        results.append((secret, evaluator.results()))
-        risks.append((secret, evaluator.risk()))
+    if max_workers == 1:
+        outcomes = [_infer_secret(data_origin, data_processed, data_control, columns, secret) for secret in columns]
+    else:
+        datasets = dict(zip(INFERENCE_DATASETS, [data_origin, data_processed, data_control]))
+        with SharedDatasets(datasets) as shared, \
+                ProcessPoolExecutor(max_workers=max_workers, initializer=attach_datasets,
+                                    initargs=(shared.handles,)) as executor:
+            outcomes = list(executor.map(_inference_job, [(columns, secret) for secret in columns]))
+    results = [(secret, result) for secret, (result, _) in zip(columns, outcomes)]
+    risks = [(secret, risk) for secret, (_, risk) in zip(columns, outcomes)]
 
     pattern = '|'.join(["SuccessRate(value=","error=", ")"])
 
@@ -96,6 +119,7 @@ def run_anonymeter_attribute_inference(data_origin, data_processed, data_control
     return results_df.transpose()
 
 def run_anonymeter_singlingout(data_origin, data_processed, data_control, mode="univariate"):
+    from anonymeter.evaluators import SinglingOutEvaluator
 
     n_attacks = len(data_processed.index)
 
@@ -142,7 +166,9 @@ def __format_results(res_Link, res_Inf, res_SO_uni, res_SO_multi, priv_mostly):
 
 
 
-def anonymeter_evaluation(data_origin, data_processed, data_control):
+def anonymeter_evaluation(data_origin, data_processed, data_control, inference_workers=1):
+    """Anonymeter attacks and holdout distances of DATA_PROCESSED, see
+    run_anonymeter_attribute_inference for INFERENCE_WORKERS."""
 
     available_columns = ['lvef_m', 'creatinine_m', 'sodium_m', 'hb_m', 'egfr_m']
     unavailable_columns = ['age', 'bmi', 'diabetes', 'copd', 'gender']
@@ -159,7 +185,8 @@ def anonymeter_evaluation(data_origin, data_processed, data_control):
     ]
 
     res_Link = run_anonymeter_linkability(data_origin, data_processed, data_control, aux_columns)
-    res_Inf = run_anonymeter_attribute_inference(data_origin, data_processed, data_control)
+    res_Inf = run_anonymeter_attribute_inference(data_origin, data_processed, data_control,
+                                                 max_workers=inference_workers)
     res_SO_uni = run_anonymeter_singlingout(data_origin, data_processed, data_control, "univariate")
     res_SO_multi = run_anonymeter_singlingout(data_origin, data_processed, data_control, "multivariate")
 
@@ -16,11 +16,39 @@
 #  */
 import numpy as np
 import pandas as pd
-from sklearn.compose import make_column_transformer
+from scipy import sparse
 from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import OneHotEncoder, QuantileTransformer
 
 
+def _fill_numeric_nan(data, numeric_cols, name):
+    """DATA with missing values of NUMERIC_COLS replaced by the column means,
+    DATA itself if there are none."""
+    if not data[numeric_cols].isna().to_numpy().any():
+        return data
+    print(f"WARNING! {name} data contains nan values in numerical columns.")
+    print("For holdout distance analyses, nan values are replaced by column mean.")
+    return data.fillna(data[numeric_cols].mean())
+
+
+def _categories(datasets, column):
+    """Sorted categories of COLUMN over all DATASETS, missing values last as in OneHotEncoder."""
+    values = set().union(*[data[column].unique() for data in datasets])
+    missing = [value for value in values if pd.isna(value)]
+    categories = sorted(value for value in values if not pd.isna(value))
+    return np.array(categories + missing[:1], dtype=object)
+
+
+def _transform(data, encoder, quantiles, other_cols, numeric_cols):
+    """One-hot encoded categorical and normal quantile transformed numerical columns of DATA."""
+    parts = []
+    if len(other_cols):
+        parts.append(encoder.transform(data[other_cols]))
+    if len(numeric_cols):
+        parts.append(sparse.csr_matrix(quantiles.transform(data[numeric_cols].to_numpy(dtype=float))))
+    return sparse.hstack(parts).tocsr()
+
+
 # Method originally from https://github.com/mostly-ai/paper-fidelity-accuracy
 # specifically from https://colab.research.google.com/github/mostly-ai/paper-fidelity-accuracy/blob/main/2023-05/evaluate.ipynb#scrollTo=yYeyS8P7f9U0
 
@@ -34,33 +62,24 @@ def mostly_privacy_metrics(training, holdout, synthetic):
     numeric_cols = training.select_dtypes(include=np.number).columns
     other_cols = training.select_dtypes(exclude=np.number).columns
 
-    # check datasets for nan values in numeric columsn and replace by nanmean of columns
-    if any(any(row) for row in np.isnan(training[numeric_cols].values)):
-        print("WARNING! Training data contains nan values in numerical columns.")
-        training[numeric_cols] = training[numeric_cols].fillna(training[numeric_cols].mean())
-        print("For holdout distance analyses, nan values are replaced by column mean.")
-
-    if any(any(row) for row in np.isnan(holdout[numeric_cols].values)):
-        print("WARNING! Holdout data contains nan values in numerical columns.")
-        holdout[numeric_cols] = holdout[numeric_cols].fillna(holdout[numeric_cols].mean())
-        print("For holdout distance analyses, nan values are replaced by column mean.")
-
-    if any(any(row) for row in np.isnan(synthetic[numeric_cols].values)):
-        print("WARNING! Synthetic data contains nan values in numerical columns.")
-        synthetic[numeric_cols] = synthetic[numeric_cols].fillna(synthetic[numeric_cols].mean())
-        print("For holdout distance analyses, nan values are replaced by column mean.")
-
-    transformer = make_column_transformer(
-        (OneHotEncoder(handle_unknown="ignore"), other_cols),
-        (QuantileTransformer(output_distribution='normal'), numeric_cols),
-        remainder="passthrough",
-    )
-
-    transformer.fit(pd.concat([training, holdout, synthetic], axis=0))
-    training_hot = transformer.transform(training)
-    holdout_hot = transformer.transform(holdout)
-    synthetic_hot = transformer.transform(synthetic)
-    synthetic_hot = np.nan_to_num(synthetic_hot, copy=False)
+    # check datasets for nan values in numeric columsn and replace by nanmean of columns, the inputs are not modified
+    training = _fill_numeric_nan(training, numeric_cols, "Training")
+    holdout = _fill_numeric_nan(holdout, numeric_cols, "Holdout")
+    synthetic = _fill_numeric_nan(synthetic, numeric_cols, "Synthetic")
+
+    # fitted per column group on all three datasets, without concatenating the whole tables
+    encoder = OneHotEncoder(handle_unknown="ignore",
+                            categories=[_categories([training, holdout, synthetic], column) for column in other_cols])
+    quantiles = QuantileTransformer(output_distribution='normal')
+    if len(other_cols):
+        encoder.fit(training[other_cols])
+    if len(numeric_cols):
+        quantiles.fit(np.concatenate([data[numeric_cols].to_numpy(dtype=float)
+                                      for data in [training, holdout, synthetic]]))
+
+    training_hot = _transform(training, encoder, quantiles, other_cols, numeric_cols)
+    holdout_hot = _transform(holdout, encoder, quantiles, other_cols, numeric_cols)
+    synthetic_hot = _transform(synthetic, encoder, quantiles, other_cols, numeric_cols)
     synthetic_hot.data[np.isnan(synthetic_hot.data)] = 0
 
     print('calculate distances to training data')
@@ -0,0 +1,315 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Mergeable quantile sketches of the continuous features.
+
+A KLLSketch (Karnin, Lang and Liberty, "Optimal Quantile Approximation in
+Streams", 2016) summarizes a stream of values in O(k) memory.  It is built in
+one pass, sketches of chunks, partitions or replicates are merged into the
+sketch of their union, and ranks and quantiles are answered with a normalized
+rank error of at most rank_error() (with 99% confidence, as in Apache
+DataSketches).  The sketches of all continuous features of a dataset are
+persisted as JSON next to the outputs and drive approximate
+Kolmogorov-Smirnov statistics, percentile tables and ECDF and QQ plots:
+
+    python -m evaluation.quantile_sketch build -i data/input.csv --score MAGGIC -o original_sketches.json
+    python -m evaluation.quantile_sketch merge part1.json part2.json -o merged.json
+    python -m evaluation.quantile_sketch compare original_sketches.json synthetic_sketches.json -o output/sketch
+"""
+import json
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS
+
+SKETCH_VERSION = 1
+# k = 200 bounds the normalized rank error by 1.3%
+DEFAULT_K = 200
+MIN_LEVEL_CAPACITY = 8
+LEVEL_CAPACITY_RATIO = 2 / 3
+PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+GRID_SIZE = 512
+
+
+class KLLSketch:
+    """KLL quantile sketch of a stream of numbers.  The items of level h
+    represent 2**h values each.  Missing values are ignored."""
+
+    def __init__(self, k=DEFAULT_K, seed=0):
+        self.k = k
+        self.seed = seed
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(MIN_LEVEL_CAPACITY, int(np.ceil(self.k * LEVEL_CAPACITY_RATIO ** depth)))
+
+    def _compress(self):
+        # the random offsets are derived from the seed and the stream length, so a reloaded sketch continues the same
+        rng = np.random.default_rng([self.seed, self.n])
+        while sum(map(len, self.levels)) > sum(self._capacity(level) for level in range(len(self.levels))):
+            level = next(level for level in range(len(self.levels))
+                         if len(self.levels[level]) >= self._capacity(level))
+            items = np.sort(self.levels[level])
+            # an odd item stays on its level, every second of the others moves up with twice the weight
+            kept, items = items[:len(items) % 2], items[len(items) % 2:]
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = kept
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[rng.integers(2)::2]])
+        return self
+
+    def update(self, values):
+        """Add VALUES (an array or Series) to the sketch."""
+        values = np.asarray(pd.to_numeric(pd.Series(values), errors='coerce'), dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min, self.max = min(self.min, values.min()), max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        return self._compress()
+
+    def merge(self, other):
+        """Merge the sketch OTHER into this one."""
+        if other.n == 0:
+            return self
+        self.n += other.n
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        return self._compress()
+
+    def rank_error(self):
+        """Normalized rank error of cdf() and quantile() (99% confidence)."""
+        return 2.296 / self.k ** 0.9723
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def cdf(self, x):
+        """Estimated share of values <= X."""
+        if self.n == 0:
+            return np.full(np.shape(x), np.nan)
+        items, cumulative = self._weighted_items()
+        position = np.searchsorted(items, x, side='right')
+        return np.where(position > 0, cumulative[np.maximum(position - 1, 0)], 0.0) / cumulative[-1]
+
+    def quantile(self, q):
+        """Estimated Q-quantiles, the extremes are exact."""
+        if self.n == 0:
+            return np.full(np.shape(q), np.nan)
+        items, cumulative = self._weighted_items()
+        q = np.asarray(q, dtype=float)
+        position = np.minimum(np.searchsorted(cumulative, q * cumulative[-1], side='left'), len(items) - 1)
+        return np.where(q <= 0, self.min, np.where(q >= 1, self.max, items[position]))
+
+    def ecdf(self, grid_size=GRID_SIZE):
+        """ECDF on GRID_SIZE equally spaced probabilities, as the quantile grid ECDF of the plot summaries."""
+        probabilities = np.linspace(0, 1, grid_size)
+        return self.quantile(probabilities), probabilities
+
+    def to_dict(self):
+        return {'k': self.k, 'seed': self.seed, 'n': self.n,
+                'min': self.min if self.n else None, 'max': self.max if self.n else None,
+                'levels': [items.tolist() for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['k'], state['seed'])
+        sketch.n = state['n']
+        if sketch.n:
+            sketch.min, sketch.max = state['min'], state['max']
+        sketch.levels = [np.asarray(items, dtype=float) for items in state['levels']]
+        return sketch
+
+
+def ks_statistic(sketch_1, sketch_2):
+    """Approximate two-sample Kolmogorov-Smirnov statistic of two sketches,
+    its error bound and the asymptotic p-value."""
+    from scipy import stats
+    if sketch_1.n == 0 or sketch_2.n == 0:
+        return np.nan, np.nan, np.nan
+    # the supremum of the difference of two step functions is attained at one of their steps
+    points = np.concatenate(sketch_1.levels + sketch_2.levels)
+    statistic = float(np.max(np.abs(sketch_1.cdf(points) - sketch_2.cdf(points))))
+    effective_n = sketch_1.n * sketch_2.n / (sketch_1.n + sketch_2.n)
+    return statistic, sketch_1.rank_error() + sketch_2.rank_error(), \
+        float(stats.kstwobign.sf(np.sqrt(effective_n) * statistic))
+
+
+def continuous_features(medical_scores=(MEDICAL_SCORE.BIOHF, MEDICAL_SCORE.MAGGIC)):
+    """Continuous features of the FEATURE_SETS of MEDICAL_SCORES."""
+    return list(dict.fromkeys(column for score in medical_scores for column in FEATURE_SETS[score]['continuous']))
+
+
+class DatasetSketches:
+    """KLLSketches of the continuous features of one dataset."""
+
+    def __init__(self, columns, k=DEFAULT_K, seed=0):
+        self.sketches = {column: KLLSketch(k, seed) for column in columns}
+
+    @classmethod
+    def of(cls, data, columns=None, k=DEFAULT_K, seed=0):
+        """Sketches of the COLUMNS of DATA (default: all continuous features)."""
+        return cls(continuous_features() if columns is None else columns, k, seed).update(data)
+
+    def update(self, data):
+        """Add the records of DATA, e.g. the next chunk.  Columns DATA does not have are skipped."""
+        for column, sketch in self.sketches.items():
+            if column in data:
+                sketch.update(data[column])
+        return self
+
+    def merge(self, other):
+        for column, sketch in other.sketches.items():
+            if column in self.sketches:
+                self.sketches[column].merge(sketch)
+            else:
+                self.sketches[column] = KLLSketch.from_dict(sketch.to_dict())
+        return self
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """Table of the estimated PERCENTILES, counts and rank error bounds per column."""
+        table = pd.DataFrame({column: sketch.quantile(np.asarray(percentiles) / 100)
+                              for column, sketch in self.sketches.items()},
+                             index=[f"p{percentile}" for percentile in percentiles]).transpose()
+        table['n'] = [sketch.n for sketch in self.sketches.values()]
+        table['rank_error'] = [sketch.rank_error() for sketch in self.sketches.values()]
+        return table
+
+    def save(self, sketch_file):
+        with open(sketch_file, 'w') as json_file:
+            json.dump({'version': SKETCH_VERSION,
+                       'sketches': {column: sketch.to_dict() for column, sketch in self.sketches.items()}}, json_file)
+        return sketch_file
+
+    @classmethod
+    def load(cls, sketch_file):
+        with open(sketch_file) as json_file:
+            state = json.load(json_file)
+        if state.get('version') != SKETCH_VERSION:
+            raise ValueError(f"{sketch_file} has sketch version {state.get('version')}, expected {SKETCH_VERSION}.")
+        sketches = cls([])
+        sketches.sketches = {column: KLLSketch.from_dict(sketch) for column, sketch in state['sketches'].items()}
+        return sketches
+
+
+def ks_table(sketches_1, sketches_2, prefix=("DS_1", "DS_2")):
+    """Approximate Kolmogorov-Smirnov statistics of the columns of two DatasetSketches."""
+    rows = {}
+    for column in sketches_1.sketches:
+        if column not in sketches_2.sketches:
+            continue
+        sketch_1, sketch_2 = sketches_1.sketches[column], sketches_2.sketches[column]
+        statistic, error, p_value = ks_statistic(sketch_1, sketch_2)
+        rows[column] = {f'{prefix[0]}_N': sketch_1.n, f'{prefix[1]}_N': sketch_2.n,
+                        'd kolmogorov smirnov': statistic, 'd error bound': error,
+                        'p-value kolmogorov smirnov': p_value}
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def sketch_plot_jobs(sketches, output_prefix, image_format="png", columns=None):
+    """ECDF and QQ plot jobs for render_plots of the DatasetSketches SKETCHES
+    (a dictionary label -> DatasetSketches, the original first)."""
+    from evaluation.plots import qq_plot, sketch_ecdf_plot
+    original = next(iter(sketches.values()))
+    columns = list(original.sketches) if columns is None else columns
+    jobs = []
+    for column in columns:
+        if column not in original.sketches or original.sketches[column].n == 0:
+            continue
+        column_sketches = {label: dataset.sketches[column] for label, dataset in sketches.items()
+                           if column in dataset.sketches and dataset.sketches[column].n > 0}
+        if len(column_sketches) < 2:
+            continue
+        jobs.append((sketch_ecdf_plot, (column_sketches,),
+                     {'xlabel': column, 'save_to': f'{output_prefix}_ecdf-{column}.{image_format}'}))
+        jobs.append((qq_plot, (column_sketches,),
+                     {'xlabel': column, 'save_to': f'{output_prefix}_qq-{column}.{image_format}'}))
+    return jobs
+
+
+def build_sketches(input_path, columns=None, chunk_size=100000, k=DEFAULT_K):
+    """DatasetSketches of the csv file INPUT_PATH, read in chunks of CHUNK_SIZE rows."""
+    sketches = DatasetSketches(continuous_features() if columns is None else columns, k)
+    for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+        sketches.update(chunk)
+    return sketches
+
+
+if __name__ == "__main__":
+    import os
+    from pathlib import Path
+
+    argparser = ArgumentParser(description='Build, merge and compare quantile sketches of the continuous features.')
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='sketch a csv file in one pass')
+    build_parser.add_argument('--input', '-i', type=str, required=True,
+                              help='input csv file')
+    build_parser.add_argument('--score', type=str, nargs='+',
+                              default=[MEDICAL_SCORE.BIOHF.value, MEDICAL_SCORE.MAGGIC.value],
+                              choices=[MEDICAL_SCORE.MAGGIC.value, MEDICAL_SCORE.BIOHF.value],
+                              help='scores whose continuous features are sketched')
+    build_parser.add_argument('--chunk_size', type=int, default=100000,
+                              help='rows read at once')
+    build_parser.add_argument('-k', type=int, default=DEFAULT_K,
+                              help='sketch size parameter, the rank error decreases with about 1/k')
+    build_parser.add_argument('--output', '-o', type=str, required=True,
+                              help='sketch file')
+    merge_parser = subparsers.add_parser('merge', help='merge sketch files of chunks, partitions or replicates')
+    merge_parser.add_argument('sketch_files', type=str, nargs='+')
+    merge_parser.add_argument('--output', '-o', type=str, required=True,
+                              help='merged sketch file')
+    compare_parser = subparsers.add_parser('compare', help='compare the first sketch file with the others')
+    compare_parser.add_argument('sketch_files', type=str, nargs='+')
+    compare_parser.add_argument('--output', '-o', type=str, required=True,
+                                help='prefix of the written tables and plots')
+    compare_parser.add_argument('--image_format', type=str, default="png",
+                                help='file format of the plots')
+    args = argparser.parse_args()
+
+    if args.command == 'build':
+        columns = continuous_features([MEDICAL_SCORE(score) for score in args.score])
+        build_sketches(args.input, columns, args.chunk_size, args.k).save(args.output)
+    elif args.command == 'merge':
+        merged = DatasetSketches.load(args.sketch_files[0])
+        for sketch_file in args.sketch_files[1:]:
+            merged.merge(DatasetSketches.load(sketch_file))
+        merged.save(args.output)
+        print(merged.percentiles().to_string())
+    else:
+        from evaluation.plots import render_plots
+        Path(os.path.dirname(os.path.abspath(args.output))).mkdir(parents=True, exist_ok=True)
+        sketches = {Path(sketch_file).stem: DatasetSketches.load(sketch_file) for sketch_file in args.sketch_files}
+        labels = list(sketches)
+        for label in labels:
+            sketches[label].percentiles().to_csv(f"{args.output}_percentiles_{label}.csv")
+        for label in labels[1:]:
+            table = ks_table(sketches[labels[0]], sketches[label], (labels[0], label))
+            print(table.to_string())
+            table.to_csv(f"{args.output}_ks_{labels[0]}_vs_{label}.csv")
+        render_plots(sketch_plot_jobs(sketches, args.output, args.image_format))
@@ -0,0 +1,187 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Re-identification risks of a released dataset from its equivalence classes.
+
+The records of a release are grouped by their values of the quasi-identifiers
+of the anonymization (QUASI_IDENTIFIERS), by hashing the combined integer codes
+of the values instead of comparing records, so that millions of records are
+profiled in seconds.  Records whose quasi-identifiers are all missing or
+suppressed ("*") are suppressed records and not part of any class.
+
+From the class size f of a record in the release and the size F of the
+matching class in a population, the usual risk measures follow:
+
+- prosecutor risk 1 / f, the attacker knows the person is in the release,
+- journalist risk 1 / F, the attacker links a record to the population (0 if
+  no person of the population has the values of the record),
+- marketer risk, the expected share of re-identified records when all records
+  are linked, i.e. the mean journalist risk.
+
+Without a population, the release is its own population (F = f).  The
+population has to be in the representation of the release: the original for
+synthetic data, while the microaggregated and generalized values of an
+anonymized release do not match the original values.  Unlike the anonymeter
+attacks, the profile needs no sampling and is a cheap pre-screen of a release:
+
+    python -m evaluation.risk_profile -i anonymized.csv synthetic.csv --score MAGGIC
+"""
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+from evaluation.constants import MEDICAL_SCORE, QUASI_IDENTIFIERS
+
+# k of the anonymization (AnonymizationParameters.DEFAULT)
+K_ANONYMITY = 2
+# suppressed and missing values as written by ARX and the analysis scripts
+MISSING_VALUES = ["*", "nan", "NULL"]
+# upper bounds of the risk intervals of the distribution, ARX style
+RISK_BINS = [0, 0.01, 0.05, 0.1, 0.2, 0.25, 1 / 3, 0.5, 1]
+RISK_QUANTILES = [0.5, 0.9, 0.99]
+
+
+def _column_codes(values):
+    """Integer codes of VALUES, numbers are compared by value (1, 1.0 and "1"
+    have the same code).  Returns the codes, the number of codes and the mask
+    of the missing or suppressed values, which share the last code."""
+    # the distinct values are hashed once, only they are converted to numbers
+    codes, uniques = pd.factorize(values.to_numpy())
+    uniques = pd.Series(uniques, dtype=object)
+    suppressed = uniques.isin(MISSING_VALUES).to_numpy()
+    numeric = pd.to_numeric(uniques.mask(suppressed), errors='coerce')
+    canonical, categories = pd.factorize(numeric.astype(object).where(numeric.notna(), uniques.astype(str)))
+    canonical = np.append(np.where(suppressed, len(categories), canonical), len(categories))
+    missing = np.append(suppressed, True)[codes]
+    return canonical[codes], len(categories) + 1, missing
+
+
+def equivalence_classes(data, quasi_identifiers):
+    """Equivalence class of every record of DATA and the mask of the
+    suppressed records (all QUASI_IDENTIFIERS missing or suppressed)."""
+    key = np.zeros(len(data), dtype=np.int64)
+    n_keys = 1
+    suppressed = np.ones(len(data), dtype=bool)
+    for column in quasi_identifiers:
+        codes, n_codes, missing = _column_codes(data[column])
+        if n_keys * n_codes >= 2 ** 62:
+            # renumber the distinct keys before the combined key overflows
+            key, uniques = pd.factorize(key)
+            n_keys = len(uniques)
+        key = key * n_codes + codes
+        n_keys *= n_codes
+        suppressed &= missing
+    return pd.factorize(key)[0], suppressed
+
+
+def risk_distribution(risks):
+    """Share of the records per risk interval ]lower, upper] of RISK_BINS, records without risk in '0'."""
+    bins = np.searchsorted(RISK_BINS, risks, side='left')
+    labels = ["0"] + [f"]{lower:.3g}, {upper:.3g}]" for lower, upper in zip(RISK_BINS[:-1], RISK_BINS[1:])]
+    shares = np.bincount(bins, minlength=len(labels)) / max(len(risks), 1)
+    return pd.Series(shares, index=pd.Index(labels, name='risk'))
+
+
+def risk_profile(release, quasi_identifiers, k=K_ANONYMITY, population=None):
+    """Risk profile of RELEASE over its QUASI_IDENTIFIERS, with the classes of
+    POPULATION for the journalist and marketer risk.  Returns the summary
+    (record counts, risk means, maxima and quantiles, share of records in
+    classes smaller than K, uniqueness) and the distribution of the prosecutor
+    and journalist risks of the records."""
+    quasi_identifiers = [column for column in quasi_identifiers if column in release]
+    n_release = len(release)
+    records = release[quasi_identifiers]
+    if population is not None:
+        records = pd.concat([records, population[quasi_identifiers]], ignore_index=True)
+    classes, suppressed = equivalence_classes(records, quasi_identifiers)
+    n_classes = classes.max() + 1 if len(classes) else 0
+
+    released = classes[:n_release][~suppressed[:n_release]]
+    class_sizes = np.bincount(released, minlength=n_classes)
+    sizes = class_sizes[released]
+    if population is None:
+        population_sizes = sizes
+    else:
+        population_classes = classes[n_release:][~suppressed[n_release:]]
+        population_sizes = np.bincount(population_classes, minlength=n_classes)[released]
+
+    prosecutor = 1 / sizes
+    journalist = np.divide(1, population_sizes, out=np.zeros(len(sizes)), where=population_sizes > 0)
+    n_records = max(len(released), 1)
+    summary = {'records': n_release,
+               'quasi_identifiers': len(quasi_identifiers),
+               'suppressed_share': suppressed[:n_release].sum() / max(n_release, 1),
+               'classes': int(np.count_nonzero(class_sizes)),
+               'min_class_size': sizes.min() if len(sizes) else np.nan,
+               f'records_below_k{k}': np.count_nonzero(sizes < k) / n_records,
+               'sample_uniqueness': np.count_nonzero(sizes == 1) / n_records,
+               'population_uniqueness': np.count_nonzero(population_sizes == 1) / n_records,
+               'population_match_share': np.count_nonzero(population_sizes > 0) / n_records}
+    for measure, risks in [('prosecutor', prosecutor), ('journalist', journalist)]:
+        summary[f'{measure}_risk_mean'] = risks.mean() if len(risks) else np.nan
+        summary[f'{measure}_risk_max'] = risks.max() if len(risks) else np.nan
+        for quantile in RISK_QUANTILES:
+            summary[f'{measure}_risk_p{quantile * 100:g}'] = np.quantile(risks, quantile) if len(risks) else np.nan
+        summary[f'{measure}_records_above_1/k'] = np.count_nonzero(risks > 1 / k) / n_records
+    summary['marketer_risk'] = summary['journalist_risk_mean']
+    distribution = pd.DataFrame({'prosecutor': risk_distribution(prosecutor),
+                                 'journalist': risk_distribution(journalist)})
+    return pd.Series(summary), distribution
+
+
+def risk_profiles(releases, quasi_identifiers, k=K_ANONYMITY, populations=None):
+    """Risk profiles of the labelled RELEASES (label -> DataFrame), POPULATIONS
+    maps labels to their population (missing labels: the release itself).
+    Returns the summary table (one column per release) and the distribution
+    table (columns release x measure)."""
+    populations = {} if populations is None else populations
+    summaries, distributions = {}, {}
+    for label, release in releases.items():
+        summaries[label], distributions[label] = risk_profile(release, quasi_identifiers, k, populations.get(label))
+    return pd.DataFrame(summaries), pd.concat(distributions, axis=1)
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Equivalence class based re-identification risks of released datasets.')
+    argparser.add_argument('--input', '-i', type=str, nargs='+', required=True,
+                           help='csv files of the released datasets')
+    argparser.add_argument('--score', type=str, default=MEDICAL_SCORE.MAGGIC.value,
+                           choices=[score.value for score in MEDICAL_SCORE],
+                           help='score whose quasi-identifiers define the equivalence classes')
+    argparser.add_argument('--population', '-p', type=str, default=None,
+                           help='csv file of the population for the journalist and marketer risk, e.g. the original '
+                                'data for synthetic releases (default: every release is its own population)')
+    argparser.add_argument('-k', type=int, default=K_ANONYMITY,
+                           help='records in classes smaller than k are reported')
+    argparser.add_argument('--output', '-o', type=str, default=None,
+                           help='output path of the summary and distribution csv files')
+    args = argparser.parse_args()
+
+    quasi_identifiers = QUASI_IDENTIFIERS[MEDICAL_SCORE(args.score)]
+    population = None if args.population is None else \
+        pd.read_csv(args.population, usecols=lambda column: column in quasi_identifiers)
+    releases = {os.path.splitext(os.path.basename(path))[0]:
+                pd.read_csv(path, usecols=lambda column: column in quasi_identifiers) for path in args.input}
+    summary, distribution = risk_profiles(releases, quasi_identifiers, args.k,
+                                          {label: population for label in releases})
+    print(summary.to_string())
+    print(distribution.round(4).to_string())
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+        summary.to_csv(os.path.join(args.output, f"risk_profile_{args.score}.csv"))
+        distribution.to_csv(os.path.join(args.output, f"risk_distribution_{args.score}.csv"))
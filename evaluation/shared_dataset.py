@@ -0,0 +1,287 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Datasets shared with worker processes without copying them.
+
+A process pool that gets the original, processed and control datasets as
+arguments pickles them to every worker, so start-up time and memory grow with
+the number of workers.  A SharedDataset instead holds the numeric columns of a
+DataFrame as one float64 matrix and the other columns as integer codes of
+their categories in shared memory (or in memory-mapped .npy files of a
+directory), and only its handle (block names, shapes, column names and
+categories) is sent to the workers, which attach to the same memory by name:
+
+    with SharedDatasets({"original": original, "control": control}) as shared:
+        with ProcessPoolExecutor(initializer=attach_datasets, initargs=(shared.handles,)) as executor:
+            ...  # in the workers: attached_dataset("original").frame()
+
+The orchestrator owns the memory and releases it when it closes the
+SharedDatasets; the workers are processes of a multiprocessing pool of the
+orchestrator (they share its resource tracker) and only close their views.
+The codes of a column refer to the categories of this column over all
+datasets of one SharedDatasets, so they are comparable across the datasets.
+The shared arrays are read-only in the workers.
+"""
+import os
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+BACKENDS = ["shared_memory", "memmap"]
+
+# datasets attached by this worker process, see attach_datasets
+_ATTACHED = {}
+
+
+def _is_numeric(column):
+    return pd.api.types.is_numeric_dtype(column.dtype) or pd.api.types.is_bool_dtype(column.dtype)
+
+
+def shared_categories(datasets):
+    """Categories of every non-numeric column over all DATASETS, sorted if
+    the values can be compared."""
+    values = {}
+    for data in datasets:
+        for column in data.columns:
+            if not _is_numeric(data[column]):
+                values.setdefault(column, []).append(pd.unique(data[column].dropna().to_numpy(dtype=object)))
+    categories = {}
+    for column, uniques in values.items():
+        index = pd.Index(np.concatenate(uniques), dtype=object).unique()
+        try:
+            index = index.sort_values()
+        except TypeError:
+            index = pd.Index(sorted(index, key=str), dtype=object)
+        categories[column] = index
+    return categories
+
+
+class _Mapping(shared_memory.SharedMemory):
+    """SharedMemory whose mapping lives as long as the arrays on its buffer.
+    numpy does not keep a buffer export of the memoryview buf, so closing the
+    mmap would unmap the memory under the arrays of the frames; close only
+    drops the references, the arrays keep buf and the mmap alive and the
+    memory is unmapped with the last of them."""
+
+    def close(self):
+        self._buf = None
+        self._mmap = None
+        if getattr(self, '_fd', -1) >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class _Block:
+    """Array in shared memory or in a memory-mapped .npy file, column-major so
+    that the columns are contiguous.  LOCATION is the name of the shared
+    memory or the path of the file, None for an empty array, which is not
+    shared."""
+
+    def __init__(self, array, location, memory=None):
+        self.array = array
+        self.location = location
+        self.memory = memory
+
+    @classmethod
+    def create(cls, shape, dtype, backend, directory):
+        if int(np.prod(shape)) == 0:
+            return cls(np.empty(shape, dtype=dtype, order='F'), None)
+        if backend == "memmap":
+            path = os.path.join(directory, f"shared_{uuid.uuid4().hex}.npy")
+            return cls(np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape, fortran_order=True), path)
+        memory = _Mapping(create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        return cls(np.ndarray(shape, dtype=dtype, buffer=memory.buf, order='F'), memory.name, memory)
+
+    @classmethod
+    def attach(cls, spec, backend):
+        location, shape, dtype = spec
+        if location is None:
+            array = np.empty(shape, dtype=dtype, order='F')
+            memory = None
+        elif backend == "memmap":
+            array = np.load(location, mmap_mode='r')
+            memory = None
+        else:
+            memory = _Mapping(name=location)
+            array = np.ndarray(shape, dtype=dtype, buffer=memory.buf, order='F')
+        array.flags.writeable = False
+        return cls(array, location, memory)
+
+    def spec(self):
+        return self.location, self.array.shape, self.array.dtype.str
+
+    def close(self, unlink=False):
+        self.array = None
+        if self.memory is not None:
+            # views of the caller keep the mapping until they are gone
+            self.memory.close()
+            if unlink:
+                self.memory.unlink()
+        elif unlink and self.location is not None:
+            os.remove(self.location)
+
+
+class SharedDataset:
+    """One DataFrame in shared memory: the numeric columns as a float64
+    matrix (numeric), the other columns as int32 codes of their categories
+    (codes, -1 for missing values as in pandas.Categorical) and an integer index."""
+
+    def __init__(self, handle, blocks):
+        self.handle = handle
+        self._blocks = blocks
+
+    @classmethod
+    def create(cls, data, categories, backend="shared_memory", directory=None):
+        """Copy DATA to new shared blocks, the codes refer to CATEGORIES (see shared_categories)."""
+        numeric_columns = [column for column in data.columns if _is_numeric(data[column])]
+        categorical_columns = [column for column in data.columns if column not in numeric_columns]
+        blocks = {'numeric': _Block.create((len(data), len(numeric_columns)), np.float64, backend, directory),
+                  'codes': _Block.create((len(data), len(categorical_columns)), np.int32, backend, directory)}
+        for i, column in enumerate(numeric_columns):
+            blocks['numeric'].array[:, i] = data[column].to_numpy(dtype=float, na_value=np.nan)
+        for i, column in enumerate(categorical_columns):
+            blocks['codes'].array[:, i] = pd.Categorical(data[column], categories=categories[column]).codes
+
+        if isinstance(data.index, pd.RangeIndex):
+            index = ('range', data.index.start, data.index.stop, data.index.step)
+        elif pd.api.types.is_integer_dtype(data.index.dtype):
+            blocks['index'] = _Block.create((len(data),), np.int64, backend, directory)
+            blocks['index'].array[:] = data.index.to_numpy()
+            index = ('shared', data.index.name)
+        else:
+            # e.g. string labels, sent with the handle
+            index = ('values', data.index)
+        handle = {'backend': backend,
+                  'columns': list(data.columns),
+                  'numeric_columns': numeric_columns,
+                  'dtypes': {column: data[column].dtype for column in numeric_columns},
+                  'categorical_columns': categorical_columns,
+                  'categories': {column: categories[column] for column in categorical_columns},
+                  'index': index,
+                  'blocks': {name: block.spec() for name, block in blocks.items()}}
+        return cls(handle, blocks)
+
+    @classmethod
+    def attach(cls, handle):
+        """Read-only view of the dataset of HANDLE, without copying it."""
+        return cls(handle, {name: _Block.attach(spec, handle['backend']) for name, spec in handle['blocks'].items()})
+
+    @property
+    def numeric(self):
+        return self._blocks['numeric'].array
+
+    @property
+    def codes(self):
+        return self._blocks['codes'].array
+
+    @property
+    def index(self):
+        kind, *values = self.handle['index']
+        if kind == 'range':
+            return pd.RangeIndex(*values)
+        if kind == 'shared':
+            return pd.Index(self._blocks['index'].array, name=values[0], copy=False)
+        return values[0]
+
+    def categorical(self, column, decode=True):
+        """Column of the categorical features, as its values or (not DECODE) as pandas.Categorical on the codes."""
+        i = self.handle['categorical_columns'].index(column)
+        values = pd.Categorical.from_codes(self.codes[:, i], categories=self.handle['categories'][column])
+        return np.asarray(values, dtype=object) if decode else values
+
+    def frame(self, decode=True):
+        """DataFrame with the columns and index of the shared dataset.  The
+        float64 columns are read-only views of the shared matrix, numeric
+        columns of other types (also nullable ones like Int64) are converted
+        back to them.  The other columns
+        are decoded to their values, or (not DECODE) categoricals on the
+        shared codes."""
+        positions = {column: i for i, column in enumerate(self.handle['numeric_columns'])}
+        columns = {}
+        for column in self.handle['columns']:
+            if column in positions:
+                values = self.numeric[:, positions[column]]
+                dtype = self.handle['dtypes'][column]
+                if dtype == np.float64:
+                    columns[column] = values
+                elif pd.api.types.is_extension_array_dtype(dtype):
+                    # nullable dtypes such as Int64, NaN becomes NA
+                    columns[column] = pd.array(values, dtype=dtype)
+                else:
+                    columns[column] = values.astype(dtype)
+            else:
+                columns[column] = self.categorical(column, decode=decode)
+        # without copy, the columns are not consolidated into new blocks
+        return pd.DataFrame(columns, index=self.index, copy=False)
+
+    def close(self, unlink=False):
+        """Close the views of this process, with UNLINK also remove the shared memory (orchestrator only)."""
+        for block in self._blocks.values():
+            block.close(unlink)
+
+
+class SharedDatasets:
+    """The labelled DATASETS (label -> DataFrame) in shared memory, or with
+    BACKEND 'memmap' in memory-mapped files of DIRECTORY.  Owned by the
+    creating process, which releases the memory with close (or at the end of
+    a with block); the picklable handles attach them in the workers."""
+
+    def __init__(self, datasets, backend="shared_memory", directory=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, choose one of {BACKENDS}.")
+        if backend == "memmap":
+            if directory is None:
+                raise ValueError("The memmap backend requires a directory.")
+            os.makedirs(directory, exist_ok=True)
+        categories = shared_categories(datasets.values())
+        self.datasets = {}
+        try:
+            for label, data in datasets.items():
+                self.datasets[label] = SharedDataset.create(data, categories, backend, directory)
+        except BaseException:
+            self.close()
+            raise
+
+    @property
+    def handles(self):
+        return {label: dataset.handle for label, dataset in self.datasets.items()}
+
+    def close(self):
+        for dataset in self.datasets.values():
+            dataset.close(unlink=True)
+        self.datasets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach_datasets(handles):
+    """Attach the datasets of HANDLES (label -> handle) in this worker
+    process, e.g. as initializer of a process pool."""
+    for label, handle in handles.items():
+        if label in _ATTACHED:
+            _ATTACHED[label].close()
+        _ATTACHED[label] = SharedDataset.attach(handle)
+
+
+def attached_dataset(label):
+    """The dataset LABEL attached by attach_datasets."""
+    return _ATTACHED[label]
@@ -0,0 +1,211 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Batch runs of the utility and risk analysis for many input extracts.
+
+The manifest is a csv file with one row per input extract and the columns
+
+- input: csv file of the extract,
+- output: output directory, the results of every score go to <output>/<score>,
+- analysis (optional): "utility" (default) or "risk",
+- score (optional): BIOHF or MAGGIC, both if empty,
+- name (optional): unique name of the job, by default the name of the input file,
+
+and optionally further columns with the keyword arguments of the
+full_data_analysis function of the analysis (e.g. arx_time_limit,
+model_selection, n_splits, memory_budget in GB, profile):
+
+    python -m pipeline.batch -m manifest.csv -o output/batch --workers 2
+
+The jobs run in a pool of worker processes that keep the imported libraries,
+the embedded R with the sourced scoring script and a JVM running the ARX jar in
+server mode warm from one job to the next.  Every job runs in its own work
+directory, to which the relative temporary files of the pipeline are written,
+and with its own log file; a failing job is recorded in the index file
+batch_index.csv and does not stop the others.
+"""
+import importlib
+import os
+import re
+import time
+import traceback
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout, redirect_stderr
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from evaluation.constants import MEDICAL_SCORE
+from profiling.instrumentation import Profiler
+
+ANALYSES = {"utility": "script_utility_analysis", "risk": "script_risk_analysis"}
+MANIFEST_COLUMNS = ["name", "analysis", "input", "output", "score"]
+SCORES = [MEDICAL_SCORE.BIOHF.value, MEDICAL_SCORE.MAGGIC.value]
+INDEX_FILE = "batch_index.csv"
+# columns of the index taken from the job
+JOB_COLUMNS = ["position", "name", "analysis", "score", "input", "output"]
+# libraries imported by the workers before their first job, if installed
+WARM_MODULES = ["ASyH", "anonymeter.evaluators", "matplotlib.pyplot"]
+
+
+def load_manifest(manifest_file):
+    """Jobs of MANIFEST_FILE, one per row and score, with absolute paths."""
+    manifest = pd.read_csv(manifest_file, dtype={"name": str, "analysis": str, "score": str})
+    missing = [column for column in ["input", "output"] if column not in manifest]
+    if missing:
+        raise ValueError(f"The manifest {manifest_file} lacks the columns {missing}.")
+    names = manifest["name"].dropna() if "name" in manifest else pd.Series(dtype=str)
+    if names.duplicated().any():
+        raise ValueError(f"The manifest {manifest_file} has the duplicate names {sorted(names[names.duplicated()])}.")
+    jobs = []
+    for position, row in manifest.iterrows():
+        analysis = row.get("analysis") if pd.notna(row.get("analysis")) else "utility"
+        if analysis not in ANALYSES:
+            raise ValueError(f"Unknown analysis {analysis} in row {position}, choose one of {list(ANALYSES)}.")
+        name = row.get("name") if pd.notna(row.get("name")) else Path(row["input"]).stem
+        scores = [row["score"]] if pd.notna(row.get("score")) else SCORES
+        options = {column: value.item() if hasattr(value, "item") else value
+                   for column, value in row.drop(MANIFEST_COLUMNS, errors="ignore").items() if pd.notna(value)}
+        for score in scores:
+            jobs.append({"position": position, "name": name, "analysis": analysis, "score": MEDICAL_SCORE(score).value,
+                         "input": os.path.abspath(row["input"]),
+                         "output": os.path.abspath(os.path.join(row["output"], score)),
+                         "options": options})
+    return jobs
+
+
+def _analysis_arguments(job):
+    """Keyword arguments of full_data_analysis for the options of JOB."""
+    options = dict(job["options"])
+    for option, value in options.items():
+        # integers of columns with empty cells are read as floats
+        if isinstance(value, float) and value.is_integer() and option != "arx_time_limit":
+            options[option] = int(value)
+    if "memory_budget" in options:
+        options["memory_budget"] = int(options["memory_budget"] * 2 ** 30)
+    profile = str(options.pop("profile", False)).lower() in ("true", "1", "yes")
+    options["profiler"] = Profiler(f"{job['analysis']}_analysis_{job['score']}", enabled=profile,
+                                   memory_budget=options.get("memory_budget"))
+    return options
+
+
+def warm_up(jvm_heap=None):
+    """Import the pipeline and its libraries, start the embedded R and register
+    the jar server, whose JVM starts with the first anonymization.  Run once
+    per worker, the jobs of the worker share them."""
+    from anonymization.anonymization_script import start_jar_server
+    from score_calculation.score_calculation import load_r_scoring
+    for module in list(ANALYSES.values()) + WARM_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as excpt:
+            print(f"Could not import {module} in advance: {excpt}")
+    start_jar_server(jvm_heap)
+    try:
+        load_r_scoring()
+    except Exception as excpt:
+        print(f"Could not start R in advance: {excpt}")
+
+
+def run_job(job, batch_dir):
+    """Run JOB in its own work directory under BATCH_DIR, with the output
+    written to its log file.  Returns the row of the job in the index."""
+    # default names (the input file names) may repeat, the row of the manifest makes the directory unique
+    job_dir = os.path.join(batch_dir, "jobs",
+                           re.sub('[^A-Za-z0-9_.-]', '_', f"{job['position']:04d}_{job['name']}_{job['score']}"))
+    Path(job_dir).mkdir(parents=True, exist_ok=True)
+    Path(job["output"]).mkdir(parents=True, exist_ok=True)
+    log_file = os.path.join(job_dir, "job.log")
+    row = {key: job[key] for key in JOB_COLUMNS}
+    row.update(status="ok", error=None, pid=os.getpid(), started=datetime.now().isoformat(timespec='seconds'))
+    start = time.perf_counter()
+    cwd = os.getcwd()
+    with open(log_file, "w") as log, redirect_stdout(log), redirect_stderr(log):
+        try:
+            os.chdir(job_dir)
+            analysis = importlib.import_module(ANALYSES[job["analysis"]])
+            analysis.full_data_analysis(job["input"], job["output"], MEDICAL_SCORE(job["score"]),
+                                        **_analysis_arguments(job))
+        except Exception as excpt:
+            traceback.print_exc()
+            row.update(status="failed", error=f"{type(excpt).__name__}: {excpt}")
+        finally:
+            os.chdir(cwd)
+    row.update(seconds=round(time.perf_counter() - start, 3), log=log_file)
+    return row
+
+
+def _write_index(rows, batch_dir):
+    index = pd.DataFrame(rows).sort_values(["position", "score"]).drop(columns="position")
+    index.to_csv(os.path.join(batch_dir, INDEX_FILE), index=False)
+    return index
+
+
+def run_batch(manifest_file, batch_dir, max_workers=None, jvm_heap=None):
+    """Run the jobs of MANIFEST_FILE in a pool of MAX_WORKERS warm worker
+    processes (in this process if MAX_WORKERS is 1), the largest inputs first.
+    The index of the finished jobs is rewritten to BATCH_DIR after every job.
+    JVM_HEAP limits the heap of the JVM of every worker to this many bytes.
+    Returns the index."""
+    batch_dir = os.path.abspath(batch_dir)
+    Path(batch_dir).mkdir(parents=True, exist_ok=True)
+    jobs = load_manifest(manifest_file)
+    jobs.sort(key=lambda job: os.path.getsize(job["input"]) if os.path.exists(job["input"]) else 0, reverse=True)
+    print(f"Running {len(jobs)} jobs of {manifest_file}.")
+
+    rows = []
+    if max_workers == 1:
+        warm_up(jvm_heap)
+        for job in jobs:
+            rows.append(run_job(job, batch_dir))
+            print(f"Job {job['name']} ({job['score']}) finished: {rows[-1]['status']}.")
+            _write_index(rows, batch_dir)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=warm_up, initargs=(jvm_heap,)) as executor:
+            futures = {executor.submit(run_job, job, batch_dir): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    rows.append(future.result())
+                except Exception as excpt:
+                    # the worker process died, e.g. in R
+                    rows.append({key: job[key] for key in JOB_COLUMNS})
+                    rows[-1].update(status="crashed", error=f"{type(excpt).__name__}: {excpt}")
+                print(f"Job {job['name']} ({job['score']}) finished: {rows[-1]['status']}.")
+                _write_index(rows, batch_dir)
+    index = _write_index(rows, batch_dir)
+    print(index[["name", "analysis", "score", "status", "seconds"]].to_string(index=False))
+    return index
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Run the utility or risk analysis for every input extract of a manifest '
+                                           'in a pool of warm worker processes.')
+    argparser.add_argument('--manifest', '-m', type=str, required=True,
+                           help='csv file with the columns input, output and optionally analysis, score, name and '
+                                'options of the analysis')
+    argparser.add_argument('--output', '-o', type=str, default=os.path.join('output', 'batch'),
+                           help='directory of the index file and of the work directories and logs of the jobs')
+    argparser.add_argument('--workers', type=int, default=None,
+                           help='number of worker processes (default: number of CPUs)')
+    argparser.add_argument('--jvm_heap', type=float, default=None,
+                           help='heap of the ARX JVM of every worker in GB (default: JVM default)')
+    args = argparser.parse_args()
+
+    run_batch(args.manifest, args.output, max_workers=args.workers,
+              jvm_heap=None if args.jvm_heap is None else int(args.jvm_heap * 2 ** 30))
@@ -0,0 +1,238 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Partitioned execution of the anonymization and the synthesis.
+
+The cleaned cohort is split by a partition key (by default the clinical
+`site`), and every partition is anonymized with ARX and/or synthesized with the
+GaussianCopula model in its own worker process and temporary directory.  The
+per-partition releases are merged with a `partition` column recording their
+provenance, and fidelity and privacy metrics are computed per partition:
+
+    python -m pipeline.partitioned -i data/input.csv -o output/partitioned --score MAGGIC
+
+Since ARX has to search the generalization lattice for every partition
+separately, small partitions are much cheaper and run in parallel.  Note that
+k-anonymity then holds within every partition, which is what a per-site
+release needs; the merged release is k-anonymous as well, as equivalence
+classes of different partitions only add up.
+"""
+import os
+import re
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS, get_attributes
+from preprocessing.filtering import select_score_subsample
+from preprocessing.preprocess_UCC import preprocess, drop_column_cleanup, drop_score_columns
+from profiling.instrumentation import Profiler
+
+MODES = ["anonymized", "synthetic"]
+PARTITION_COLUMN = "partition"
+# partitions with fewer records are pooled into one partition, ARX would suppress most of them
+MIN_PARTITION_SIZE = 50
+SMALL_PARTITIONS = "pooled_small_partitions"
+
+
+def split_partitions(data, key="site", min_size=MIN_PARTITION_SIZE):
+    """Split DATA by the column KEY into a dictionary partition name -> DataFrame.
+    Records with a missing KEY and partitions with less than MIN_SIZE records
+    are pooled into one partition."""
+    keys = data[key].astype(object).where(data[key].notna(), SMALL_PARTITIONS).astype(str)
+    sizes = keys.value_counts()
+    keys = keys.where(keys.map(sizes) >= min_size, SMALL_PARTITIONS)
+    return {partition: data[keys == partition] for partition in sorted(keys.unique())}
+
+
+def _partition_dir(work_dir, mode, partition):
+    # unique temporary directory per partition and mode, the pipeline functions overwrite their temp files
+    return os.path.join(work_dir, f"{mode}_{re.sub('[^A-Za-z0-9_.-]', '_', partition)}")
+
+
+def run_partition(partition, data, mode, medical_score, work_dir):
+    """Anonymize (MODE 'anonymized') or synthesize (MODE 'synthetic') the
+    records DATA of one partition.  Returns (PARTITION, MODE, released data)."""
+    partition_dir = _partition_dir(work_dir, mode, partition)
+    Path(partition_dir).mkdir(parents=True, exist_ok=True)
+    temp_file = os.path.join(partition_dir, "input.csv")
+    output_file = os.path.join(partition_dir, "output.csv")
+    if mode == "anonymized":
+        from anonymization.anonymization_script import anonymize_ucc_cardio_data
+        released = anonymize_ucc_cardio_data(drop_score_columns(data), temp_file=temp_file,
+                                             output_file=output_file, anon_type=medical_score)
+    elif mode == "synthetic":
+        from synthetization.synthetization_script import synthesize_ucc_cardio_data
+        released = synthesize_ucc_cardio_data(drop_score_columns(data), temp_file=temp_file,
+                                              output_file=output_file)
+    else:
+        raise ValueError(f"Unknown mode {mode}, choose one of {MODES}.")
+    print(f"Partition {partition} ({mode}) finished with {len(released)} records.")
+    return partition, mode, released
+
+
+def _run_partition_job(job):
+    return run_partition(*job)
+
+
+def run_partitioned(data, medical_score, modes=MODES, key="site", work_dir=os.path.join("temp", "partitions"),
+                    max_workers=None, min_size=MIN_PARTITION_SIZE):
+    """Split DATA by KEY and release every partition in every mode of MODES in
+    a pool of MAX_WORKERS processes (serially if MAX_WORKERS is 1).
+
+    Returns a dictionary mode -> merged release with a PARTITION_COLUMN, and the
+    dictionary of original partitions.
+    """
+    work_dir = os.path.abspath(work_dir)
+    partitions = split_partitions(data, key, min_size)
+    print(f"Partitions by {key}: " + ", ".join(f"{name} ({len(part)})" for name, part in partitions.items()))
+    jobs = [(partition, part, mode, medical_score, work_dir)
+            for mode in modes for partition, part in partitions.items()]
+
+    if max_workers == 1 or len(jobs) <= 1:
+        results = [_run_partition_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_run_partition_job, jobs))
+
+    releases = {}
+    for mode in modes:
+        releases[mode] = pd.concat([released.assign(**{PARTITION_COLUMN: partition})
+                                    for partition, released_mode, released in results if released_mode == mode],
+                                   ignore_index=True)
+    return releases, partitions
+
+
+def _normalized(data, columns):
+    """COLUMNS of DATA as strings, with numbers in a canonical format, so that
+    e.g. 64, 64.0 and "64" compare equal."""
+    normalized = {}
+    for column in columns:
+        values = data[column] if column in data else pd.Series(np.nan, index=data.index)
+        numeric = pd.to_numeric(values, errors='coerce')
+        normalized[column] = np.where(numeric.notna(), numeric.map(repr), values.astype(str))
+    return pd.DataFrame(normalized, index=data.index)
+
+
+def fidelity_metrics(original, released, featureset_cont, featureset_cat):
+    """Mean absolute standardized mean difference of the continuous features
+    and mean total variation distance of the categorical features.  Generalized
+    (non numeric) values of anonymized data are ignored for the former."""
+    smd = []
+    for column in featureset_cont:
+        if column not in original or column not in released:
+            continue
+        orig = pd.to_numeric(original[column], errors='coerce')
+        rel = pd.to_numeric(released[column], errors='coerce')
+        if orig.notna().sum() > 1 and rel.notna().any() and orig.std() > 0:
+            smd.append(abs(rel.mean() - orig.mean()) / orig.std())
+    tvd = []
+    for column in featureset_cat:
+        if column not in original or column not in released:
+            continue
+        columns = _normalized(original, [column])[column], _normalized(released, [column])[column]
+        frequencies = pd.concat([values.value_counts(normalize=True) for values in columns], axis=1).fillna(0)
+        tvd.append(0.5 * np.abs(frequencies.iloc[:, 0] - frequencies.iloc[:, 1]).sum())
+    return {'mean_abs_smd': np.mean(smd) if smd else np.nan,
+            'mean_tvd': np.mean(tvd) if tvd else np.nan}
+
+
+def privacy_metrics(original, released, quasi_identifiers):
+    """Share of released records whose quasi-identifiers are identical to
+    those of an original record, and share of fully suppressed records."""
+    if len(released) == 0:
+        return {'identical_match_share': np.nan, 'suppressed_share': np.nan}
+    original_keys = pd.MultiIndex.from_frame(_normalized(original, quasi_identifiers))
+    released_qis = _normalized(released, quasi_identifiers)
+    matches = pd.MultiIndex.from_frame(released_qis).isin(original_keys)
+    suppressed = (released_qis == "*").all(axis=1)
+    return {'identical_match_share': matches.mean(),
+            'suppressed_share': suppressed.mean()}
+
+
+def partition_metrics(partitions, releases, medical_score):
+    """Table of fidelity and privacy metrics per mode and partition."""
+    featureset_cont = [column for column in FEATURE_SETS[medical_score]['continuous']
+                       if column in get_attributes(medical_score)]
+    rows = []
+    for mode, release in releases.items():
+        for partition, original in partitions.items():
+            released = release[release[PARTITION_COLUMN] == partition]
+            rows.append({'mode': mode, 'partition': partition,
+                         'n_original': len(original), 'n_released': len(released),
+                         **fidelity_metrics(original, released, featureset_cont,
+                                            FEATURE_SETS[medical_score]['categorical']),
+                         **privacy_metrics(original, released, get_attributes(medical_score))})
+    return pd.DataFrame(rows).set_index(['mode', 'partition'])
+
+
+def partitioned_analysis(input_path, output_path, medical_score: MEDICAL_SCORE, modes=MODES, key="site",
+                         max_workers=None, min_size=MIN_PARTITION_SIZE, profiler=None):
+    if profiler is None:
+        profiler = Profiler(f"partitioned_{medical_score.value}", enabled=False)
+    Path(output_path).mkdir(parents=True, exist_ok=True)
+
+    full_dataset = pd.read_csv(input_path)
+    print("Preprocessing started.")
+    full_dataset_cleaned = profiler.call("preprocess", preprocess, full_dataset)
+    print("Filtering started.")
+    full_dataset_cleaned = profiler.call("select_score_subsample", select_score_subsample,
+                                         full_dataset_cleaned, medical_score)
+    full_dataset_cleaned = drop_column_cleanup(full_dataset_cleaned)
+
+    print("Partitioned anonymization and synthesis started.")
+    releases, partitions = profiler.call("run_partitioned", run_partitioned, full_dataset_cleaned, medical_score,
+                                         modes=modes, key=key, max_workers=max_workers, min_size=min_size)
+    metrics = profiler.call("partition_metrics", partition_metrics, partitions, releases, medical_score)
+    print(metrics.to_string())
+
+    filename = Path(input_path).name
+    prefix = f"{datetime.now().strftime('%Y-%m-%d')}_{medical_score.value}_{filename}"
+    for mode, release in releases.items():
+        release.to_csv(os.path.join(output_path, f"{prefix}_{mode}_by_{key}.csv"), index=False)
+    metrics.to_csv(os.path.join(output_path, f"{prefix}_partition_metrics_by_{key}.csv"))
+    profiler.write(output_path, f"{prefix}_partitioned")
+    return releases, metrics
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Anonymize and synthesize the cohort separately per site (or other key).')
+    argparser.add_argument('--input', '-i', type=str, required=True,
+                           help='input csv file')
+    argparser.add_argument('--output', '-o', type=str, default=os.path.join('output', 'partitioned'),
+                           help='output directory')
+    argparser.add_argument('--score', type=str, default=MEDICAL_SCORE.MAGGIC.value,
+                           choices=[MEDICAL_SCORE.MAGGIC.value, MEDICAL_SCORE.BIOHF.value],
+                           help='medical score defining the subsample and feature set')
+    argparser.add_argument('--key', type=str, default='site',
+                           help='column to partition by')
+    argparser.add_argument('--modes', type=str, nargs='+', default=MODES, choices=MODES,
+                           help='releases to produce per partition')
+    argparser.add_argument('--workers', type=int, default=None,
+                           help='number of worker processes (default: number of CPUs)')
+    argparser.add_argument('--min_partition_size', type=int, default=MIN_PARTITION_SIZE,
+                           help='partitions with fewer records are pooled')
+    argparser.add_argument('--profile', action='store_true',
+                           help='write a run report and a Chrome trace with per-stage timing, memory and row counts')
+    args = argparser.parse_args()
+
+    partitioned_analysis(args.input, args.output, MEDICAL_SCORE(args.score), modes=args.modes, key=args.key,
+                         max_workers=args.workers, min_size=args.min_partition_size,
+                         profiler=Profiler("partitioned_analysis", enabled=args.profile))
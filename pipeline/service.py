@@ -0,0 +1,462 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Local HTTP job service for the anonymization, synthesis, scoring and evaluation.
+
+    python -m pipeline.service --port 8765 --work_dir temp/service
+
+The service listens on 127.0.0.1 only and runs without network access.  Jobs
+are submitted asynchronously:
+
+- POST /jobs/<kind> with kind anonymize, synthesize, score, evaluate or
+  anonymeter and a JSON body with the parameters of the job, or a csv body
+  (Content-Type text/csv) as the input of the job and the parameters in the
+  query string.  Answers 202 with the job, or 503 if the queue is full.
+- GET /jobs, GET /jobs/<id>: status of the jobs or of one job.
+- GET /jobs/<id>/progress?since=<n>: progress events of a job from the n-th on
+  (the progress events of ARX and the messages of the pipeline).
+- GET /jobs/<id>/result: the result as Parquet file (anonymize, synthesize,
+  score, anonymeter) or as zip archive of the output directory (evaluate).
+- DELETE /jobs/<id>: cancel a queued job.
+- GET /health: the backends with their concurrency limits and the queue.
+
+Inputs are paths of csv or Parquet files on this machine, or job:<id> for the
+result of a finished job, e.g. {"input": "job:3", "score": "MAGGIC"}.  The
+parameters per kind are
+
+- anonymize: input, score, prepare, time_limit,
+- synthesize: input, score, prepare, model_selection,
+- score: input, score, prepare,
+- evaluate: original, synthetic, anonymized, combined, score, image_format,
+- anonymeter: original, released, control, score,
+
+where prepare runs the preprocessing and score subsample selection of the
+analysis scripts on the input first.  Every kind runs on its backend, a pool of
+worker processes that stay warm: the JVM backend runs the ARX jar in server
+mode, the R backend keeps the embedded R with the sourced scoring script and a
+score memo, the Python backend keeps ASyH and anonymeter imported.  Every job
+runs in its own directory under the work directory.
+"""
+import importlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qsl
+
+import pandas as pd
+
+from evaluation.constants import MEDICAL_SCORE, get_attributes
+
+HOST = "127.0.0.1"
+PORT = 8765
+# jobs waiting for a worker, further submissions are rejected
+MAX_QUEUE = 32
+BACKENDS = {"jvm": ["anonymize"], "r": ["score"], "python": ["synthesize", "evaluate", "anonymeter"]}
+DEFAULT_LIMITS = {"jvm": 1, "r": 1, "python": 2}
+# libraries imported by the workers of the Python backend before their first job
+PYTHON_MODULES = ["ASyH", "anonymeter.evaluators"]
+INPUTS = {"anonymize": ["input"], "synthesize": ["input"], "score": ["input"],
+          "evaluate": ["original", "synthetic", "anonymized", "combined"],
+          "anonymeter": ["original", "released", "control"]}
+# progress events kept per job
+MAX_EVENTS = 1000
+RESULT_TYPES = {".parquet": "application/vnd.apache.parquet", ".zip": "application/zip"}
+
+# queue of the progress events of the worker processes, set by _init_worker
+_EVENTS = None
+# scores of the score inputs seen by an R worker
+_MEMO = None
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _EventWriter(io.TextIOBase):
+    """Standard output of a job: written to its log file, every line is also a progress event."""
+
+    def __init__(self, job_id, log):
+        self.job_id = job_id
+        self.log = log
+        self.line = ""
+
+    def write(self, text):
+        self.log.write(text)
+        self.line += text
+        *lines, self.line = self.line.split("\n")
+        for line in lines:
+            if line.strip():
+                _EVENTS.put((self.job_id, {"event": "message", "message": line}))
+        return len(text)
+
+
+def _init_worker(events, backend, jvm_heap):
+    """Warm up a worker of BACKEND: register the jar server, start R or import the libraries."""
+    global _EVENTS, _MEMO
+    _EVENTS = events
+    try:
+        if backend == "jvm":
+            from anonymization.anonymization_script import start_jar_server
+            start_jar_server(jvm_heap)
+        elif backend == "r":
+            from score_calculation.score_calculation import load_r_scoring, ScoreMemo
+            _MEMO = ScoreMemo()
+            load_r_scoring()
+        else:
+            for module in PYTHON_MODULES:
+                importlib.import_module(module)
+    except Exception as excpt:
+        # the jobs of the worker report the error
+        print(f"Warm-up of the {backend} worker failed: {excpt}")
+
+
+def read_table(path):
+    return pd.read_parquet(path) if Path(path).suffix == ".parquet" else pd.read_csv(path)
+
+
+def to_columnar(table):
+    """TABLE with string column names and without mixed object columns, which
+    Parquet cannot store: columns of numbers become numeric, others text."""
+    table = table.rename(columns=str)
+    for column in table.columns[table.dtypes == object]:
+        values = table[column]
+        numeric = pd.to_numeric(values, errors='coerce')
+        table[column] = numeric if numeric.notna().sum() == values.notna().sum() else \
+            values.astype(str).where(values.notna(), None)
+    return table
+
+
+def _prepared(data, medical_score):
+    from preprocessing.filtering import select_score_subsample
+    from preprocessing.preprocess_UCC import preprocess, drop_column_cleanup
+    return drop_column_cleanup(select_score_subsample(preprocess(data), medical_score))
+
+
+def _run_kind(kind, params, job_dir, job_id):
+    """Run the pipeline function of KIND, returns the path of the result."""
+    medical_score = MEDICAL_SCORE(params.get("score", MEDICAL_SCORE.MAGGIC.value))
+    data = {name: read_table(params[name]) for name in INPUTS[kind]}
+    if str(params.get("prepare", False)).lower() in ("true", "1") and "input" in data:
+        data["input"] = _prepared(data["input"], medical_score)
+    temp_files = dict(temp_file=os.path.join(job_dir, "input.csv"), output_file=os.path.join(job_dir, "output.csv"))
+
+    if kind == "anonymize":
+        from anonymization.anonymization_script import anonymize_ucc_cardio_data
+        from preprocessing.preprocess_UCC import drop_score_columns
+        time_limit = params.get("time_limit")
+        result = anonymize_ucc_cardio_data(drop_score_columns(data["input"]), anon_type=medical_score,
+                                           time_limit=None if time_limit is None else float(time_limit),
+                                           progress_callback=lambda event: _EVENTS.put((job_id, event)), **temp_files)
+    elif kind == "synthesize":
+        from synthetization.synthetization_script import synthesize_ucc_cardio_data
+        result = synthesize_ucc_cardio_data(data["input"], model_selection=params.get("model_selection", "cached"),
+                                            **temp_files)
+    elif kind == "score":
+        from score_calculation.score_calculation import calculate_scores
+        result = calculate_scores(data["input"], memo=_MEMO, **temp_files)
+    elif kind == "evaluate":
+        from evaluation.evaluation_script import evaluate_datasets
+        output_path = os.path.join(job_dir, "evaluation")
+        Path(output_path).mkdir(exist_ok=True)
+        evaluate_datasets(data["original"], data["synthetic"], data["anonymized"], data["combined"], output_path,
+                          medical_score, image_format=params.get("image_format", "png"), max_workers=1)
+        return shutil.make_archive(os.path.join(job_dir, "result"), "zip", output_path)
+    elif kind == "anonymeter":
+        from evaluation.privacy_evaluation_script import anonymeter_evaluation
+        columns = get_attributes(medical_score) + ["alias"]
+        results, holdout = anonymeter_evaluation(*[data[name][columns] for name in INPUTS[kind]])
+        result = pd.concat([results, holdout.to_frame("holdout").transpose()]).reset_index(names="attack")
+    else:
+        raise ValueError(f"Unknown job kind {kind}, choose one of {list(INPUTS)}.")
+    result_file = os.path.join(job_dir, "result.parquet")
+    to_columnar(result).to_parquet(result_file, index=False)
+    return result_file
+
+
+def run_job(job_id, kind, params, job_dir):
+    """Run a job in a worker process, in JOB_DIR and with its output in JOB_DIR/job.log."""
+    _EVENTS.put((job_id, {"event": "started", "pid": os.getpid()}))
+    cwd = os.getcwd()
+    with open(os.path.join(job_dir, "job.log"), "w") as log, redirect_stdout(_EventWriter(job_id, log)):
+        try:
+            os.chdir(job_dir)
+            return _run_kind(kind, params, job_dir, job_id)
+        except Exception:
+            traceback.print_exc(file=log)
+            raise
+        finally:
+            os.chdir(cwd)
+
+
+class JobService:
+    """Jobs and the warm worker pools of the backends.  At most MAX_QUEUE
+    jobs wait for a worker, LIMITS gives the number of worker processes per
+    backend."""
+
+    def __init__(self, work_dir, max_queue=MAX_QUEUE, limits=None, jvm_heap=None):
+        self.work_dir = os.path.abspath(work_dir)
+        self.max_queue = max_queue
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.jobs = {}
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.events = multiprocessing.Queue()
+        self.jvm_heap = jvm_heap
+        self.executors = {backend: self._new_executor(backend) for backend in BACKENDS}
+        self.listener = threading.Thread(target=self._listen, daemon=True)
+        self.listener.start()
+
+    def _new_executor(self, backend):
+        return ProcessPoolExecutor(max_workers=self.limits[backend], initializer=_init_worker,
+                                   initargs=(self.events, backend, self.jvm_heap))
+
+    def _restart_executor(self, backend, broken):
+        """Replace the pool BROKEN of BACKEND after one of its workers died
+        (e.g. a crash in R or the JVM), unless it was already replaced.
+        Requires the lock."""
+        if self.executors[backend] is broken:
+            print(f"A worker of the {backend} backend died, restarting its pool.")
+            self.executors[backend] = self._new_executor(backend)
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def _listen(self):
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            job_id, event = item
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    continue
+                if event["event"] == "started" and job["status"] == "queued":
+                    job.update(status="running", started=time.time())
+                job["progress"].append(event)
+                del job["progress"][:-MAX_EVENTS]
+
+    def _resolve(self, value):
+        """Path of an input: a file of this machine or job:<id> for the result of a finished job."""
+        if str(value).startswith("job:"):
+            job = self.jobs.get(int(str(value)[4:]))
+            if job is None or job["status"] != "done":
+                raise ValueError(f"Job {value[4:]} has no result.")
+            return job["result"]
+        if not os.path.isfile(value):
+            raise ValueError(f"Input file {value} does not exist.")
+        return os.path.abspath(value)
+
+    def submit(self, kind, params, upload=None):
+        """Queue a job of KIND, UPLOAD is the content of its input file.  Returns the job."""
+        if kind not in INPUTS:
+            raise ValueError(f"Unknown job kind {kind}, choose one of {list(INPUTS)}.")
+        backend = next(backend for backend, kinds in BACKENDS.items() if kind in kinds)
+        with self.lock:
+            if sum(job["status"] == "queued" for job in self.jobs.values()) >= self.max_queue:
+                raise QueueFull(f"{self.max_queue} jobs are waiting, try again later.")
+            job_id = next(self.ids)
+            job_dir = os.path.join(self.work_dir, "jobs", str(job_id))
+            Path(job_dir).mkdir(parents=True, exist_ok=True)
+            params = dict(params)
+            if upload is not None:
+                params["input"] = os.path.join(job_dir, "upload.csv")
+                Path(params["input"]).write_bytes(upload)
+            missing = [name for name in INPUTS[kind] if name not in params]
+            if missing:
+                raise ValueError(f"The job lacks the inputs {missing}.")
+            for name in INPUTS[kind]:
+                params[name] = self._resolve(params[name])
+            self.jobs[job_id] = {"id": job_id, "kind": kind, "backend": backend, "status": "queued",
+                                 "params": params, "submitted": time.time(), "started": None, "finished": None,
+                                 "error": None, "result": None, "progress": []}
+            executor = self.executors[backend]
+            try:
+                future = executor.submit(run_job, job_id, kind, params, job_dir)
+            except BrokenProcessPool:
+                # the pool broke after its last job finished, the job has not run yet
+                self._restart_executor(backend, executor)
+                executor = self.executors[backend]
+                future = executor.submit(run_job, job_id, kind, params, job_dir)
+            self.futures[job_id] = future
+        future.add_done_callback(lambda done: self._finish(job_id, done, executor))
+        return self.status(job_id)
+
+    def _finish(self, job_id, future, executor):
+        with self.lock:
+            job = self.jobs[job_id]
+            job["finished"] = time.time()
+            if future.cancelled():
+                job["status"] = "cancelled"
+            elif isinstance(future.exception(), BrokenProcessPool):
+                # the job or another one of the pool killed its worker, the later jobs get a new pool
+                job.update(status="failed", error=f"BrokenProcessPool: a worker of the {job['backend']} backend "
+                                                  f"died while the job was running or waiting")
+                self._restart_executor(job["backend"], executor)
+            elif future.exception() is not None:
+                job.update(status="failed", error=f"{type(future.exception()).__name__}: {future.exception()}")
+            else:
+                job.update(status="done", result=future.result())
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs[job_id]
+            return {key: value for key, value in job.items() if key != "progress"} | \
+                {"events": len(job["progress"]), "last_event": job["progress"][-1] if job["progress"] else None}
+
+    def progress(self, job_id, since=0):
+        with self.lock:
+            return self.jobs[job_id]["progress"][since:]
+
+    def cancel(self, job_id):
+        """Cancel a queued job, returns False if it is already running or finished."""
+        return self.futures[job_id].cancel()
+
+    def health(self):
+        with self.lock:
+            statuses = pd.Series([job["status"] for job in self.jobs.values()], dtype=object).value_counts()
+        return {"backends": {backend: {"kinds": kinds, "workers": self.limits[backend]}
+                             for backend, kinds in BACKENDS.items()},
+                "max_queue": self.max_queue, "jobs": statuses.to_dict()}
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(cancel_futures=True)
+        self.events.put(None)
+        # the listener stops before the queue is closed at exit
+        self.listener.join()
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    """HTTP interface of the JobService of the server."""
+
+    def _send_json(self, content, status=HTTPStatus.OK):
+        body = json.dumps(content, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        job_id = int(parts[1]) if len(parts) > 1 and parts[0] == "jobs" and parts[1].isdigit() else None
+        if job_id is not None and job_id not in self.server.service.jobs:
+            raise KeyError(f"Unknown job {job_id}.")
+        return parts, job_id, dict(parse_qsl(url.query))
+
+    def _handle(self, method):
+        service = self.server.service
+        try:
+            parts, job_id, query = self._route()
+            if method == "GET" and parts == ["health"]:
+                return self._send_json(service.health())
+            if method == "GET" and parts == ["jobs"]:
+                return self._send_json([service.status(job) for job in list(service.jobs)])
+            if method == "POST" and len(parts) == 2 and parts[0] == "jobs":
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Type", "").startswith("text/csv"):
+                    job = service.submit(parts[1], query, upload=body)
+                else:
+                    job = service.submit(parts[1], {**query, **(json.loads(body) if body else {})})
+                return self._send_json(job, HTTPStatus.ACCEPTED)
+            if job_id is not None and method == "GET" and len(parts) == 2:
+                return self._send_json(service.status(job_id))
+            if job_id is not None and method == "GET" and parts[2:] == ["progress"]:
+                return self._send_json(service.progress(job_id, int(query.get("since", 0))))
+            if job_id is not None and method == "GET" and parts[2:] == ["result"]:
+                return self._send_result(service.status(job_id))
+            if job_id is not None and method == "DELETE" and len(parts) == 2:
+                cancelled = service.cancel(job_id)
+                return self._send_json({"id": job_id, "cancelled": cancelled},
+                                       HTTPStatus.OK if cancelled else HTTPStatus.CONFLICT)
+            self._send_json({"error": f"Unknown request {method} {self.path}"}, HTTPStatus.NOT_FOUND)
+        except QueueFull as excpt:
+            self._send_json({"error": str(excpt)}, HTTPStatus.SERVICE_UNAVAILABLE)
+        except KeyError as excpt:
+            self._send_json({"error": excpt.args[0]}, HTTPStatus.NOT_FOUND)
+        except ValueError as excpt:
+            self._send_json({"error": str(excpt)}, HTTPStatus.BAD_REQUEST)
+
+    def _send_result(self, job):
+        if job["status"] != "done":
+            return self._send_json({"error": f"Job {job['id']} is {job['status']}."}, HTTPStatus.CONFLICT)
+        path = Path(job["result"])
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", RESULT_TYPES.get(path.suffix, "application/octet-stream"))
+        self.send_header("Content-Disposition", f'attachment; filename="{job["kind"]}_{job["id"]}{path.suffix}"')
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.end_headers()
+        with open(path, "rb") as result:
+            shutil.copyfileobj(result, self.wfile)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+def serve(work_dir, host=HOST, port=PORT, max_queue=MAX_QUEUE, limits=None, jvm_heap=None):
+    """Run the job service until interrupted."""
+    service = JobService(work_dir, max_queue, limits, jvm_heap)
+    server = ThreadingHTTPServer((host, port), JobHandler)
+    server.service = service
+    print(f"Job service listening on http://{host}:{port}, jobs in {service.work_dir}.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Local HTTP service running anonymization, synthesis, scoring and '
+                                           'evaluation jobs in warm worker processes.')
+    argparser.add_argument('--port', type=int, default=PORT,
+                           help='port on 127.0.0.1')
+    argparser.add_argument('--work_dir', type=str, default=os.path.join('temp', 'service'),
+                           help='directory of the job directories with inputs, logs and results')
+    argparser.add_argument('--max_queue', type=int, default=MAX_QUEUE,
+                           help='jobs waiting for a worker, further submissions are rejected with 503')
+    for backend, limit in DEFAULT_LIMITS.items():
+        argparser.add_argument(f'--{backend}_workers', type=int, default=limit,
+                               help=f'worker processes of the {backend} backend ({", ".join(BACKENDS[backend])})')
+    argparser.add_argument('--jvm_heap', type=float, default=None,
+                           help='heap of every ARX JVM in GB (default: JVM default)')
+    args = argparser.parse_args()
+
+    serve(args.work_dir, port=args.port, max_queue=args.max_queue,
+          limits={backend: getattr(args, f'{backend}_workers') for backend in BACKENDS},
+          jvm_heap=None if args.jvm_heap is None else int(args.jvm_heap * 2 ** 30))
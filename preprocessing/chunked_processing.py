@@ -0,0 +1,149 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Out-of-core execution of the row-local stages.
+
+Preprocessing, the score subsample filter and the score calculation only look
+at one record at a time.  stream_row_local_stages reads the input csv file in
+chunks of fixed size, runs these stages on every chunk and appends the result
+to a Parquet file, so the peak memory of these stages is proportional to the
+chunk size.  Only the stages that need the whole dataset (ARX, model fitting,
+evaluation) read the Parquet file back into memory.  Quantile sketches of the
+continuous features are merged over the chunks and saved next to it.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS, column_filter
+from preprocessing.filtering import select_score_subsample
+from preprocessing.preprocess_UCC import preprocess, drop_column_cleanup, limiters
+
+CHUNK_SIZE = 100000
+# the whole-data stages hold about this many copies of the cohort at once (raw, cleaned and scored data)
+IN_MEMORY_COPIES = 3
+# share of the memory budget one chunk of the row-local stages may take
+CHUNK_BUDGET_SHARE = 0.25
+
+# columns that have to be read as numbers even if they are empty in the first chunk
+NUMERIC_COLUMNS = sorted({lim.key for lim in limiters} |
+                         {column for score in [MEDICAL_SCORE.BIOHF, MEDICAL_SCORE.MAGGIC]
+                          for column in FEATURE_SETS[score]['continuous']})
+
+
+def infer_chunk_dtypes(input_path, chunk_size=CHUNK_SIZE, columns=None):
+    """Column types for reading the COLUMNS (all if None) of INPUT_PATH chunk
+    by chunk, inferred from the first chunk.  Numbers are read as float64, so
+    that a later chunk with missing values has the same type; everything else
+    is read as object."""
+    head = pd.read_csv(input_path, nrows=chunk_size, usecols=column_filter(columns))
+    return {column: 'float64' if column in NUMERIC_COLUMNS or
+                                 (pd.api.types.is_numeric_dtype(dtype) and head[column].notna().any())
+            else 'object'
+            for column, dtype in head.dtypes.items()}
+
+
+def chunk_size_for_budget(input_path, memory_budget, sample_rows=1000, columns=None):
+    """Chunk size for running the row-local stages on the COLUMNS (all if
+    None) of INPUT_PATH within MEMORY_BUDGET bytes, or None if the whole
+    cohort fits.  The in-memory size of a row and the number of rows are
+    estimated from the first SAMPLE_ROWS rows of the file."""
+    with open(input_path, 'rb') as input_file:
+        header = input_file.readline()
+        sample = input_file.readlines(sample_rows * 2 ** 10)[:sample_rows]
+    if not sample:
+        return None
+    head = pd.read_csv(input_path, nrows=len(sample), usecols=column_filter(columns))
+    row_bytes = head.memory_usage(index=True, deep=True).sum() / len(head)
+    rows = (os.path.getsize(input_path) - len(header)) / (sum(map(len, sample)) / len(sample))
+    if rows * row_bytes * IN_MEMORY_COPIES <= memory_budget:
+        return None
+    chunk_size = max(int(memory_budget * CHUNK_BUDGET_SHARE / row_bytes), 1000)
+    print(f"About {rows:.0f} rows of {row_bytes:.0f} bytes do not fit into the memory budget, "
+          f"the row-local stages run in chunks of {chunk_size} rows.")
+    return chunk_size
+
+
+def arrow_schema(chunk):
+    """Parquet schema of the first processed chunk: float64 for numbers, string otherwise."""
+    import pyarrow as pa
+    return pa.schema([(column, pa.float64() if pd.api.types.is_numeric_dtype(dtype) else pa.string())
+                      for column, dtype in chunk.dtypes.items()])
+
+
+def conform_to_schema(chunk, schema):
+    """Cast CHUNK to SCHEMA, adding missing columns as missing values."""
+    import pyarrow as pa
+    conformed = {}
+    for field in schema:
+        if field.name not in chunk:
+            conformed[field.name] = np.full(len(chunk), np.nan if field.type == pa.float64() else None)
+        elif field.type == pa.float64():
+            conformed[field.name] = pd.to_numeric(chunk[field.name], errors='coerce').astype('float64')
+        else:
+            column = chunk[field.name]
+            conformed[field.name] = column.astype(str).where(column.notna(), None)
+    return pa.Table.from_pandas(pd.DataFrame(conformed), schema=schema, preserve_index=False)
+
+
+def process_chunk(chunk, medical_score, score=True, temp_dir="temp", memo=None):
+    """Preprocess, filter and (if SCORE) score a single chunk, see calculate_scores for MEMO."""
+    cleaned = drop_column_cleanup(select_score_subsample(preprocess(chunk), medical_score))
+    if score and len(cleaned) > 0:
+        from score_calculation.score_calculation import calculate_scores
+        cleaned = drop_column_cleanup(calculate_scores(cleaned,
+                                                       temp_file=os.path.join(temp_dir, "chunk_without_score.csv"),
+                                                       output_file=os.path.join(temp_dir, "chunk_with_score.csv"),
+                                                       memo=memo))
+    return cleaned
+
+
+def stream_row_local_stages(input_path, output_file, medical_score, chunk_size=CHUNK_SIZE, score=True,
+                            temp_dir="temp", memo=None, columns=None):
+    """Run preprocessing, score subsample filtering and (if SCORE) the score
+    calculation on the COLUMNS (all if None) of INPUT_PATH in chunks of
+    CHUNK_SIZE rows and write the result to the Parquet file OUTPUT_FILE.
+    With a ScoreMemo MEMO, score inputs repeating across chunks are scored once.  The quantile sketches of the
+    result are saved to OUTPUT_FILE with the suffix _sketches.json.  Returns
+    the numbers of read and written rows.
+    """
+    import pyarrow.parquet as pq
+    from evaluation.quantile_sketch import DatasetSketches, continuous_features
+
+    dtypes = infer_chunk_dtypes(input_path, chunk_size, columns)
+    writer = None
+    rows_in = rows_out = 0
+    sketches = DatasetSketches(continuous_features([medical_score]))
+    try:
+        for chunk in pd.read_csv(input_path, chunksize=chunk_size, dtype=dtypes, usecols=column_filter(columns)):
+            rows_in += len(chunk)
+            processed = process_chunk(chunk, medical_score, score=score, temp_dir=temp_dir, memo=memo)
+            if writer is None:
+                if len(processed) == 0:
+                    continue
+                writer = pq.ParquetWriter(output_file, arrow_schema(processed))
+            writer.write_table(conform_to_schema(processed, writer.schema))
+            sketches.update(processed)
+            rows_out += len(processed)
+            print(f"Processed {rows_in} rows, kept {rows_out}.")
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError(f"No records of {input_path} are left after preprocessing and filtering.")
+    sketches.save(os.path.splitext(output_file)[0] + "_sketches.json")
+    return rows_in, rows_out
@@ -20,7 +20,7 @@ from argparse import ArgumentParser
 
 import pandas as pd
 
-from evaluation.local_utils import MEDICAL_SCORE, FEATURE_SETS
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS
 
 
 def select_score_subsample(full_dataset_cleaned: pd.DataFrame,
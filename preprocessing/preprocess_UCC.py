@@ -31,30 +31,33 @@ def drop_unused_columns(dataset, unused_columns=['Unnamed: 0', 'ntprobnp_m', 'nt
     return dataset.drop(columns=unused_columns, errors='ignore')
 
 
-def drop_score_columns(dataset, unused_columns=['biohf_v1_1', 'biohf_v1_3', 'maggic_score_1', 'maggic_score_3']):
+def drop_score_columns(dataset, unused_columns=['biohf_v1_1', 'biohf_v1_3', 'maggic_score_1', 'maggic_score_3',
+                                               'gender_m', 'gender_f']):
+    """Drop the outputs of the score calculation, including the gender indicators gender_m and gender_f it adds."""
     return dataset.drop(columns=unused_columns, errors='ignore')
 
 
-# helper 'macro'
+# helper 'macro', each limiter returns the limited column KEY of the data
 def cond(key, minval, maxval, do_round=False):
-    def filter_cond(indict):
-        outdict = indict.copy()
-        if do_round and not numpy.isnan(outdict[key]):
-            outdict[key] = round(outdict[key], 8)
-        if outdict[key] < minval or outdict[key] > maxval:
-            outdict[key] = numpy.nan
-        return outdict
-
+    def filter_cond(data):
+        column = data[key]
+        if do_round:
+            column = column.round(8)
+        return column.mask((column < minval) | (column > maxval))
+
+    filter_cond.key = key
+    filter_cond.bounds = (minval, maxval)
     return filter_cond
 
 
 def cond_months_age(key, minval, maxval):
-    def filter_cond(indict):
-        outdict = indict.copy()
-        if outdict[key] < minval * outdict['age'] or outdict[key] > maxval * outdict['age']:
-            outdict[key] = numpy.nan
-        return outdict
+    def filter_cond(data):
+        column = data[key]
+        return column.mask((column < minval * data['age']) | (column > maxval * data['age']))
 
+    filter_cond.key = key
+    # bounds relative to the age
+    filter_cond.bounds = None
     return filter_cond
 
 
@@ -71,24 +74,29 @@ limiters = [cond('age', 18, 110, False),
 
 
 # for logging any chaged rows:
-def check_dicts(a, b):
-    if a != b:
-        print(f'data outside limits: changed\n  {a}\nto\n  {b}')
+def check_dicts(data, key, limited_column):
+    changed = data[key].notna() & limited_column.isna()
+    for row in data[changed].to_dict(orient='records'):
+        print(f'data outside limits: changed {key} to nan in\n  {row}')
 
 
 # get data
 def preprocess(dataset, verbose=False):
-    in_data = dataset.drop('Unnamed: 0', axis=1, errors="ignore")
-    cleared_data = pandas.DataFrame()
-
-    for row in in_data.to_dict(orient='records'):
-        r = row
-        for lim in limiters:
-            r = lim(r)
-            if verbose:
-                check_dicts(row, r)
-        rdf = pandas.DataFrame(r, index=[0])
-        cleared_data = pandas.concat([cleared_data, rdf])
-
-    cleared_data.reset_index()
-    return cleared_data
+    """Set values outside the plausible range to NaN.  The limiters work on
+    whole columns, so the data can also be cleaned chunk by chunk; limiters of
+    columns the dataset does not have (e.g. after a column projection, see
+    evaluation.constants.required_columns) are skipped.  The result has a
+    RangeIndex (0..n-1), which the row selections of the risk analysis rely
+    on."""
+    cleared_data = dataset.drop('Unnamed: 0', axis=1, errors="ignore")
+
+    for lim in limiters:
+        if lim.key not in cleared_data:
+            continue
+        limited_column = lim(cleared_data)
+        if verbose:
+            check_dicts(cleared_data, lim.key, limited_column)
+        if not limited_column.equals(cleared_data[lim.key]):
+            cleared_data[lim.key] = limited_column
+
+    return cleared_data.reset_index(drop=True)
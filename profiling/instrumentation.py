@@ -0,0 +1,245 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Per-stage profiling of the pipeline.
+
+A Profiler records for every stage the wall time, the CPU time of this process
+and of its terminated child processes (the ARX JVM), the peak resident set
+size, and the number of input and output rows.  The records are written as a
+JSON run report and as a Chrome trace file, which can be opened in
+chrome://tracing or https://ui.perfetto.dev.  With a memory budget, stages
+whose peak memory exceeds it are flagged in the report.
+"""
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+_MAXRSS_TO_BYTES = 1 if sys.platform == "darwin" else 1024
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of this process (Linux only).  Returns whether the
+    peak could be reset, i.e. whether the measured peak is per stage."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    """Peak RSS of this process in bytes."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_TO_BYTES
+    return None
+
+
+def current_rss():
+    """Current RSS of this process in bytes, None if unknown."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def remaining_memory(memory_budget, minimum=2 ** 28):
+    """Share of MEMORY_BUDGET bytes not used by this process, at least MINIMUM
+    bytes, e.g. for the heap of a child process.  None without a budget."""
+    if memory_budget is None:
+        return None
+    return max(int(memory_budget - (current_rss() or 0)), minimum)
+
+
+def _children_usage():
+    """CPU seconds and peak RSS in bytes of all terminated child processes."""
+    if resource is None:
+        return None, None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * _MAXRSS_TO_BYTES
+
+
+def count_rows(data):
+    """Number of rows of DATA, the first DataFrame of a tuple/list, or None."""
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return len(data)
+    if isinstance(data, (tuple, list)):
+        for item in data:
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                return len(item)
+    return None
+
+
+class StageRecord:
+    """Measurements of one pipeline stage."""
+
+    def __init__(self, name, depth, rows_in=None):
+        self.name = name
+        self.depth = depth
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.start = None
+        self.wall_s = None
+        self.cpu_s = None
+        self.children_cpu_s = None
+        self.peak_rss_bytes = None
+        self.peak_rss_per_stage = None
+        self.children_peak_rss_bytes = None
+        self.rss_end_bytes = None
+        self.over_memory_budget = None
+        self.error = None
+
+    def set_output(self, data):
+        self.rows_out = count_rows(data)
+
+    def to_dict(self):
+        return {key: value for key, value in self.__dict__.items()}
+
+
+class Profiler:
+    """Collects StageRecords.  A disabled profiler only runs the stages.
+    MEMORY_BUDGET is the memory in bytes a stage may use, including the child
+    processes started by it."""
+
+    def __init__(self, name="pipeline", enabled=True, verbose=True, memory_budget=None):
+        self.name = name
+        self.memory_budget = memory_budget
+        self.enabled = enabled
+        self.verbose = verbose
+        self.stages = []
+        self._stack = []
+        self._origin = time.perf_counter()
+        self._started = datetime.now().isoformat(timespec='seconds')
+
+    @contextmanager
+    def stage(self, name, data_in=None):
+        """Context manager measuring the enclosed block as stage NAME.  Call
+        set_output() on the yielded record to register the output rows."""
+        record = StageRecord(name, len(self._stack), count_rows(data_in))
+        if not self.enabled:
+            yield record
+            return
+
+        self.stages.append(record)
+        self._stack.append(record)
+        per_stage_peak = _reset_peak_rss()
+        children_cpu_before, children_peak_before = _children_usage()
+        cpu_before = time.process_time()
+        record.start = time.perf_counter() - self._origin
+        try:
+            yield record
+        except BaseException as excpt:
+            record.error = repr(excpt)
+            raise
+        finally:
+            record.wall_s = time.perf_counter() - self._origin - record.start
+            record.cpu_s = time.process_time() - cpu_before
+            children_cpu_after, children_peak = _children_usage()
+            if children_cpu_before is not None:
+                record.children_cpu_s = children_cpu_after - children_cpu_before
+                record.children_peak_rss_bytes = children_peak
+            # a nested stage resets the peak, so its peak is carried over to the enclosing stage
+            record.peak_rss_bytes = max(filter(None, [_peak_rss(), record.peak_rss_bytes]), default=None)
+            record.peak_rss_per_stage = per_stage_peak
+            record.rss_end_bytes = current_rss()
+            if self.memory_budget is not None and record.peak_rss_bytes is not None:
+                # the peak of all children only counts if a child of this stage raised it
+                children = record.children_peak_rss_bytes if children_peak != children_peak_before else 0
+                record.over_memory_budget = record.peak_rss_bytes + (children or 0) > self.memory_budget
+                if record.over_memory_budget:
+                    print(f"WARNING! {name} used {(record.peak_rss_bytes + (children or 0)) / 2 ** 30:.2f} GB, "
+                          f"more than the memory budget of {self.memory_budget / 2 ** 30:.2f} GB.")
+            self._stack.pop()
+            if self._stack and record.peak_rss_bytes is not None:
+                parent = self._stack[-1]
+                parent.peak_rss_bytes = max(parent.peak_rss_bytes or 0, record.peak_rss_bytes)
+            if self.verbose:
+                print(f"{name} finished after {record.wall_s:.1f} s.")
+
+    def call(self, name, function, *args, **kwargs):
+        """Run FUNCTION(*ARGS, **KWARGS) as stage NAME and return its result.
+        Rows are counted for the first DataFrame argument and the result."""
+        data_in = next((arg for arg in list(args) + list(kwargs.values())
+                        if isinstance(arg, pd.DataFrame)), None)
+        with self.stage(name, data_in) as record:
+            result = function(*args, **kwargs)
+            record.set_output(result)
+        return result
+
+    def report(self):
+        return {'name': self.name,
+                'started': self._started,
+                'host': platform.node(),
+                'python': platform.python_version(),
+                'pid': os.getpid(),
+                'total_wall_s': time.perf_counter() - self._origin,
+                'memory_budget_bytes': self.memory_budget,
+                'stages': [record.to_dict() for record in self.stages]}
+
+    def trace(self):
+        """Stages as Chrome trace 'complete' events with peak RSS counters."""
+        pid = os.getpid()
+        events = []
+        for record in self.stages:
+            if record.wall_s is None:
+                continue
+            args = {key: value for key, value in record.to_dict().items()
+                    if key not in ('name', 'start', 'depth') and value is not None}
+            events.append({'name': record.name, 'cat': 'stage', 'ph': 'X',
+                           'ts': record.start * 1e6, 'dur': record.wall_s * 1e6,
+                           'pid': pid, 'tid': 0, 'args': args})
+            if record.peak_rss_bytes is not None:
+                events.append({'name': 'peak_rss_mb', 'ph': 'C',
+                               'ts': (record.start + record.wall_s) * 1e6, 'pid': pid,
+                               'args': {'self': record.peak_rss_bytes / 2 ** 20,
+                                        'children': (record.children_peak_rss_bytes or 0) / 2 ** 20}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'name': self.name, 'started': self._started}}
+
+    def write(self, output_path, prefix):
+        """Write OUTPUT_PATH/PREFIX_run_report.json and PREFIX_trace.json."""
+        if not self.enabled:
+            return None
+        report_file = os.path.join(output_path, f"{prefix}_run_report.json")
+        trace_file = os.path.join(output_path, f"{prefix}_trace.json")
+        with open(report_file, 'w') as report:
+            json.dump(self.report(), report, indent=2)
+        with open(trace_file, 'w') as trace:
+            json.dump(self.trace(), trace)
+        return report_file, trace_file
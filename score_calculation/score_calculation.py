@@ -16,30 +16,188 @@
 #  */
 from argparse import ArgumentParser
 
+import numpy as np
 import pandas as pd
-import rpy2.robjects as robj
 import os
 from pathlib import Path
 
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS
+
 R_SCRIPT_PATH = os.path.dirname(__file__)
 DELETE_TEMP = False
 
+# the columns scores_anon.R reads, the scores only depend on these
+SCORE_INPUTS = list(dict.fromkeys(FEATURE_SETS[MEDICAL_SCORE.MAGGIC]['all'] + FEATURE_SETS[MEDICAL_SCORE.BIOHF]['all']))
+# the columns scores_anon.R adds
+SCORE_OUTPUTS = ['gender_m', 'gender_f', 'maggic_score_1', 'maggic_score_3', 'biohf_v1_1', 'biohf_v1_3']
+# values scores_anon.R replaces by NA in all columns
+R_MISSING_VALUES = ["*", "NULL"]
+R_LOGICAL_VALUES = ["TRUE", "FALSE", "True", "False", "true", "false", "T", "F"]
+
+# score_calculation function of the embedded R, see load_r_scoring
+_R_SCORE = None
+
+
+class ScoreMemo:
+    """Scores per combination of score inputs, shared by all datasets scored
+    with it (original, anonymized, synthetic, chunks of one dataset).
+
+    R reads a column as text if any of its values is not a number (e.g. a
+    generalized or suppressed value of ARX), which can change the score of the
+    same value.  The memo is therefore keyed by these column types as well.
+    """
+
+    def __init__(self):
+        self.scores = {}
+        self.rows = 0
+        self.unique = 0
+        self.memo_hits = 0
+        self.computed = 0
+
+    def hit_rate(self):
+        """Share of rows that were not scored in R."""
+        return 1 - self.computed / self.rows if self.rows else 0.0
+
+    def stats(self):
+        return {'rows': self.rows, 'unique_inputs': self.unique, 'memo_hits': self.memo_hits,
+                'computed': self.computed, 'hit_rate': self.hit_rate()}
+
 
-def calculate_scores(dataset, temp_file="temp/without_score.csv", output_file="temp/with_score.csv"):
+def _r_column_types(inputs):
+    """'logical', 'numeric' or 'text' per column, as read.csv infers them."""
+    types = {}
+    for column in inputs:
+        values = inputs[column].dropna()
+        if pd.api.types.is_bool_dtype(values) or values.astype(str).isin(R_LOGICAL_VALUES).all():
+            types[column] = 'logical'
+        elif pd.api.types.is_numeric_dtype(values) or pd.to_numeric(values, errors='coerce').notna().all():
+            types[column] = 'numeric'
+        else:
+            types[column] = 'text'
+    return types
+
+
+def _score_keys(inputs, types):
+    """Hashable key per row: numbers as floats, text as written to csv, missing as None."""
+    normalized = {}
+    for column in inputs:
+        values = inputs[column]
+        if types[column] == 'numeric':
+            normalized[column] = pd.to_numeric(values, errors='coerce').astype(float).astype(object)
+        else:
+            normalized[column] = values.astype(str).astype(object)
+        normalized[column] = normalized[column].where(values.notna(), None)
+    return pd.Series(list(zip(*normalized.values())), index=inputs.index)
+
+
+def load_r_scoring():
+    """The score_calculation function of scores_anon.R.  The script is sourced
+    once per process, later calls reuse the embedded R with its packages."""
+    global _R_SCORE
+    if _R_SCORE is None:
+        # imported here, loading rpy2 starts the embedded R
+        import rpy2.robjects as robj
+        robj.r['source'](rf"{R_SCRIPT_PATH}/scores_anon.R")
+        _R_SCORE = robj.globalenv['score_calculation']
+    return _R_SCORE
+
+
+def run_r_scoring(temp_file, output_file):
+    """Run scores_anon.R on TEMP_FILE, writing OUTPUT_FILE."""
     temp_cwd = os.getcwd()
+    r_score = load_r_scoring()
+    r_score(temp_file, output_file, R_SCRIPT_PATH)
+    os.chdir(temp_cwd)
+
+
+def missing_score_inputs(dataset):
+    """SCORE_INPUTS DATASET does not have, e.g. the inputs of the other score
+    after a column projection (evaluation.constants.required_columns)."""
+    return [column for column in SCORE_INPUTS if column not in dataset]
+
+
+def with_score_inputs(dataset):
+    """DATASET with its missing score inputs added as missing values, so that
+    scores_anon.R can read it; the scores depending on them are missing."""
+    missing = missing_score_inputs(dataset)
+    return dataset.assign(**{column: np.nan for column in missing}) if missing else dataset
+
+
+def calculate_scores_deduplicated(dataset, memo=None, temp_file="temp/without_score.csv",
+                                  output_file="temp/with_score.csv"):
+    """Same result as calculate_scores, but every combination of SCORE_INPUTS
+    is scored in R only once and the scores are broadcast to all rows sharing
+    it.  Combinations already in MEMO are not scored again.  Anonymized data
+    consists of equivalence classes of at least k identical rows, so R scores
+    at most a k-th of the rows."""
+    memo = ScoreMemo() if memo is None else memo
+    temp_file = os.path.abspath(temp_file)
+    output_file = os.path.abspath(output_file)
+    Path(os.path.dirname(output_file)).mkdir(parents=True, exist_ok=True)
+
+    # the returned dataset keeps the columns of DATASET, missing inputs are only added for R
+    inputs = with_score_inputs(dataset)[SCORE_INPUTS]
+    types = _r_column_types(inputs)
+    signature = tuple(types.values())
+    known = memo.scores.setdefault(signature, {})
+
+    keys = _score_keys(inputs, types)
+    first_rows = ~keys.duplicated()
+    unique_keys = keys[first_rows]
+    new = ~unique_keys.isin(known.keys()) if known else pd.Series(True, index=unique_keys.index)
+    memo.rows += len(dataset)
+    memo.unique += len(unique_keys)
+    memo.memo_hits += int((~new).sum())
+    memo.computed += int(new.sum())
+
+    if new.any():
+        to_score = inputs.loc[new[new].index]
+        retyped = [column for column, column_type in _r_column_types(to_score).items() if column_type != types[column]]
+        if retyped:
+            # a row that keeps these columns text in R, as they are in the whole dataset
+            to_score = pd.concat([to_score, pd.DataFrame({column: ["*"] for column in retyped})], ignore_index=True)
+        to_score.to_csv(temp_file)
+        run_r_scoring(temp_file, output_file)
+        scored = pd.read_csv(output_file)[SCORE_OUTPUTS].iloc[:new.sum()]
+        known.update(zip(unique_keys[new], map(tuple, scored.to_numpy())))
+    print(f"Scored {len(dataset)} rows with {len(unique_keys)} unique score inputs, "
+          f"{int(new.sum())} computed in R (hit rate of the memo so far {memo.hit_rate():.1%}).")
+
+    # the result of scores_anon.R: its row names, the index, the data with R's missing values, the scores
+    scored_dataset = dataset.mask(dataset.isin(R_MISSING_VALUES))
+    scored_dataset.insert(0, 'X', dataset.index)
+    scored_dataset.insert(0, 'Unnamed: 0', np.arange(1, len(dataset) + 1))
+    scores = pd.DataFrame(keys.map(known).tolist(), columns=SCORE_OUTPUTS, index=dataset.index)
+    for column in SCORE_OUTPUTS:
+        scored_dataset[column] = scores[column]
+    scored_dataset.to_csv(output_file, index=False)
+    scored_dataset = pd.read_csv(output_file)
+    if DELETE_TEMP:
+        for path in [temp_file, output_file]:
+            if os.path.exists(path):
+                os.remove(path)
+    return scored_dataset
+
+
+def calculate_scores(dataset, temp_file="temp/without_score.csv", output_file="temp/with_score.csv", memo=None):
+    """Score every row of DATASET with scores_anon.R, score inputs DATASET
+    does not have are missing for R and not returned.  With a ScoreMemo MEMO,
+    every combination of score inputs is scored only once, see
+    calculate_scores_deduplicated."""
+    if memo is not None:
+        return calculate_scores_deduplicated(dataset, memo, temp_file=temp_file, output_file=output_file)
     temp_file = os.path.abspath(temp_file)
     output_file = os.path.abspath(output_file)
 
     output_dir = os.path.dirname(output_file)
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
-    dataset.to_csv(temp_file)
-    robj.r['source'](rf"{R_SCRIPT_PATH}/scores_anon.R")
-    r_score = robj.globalenv['score_calculation']
-    r_score(temp_file, output_file, R_SCRIPT_PATH)
+    missing_inputs = missing_score_inputs(dataset)
+    with_score_inputs(dataset).to_csv(temp_file)
+    run_r_scoring(temp_file, output_file)
+    scored_dataset = pd.read_csv(output_file).drop(columns=missing_inputs)
     if DELETE_TEMP:
         os.remove(temp_file)
         os.remove(output_file)
 
-    os.chdir(temp_cwd)
-    return pd.read_csv(output_file)
+    return scored_dataset
@@ -19,112 +19,306 @@
 
 import os
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import warnings
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from scipy import stats
+from sklearn.model_selection import KFold, train_test_split
 
 from anonymization.anonymization_script import anonymize_ucc_cardio_data
-from evaluation.local_utils import MEDICAL_SCORE, get_attributes, FEATURE_SETS
+from evaluation.constants import MEDICAL_SCORE, get_attributes, FEATURE_SETS, QUASI_IDENTIFIERS, required_columns, \
+    column_filter
 from evaluation.privacy_evaluation_script import anonymeter_evaluation
+from evaluation.risk_profile import risk_profiles
+from evaluation.shared_dataset import SharedDatasets, attach_datasets, attached_dataset
+from profiling.instrumentation import Profiler, remaining_memory
+from preprocessing.chunked_processing import stream_row_local_stages, chunk_size_for_budget
 from preprocessing.filtering import select_score_subsample
 from preprocessing.preprocess_UCC import preprocess, drop_score_columns, drop_column_cleanup
-from score_calculation.score_calculation import calculate_scores
+from score_calculation.score_calculation import calculate_scores, ScoreMemo
+from synthetization.model_selection import SELECTION_MODES
 from synthetization.synthetization_script import synthesize_ucc_cardio_data
 
 
 DATE_TODAY = datetime.now().strftime('%Y-%m-%d')
+RELEASES = ["Synthetic", "Anonymized", "Combined"]
+SPLIT_MODES = ["repeated", "kfold"]
+# confidence level of the intervals over the splits
+CONFIDENCE = 0.95
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
 
-def full_data_analysis(input_path, output_path, medical_score: MEDICAL_SCORE):
-    if not os.path.exists(output_path):
-        os.mkdir(output_path)
-
-    # general script overview:
-    full_dataset = pd.read_csv(input_path)
-
-    # data preprocessing
-    print("Preprocessing started.")
-    full_dataset_cleaned = preprocess(full_dataset)
-
-    # Filter subsample
-    print("Filtering started.")
-    full_dataset_cleaned = select_score_subsample(full_dataset_cleaned, medical_score)
-    full_dataset_cleaned = drop_column_cleanup(full_dataset_cleaned)
-
-    # split datasets for holdout analysis
-    train_dataset_cleaned, control_dataset_cleaned = train_test_split(full_dataset_cleaned, test_size=0.5)
-
-    train_dataset_cleaned = drop_column_cleanup(train_dataset_cleaned)
-    control_dataset_cleaned = drop_column_cleanup(control_dataset_cleaned)
+def holdout_splits(data, n_splits=1, mode="repeated", seed=0):
+    """Index of the control records of every split of DATA.  MODE 'repeated'
+    draws N_SPLITS random halves, seeded with SEED, SEED + 1, ...; 'kfold'
+    uses each of N_SPLITS folds as control once."""
+    if mode == "repeated":
+        return [train_test_split(data.index, test_size=0.5, random_state=seed + i)[1] for i in range(n_splits)]
+    if mode == "kfold":
+        if n_splits < 2:
+            raise ValueError("kfold requires at least 2 splits.")
+        folds = KFold(n_splits=n_splits, shuffle=True, random_state=seed)
+        return [data.index[control] for _, control in folds.split(data)]
+    raise ValueError(f"Unknown split mode {mode}, choose one of {SPLIT_MODES}.")
+
+
+def risk_analysis_split(full_dataset_cleaned, split, control_index, work_dir, medical_score, arx_time_limit=None,
+                        model_selection="cached", score_every_row=False, profiler=None, memo=None,
+                        memory_budget=None, inference_workers=1):
+    """Anonymize and synthesize the training records of one split, score the
+    releases and evaluate their risk against the control records
+    CONTROL_INDEX.  Temporary files are written to WORK_DIR.  Returns the
+    anonymeter and holdout (DCR) results and the equivalence class risk
+    profiles of the releases.  FULL_DATASET_CLEANED is only read;
+    the heap of the ARX JVM is limited to the part of MEMORY_BUDGET (bytes)
+    not used by this process.  INFERENCE_WORKERS processes run the inference
+    attacks of the secrets in parallel."""
+    if profiler is None:
+        profiler = Profiler(f"risk_analysis_split{split}", enabled=False)
+    if memo is None and not score_every_row:
+        memo = ScoreMemo()
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+    temp_files = {name: dict(temp_file=os.path.join(work_dir, f"{name}_input.csv"),
+                             output_file=os.path.join(work_dir, f"{name}_output.csv"))
+                  for name in ["anonymized", "synthetic", "combined", "scores"]}
+
+    train_dataset_cleaned = drop_column_cleanup(full_dataset_cleaned.drop(index=control_index))
+    control_dataset_cleaned = drop_column_cleanup(full_dataset_cleaned.loc[control_index])
+    # the releases are generated from the records before scoring
+    train_dataset_cleaned = drop_score_columns(train_dataset_cleaned)
 
     # anonymization (might take long!)
-    print("Anonymization started.")
-    anonymized_dataset = anonymize_ucc_cardio_data(drop_score_columns(train_dataset_cleaned.copy()),
-                                                   anon_type=medical_score)
+    print(f"Anonymization of split {split} started.")
+    anonymized_dataset = profiler.call("anonymize_ucc_cardio_data", anonymize_ucc_cardio_data,
+                                       train_dataset_cleaned, anon_type=medical_score, time_limit=arx_time_limit,
+                                       max_heap=remaining_memory(memory_budget), **temp_files["anonymized"])
 
     # synthetization (might take long!)
-    print("Synthetization started.")
-    synthetic_dataset = synthesize_ucc_cardio_data(train_dataset_cleaned.copy())
+    print(f"Synthetization of split {split} started.")
+    synthetic_dataset = profiler.call("synthesize_ucc_cardio_data", synthesize_ucc_cardio_data,
+                                      train_dataset_cleaned, model_selection=model_selection,
+                                      **temp_files["synthetic"])
 
     # synthetization (might take long!)
-    print("Synthetization of anonymized Data started.")
+    print(f"Synthetization of anonymized data of split {split} started.")
     anonymized_dataset = anonymized_dataset.replace("*", np.nan)
     anonymized_dataset['alias'] = np.core.defchararray.add('ID_', np.arange(len(anonymized_dataset)).astype(str))
-    synthetic_anon_dataset = synthesize_ucc_cardio_data(anonymized_dataset.copy(),
-                                                        columns_spec=FEATURE_SETS[medical_score]['all'])
+    synthetic_anon_dataset = profiler.call("synthesize_ucc_cardio_data[anonymized]", synthesize_ucc_cardio_data,
+                                           anonymized_dataset, columns_spec=FEATURE_SETS[medical_score]['all'],
+                                           model_selection=model_selection, **temp_files["combined"])
 
     # synthetic_dataset is reduced to the columns in the used FEATURE_SET, missing columns are replaced by nan values
     columns = [c for c in train_dataset_cleaned.keys() if c not in FEATURE_SETS[medical_score]['all']]
     synthetic_anon_dataset[columns] = np.nan
 
-    # score calculation for orig, anon, synth
-
-    full_dataset_cleaned = calculate_scores(full_dataset_cleaned)
-    anonymized_dataset = calculate_scores(anonymized_dataset.replace("*", "nan"))
-    synthetic_dataset = calculate_scores(synthetic_dataset)
-    synthetic_anon_dataset = calculate_scores(synthetic_anon_dataset)
+    # score calculation for anon, synth
+    anonymized_dataset = profiler.call("calculate_scores[anonymized]", calculate_scores,
+                                       anonymized_dataset.replace("*", "nan"), memo=memo, **temp_files["scores"])
+    synthetic_dataset = profiler.call("calculate_scores[synthetic]", calculate_scores, synthetic_dataset, memo=memo,
+                                      **temp_files["scores"])
+    synthetic_anon_dataset = profiler.call("calculate_scores[combined]", calculate_scores, synthetic_anon_dataset,
+                                           memo=memo, **temp_files["scores"])
+    if memo is not None:
+        print(f"Score memo: {memo.stats()}")
 
     # evaluation
 
     string_columns = ["alias", "site", "treatment", "egfr_u", "hb_u", "lvef_u", "sys_bp_u", "creatinine_u", "sodium_u",
                       "ntprobnp_m", "ntprobnp_u", "hstnt_u"]
-    anonymized_dataset[string_columns] = anonymized_dataset[string_columns].astype(object)
-    synthetic_anon_dataset[string_columns] = synthetic_anon_dataset[string_columns].astype(object)
+    for dataset in [anonymized_dataset, synthetic_anon_dataset]:
+        # projected inputs lack most of these columns
+        present = [column for column in string_columns if column in dataset]
+        dataset[present] = dataset[present].astype(object)
 
-    full_dataset_cleaned[["beta", "furosemide1", "statin", "age", "acei_arb"]] = full_dataset_cleaned[
-        ["beta", "furosemide1", "statin", "age", "acei_arb"]].astype("float64")
     anonymized_dataset["age"] = anonymized_dataset["age"].astype("float64")
     synthetic_dataset["age"] = synthetic_dataset["age"].astype("float64")
     synthetic_anon_dataset["age"] = synthetic_anon_dataset["age"].astype("float64")
 
     score_related_columns = get_attributes(medical_score) + ["alias"]
 
-    print("Risk Evaluation started.")
-    results_syn, holdout_res_syn = anonymeter_evaluation(full_dataset_cleaned[score_related_columns],
-                                                         synthetic_dataset[score_related_columns],
-                                                         control_dataset_cleaned[score_related_columns])
-    results_anon, holdout_res_anon = anonymeter_evaluation(full_dataset_cleaned[score_related_columns],
-                                                           anonymized_dataset[score_related_columns],
-                                                           control_dataset_cleaned[score_related_columns])
+    # equivalence class risks as a cheap pre-screen. The releases are linked to a population in their own
+    # representation: the synthetic release to the cohort, the combined release, synthesized from the generalized
+    # and microaggregated values, to the anonymized training records (it would hardly match the original values)
+    releases = dict(zip(RELEASES, [synthetic_dataset, anonymized_dataset, synthetic_anon_dataset]))
+    results_profile = profiler.call("risk_profiles", risk_profiles, releases, QUASI_IDENTIFIERS[medical_score],
+                                    populations={"Synthetic": full_dataset_cleaned, "Combined": anonymized_dataset})
+    print(f"Risk profile of split {split}:")
+    print(results_profile[0].to_string())
+
+    print(f"Risk Evaluation of split {split} started.")
+    results_syn, holdout_res_syn = profiler.call("anonymeter_evaluation[synthetic]", anonymeter_evaluation,
+                                                 full_dataset_cleaned[score_related_columns],
+                                                 synthetic_dataset[score_related_columns],
+                                                 control_dataset_cleaned[score_related_columns],
+                                                 inference_workers=inference_workers)
+    results_anon, holdout_res_anon = profiler.call("anonymeter_evaluation[anonymized]", anonymeter_evaluation,
+                                                   full_dataset_cleaned[score_related_columns],
+                                                   anonymized_dataset[score_related_columns],
+                                                   control_dataset_cleaned[score_related_columns],
+                                                   inference_workers=inference_workers)
+
+    results_combined, holdout_res_combined = profiler.call("anonymeter_evaluation[combined]", anonymeter_evaluation,
+                                                           full_dataset_cleaned[score_related_columns],
+                                                           synthetic_anon_dataset[score_related_columns],
+                                                           control_dataset_cleaned[score_related_columns],
+                                                           inference_workers=inference_workers)
+
+    results_anonymeter = pd.concat([results_syn, results_anon, results_combined], axis=1)
+    results_holdout = pd.concat([holdout_res_syn, holdout_res_anon, holdout_res_combined], axis=1)
+    results_holdout.columns = RELEASES
+    return results_anonymeter, results_holdout, results_profile
+
+
+# cohort of the worker processes, set once per process by _share_cohort
+_COHORT = None
+
+
+def _share_cohort(handles):
+    """Attach the cohort in shared memory, its numeric columns are not copied to the worker."""
+    global _COHORT
+    attach_datasets(handles)
+    _COHORT = attached_dataset("cohort").frame()
+
+
+def _run_split_job(job):
+    split, control_index, work_dir, options = job
+    return risk_analysis_split(_COHORT, split, control_index, work_dir, **options)
+
+
+def _mean_ci(values, confidence=CONFIDENCE):
+    """Mean and half width of the t confidence interval of the mean."""
+    values = pd.to_numeric(values, errors='coerce').dropna()
+    if len(values) < 2:
+        return pd.Series({'mean': values.mean(), 'ci': np.nan, 'n': len(values)})
+    half_width = stats.t.ppf((1 + confidence) / 2, len(values) - 1) * values.std(ddof=1) / np.sqrt(len(values))
+    return pd.Series({'mean': values.mean(), 'ci': half_width, 'n': len(values)})
+
+
+def aggregate_split_results(results, confidence=CONFIDENCE):
+    """Mean and confidence interval over the splits of every numerical
+    anonymeter result (attack, baseline and control success rates, risks) and
+    holdout metric (DCR share) per release.  RESULTS is the list of
+    (anonymeter, holdout, risk profile) results of risk_analysis_split.  Returns two tables
+    with the columns '<metric> mean', '<metric> ci', and '<metric>' formatted
+    as 'mean ± ci'."""
+    anonymeter = []
+    for split, (results_anonymeter, _, _) in enumerate(results):
+        # the anonymeter results of the releases are side by side, in the order of RELEASES
+        n_columns = results_anonymeter.shape[1] // len(RELEASES)
+        for i, release in enumerate(RELEASES):
+            table = results_anonymeter.iloc[:, i * n_columns:(i + 1) * n_columns].transpose()
+            table = table.reset_index(names='metric').melt(id_vars='metric', var_name='attack')
+            anonymeter.append(table.assign(release=release, split=split))
+    holdout = [results_holdout.reset_index(names='metric').melt(id_vars='metric', var_name='release')
+               .assign(attack='holdout', split=split) for split, (_, results_holdout, _) in enumerate(results)]
+
+    summaries = []
+    for long_table in [pd.concat(anonymeter, ignore_index=True), pd.concat(holdout, ignore_index=True)]:
+        long_table = long_table[pd.to_numeric(long_table['value'], errors='coerce').notna()]
+        summary = long_table.groupby(['release', 'attack', 'metric'], sort=False)['value'] \
+            .apply(_mean_ci, confidence=confidence).unstack()
+        summary['mean ± ci'] = summary['mean'].map('{:.4f}'.format) + ' ± ' + summary['ci'].map('{:.4f}'.format)
+        summaries.append(summary.unstack('metric'))
+    return summaries
+
+
+def full_data_analysis(input_path, output_path, medical_score: MEDICAL_SCORE, profiler=None, chunk_size=None,
+                       arx_time_limit=None, model_selection="cached", score_every_row=False, n_splits=1,
+                       split_mode="repeated", seed=0, max_workers=None, memory_budget=None, all_columns=False,
+                       inference_workers=1):
+    """Only the columns the stages use for MEDICAL_SCORE are read from
+    INPUT_PATH, all of them with ALL_COLUMNS.  With a MEMORY_BUDGET in bytes,
+    cohorts that do not fit are preprocessed, filtered and scored in chunks,
+    and parallel splits share the budget.  MAX_WORKERS processes run the
+    splits, INFERENCE_WORKERS processes the inference attacks of a split."""
+    if profiler is None:
+        profiler = Profiler(f"risk_analysis_{medical_score.value}", enabled=False)
+    # scores every combination of score inputs only once across the original and the released datasets
+    memo = None if score_every_row else ScoreMemo()
+    if not os.path.exists(output_path):
+        os.mkdir(output_path)
+
+    # columns of the input used by any stage, see required_columns
+    columns = None if all_columns else required_columns(medical_score, "input")
 
-    results_combined, holdout_res_combined = anonymeter_evaluation(full_dataset_cleaned[score_related_columns],
-                                                                   synthetic_anon_dataset[score_related_columns],
-                                                                   control_dataset_cleaned[score_related_columns])
+    if memory_budget is not None and not chunk_size:
+        chunk_size = chunk_size_for_budget(input_path, memory_budget, columns=columns)
+
+    # general script overview:
+    if chunk_size:
+        # row-local stages (preprocessing, filtering, scoring) chunk by chunk, only the result is loaded
+        print("Chunked preprocessing, filtering and scoring started.")
+        cleaned_file = os.path.join(output_path, f"{Path(input_path).name}_cleaned.parquet")
+        profiler.call("stream_row_local_stages", stream_row_local_stages,
+                      input_path, cleaned_file, medical_score, chunk_size=chunk_size, memo=memo, columns=columns)
+        full_dataset_cleaned = pd.read_parquet(cleaned_file)
+    else:
+        full_dataset = pd.read_csv(input_path, usecols=column_filter(columns))
+
+        # data preprocessing
+        print("Preprocessing started.")
+        full_dataset_cleaned = profiler.call("preprocess", preprocess, full_dataset)
+        del full_dataset
+
+        # Filter subsample
+        print("Filtering started.")
+        full_dataset_cleaned = profiler.call("select_score_subsample", select_score_subsample,
+                                             full_dataset_cleaned, medical_score)
+        full_dataset_cleaned = drop_column_cleanup(full_dataset_cleaned)
+
+    # score calculation of the original, shared by all splits
+    if not chunk_size:
+        full_dataset_cleaned = profiler.call("calculate_scores[original]", calculate_scores, full_dataset_cleaned,
+                                             memo=memo)
+    float_columns = [column for column in ["beta", "furosemide1", "statin", "age", "acei_arb"]
+                     if column in full_dataset_cleaned]
+    full_dataset_cleaned[float_columns] = full_dataset_cleaned[float_columns].astype("float64")
+
+    # split datasets for holdout analysis
+    splits = holdout_splits(full_dataset_cleaned, n_splits, split_mode, seed)
+    split_options = dict(medical_score=medical_score, arx_time_limit=arx_time_limit, model_selection=model_selection,
+                         score_every_row=score_every_row, memory_budget=memory_budget,
+                         inference_workers=inference_workers)
+    work_dir = os.path.abspath(os.path.join("temp", "risk_splits", medical_score.value))
+    if len(splits) == 1 or max_workers == 1:
+        results = [risk_analysis_split(full_dataset_cleaned, i, control_index, os.path.join(work_dir, f"split{i}"),
+                                       profiler=profiler, memo=memo, **split_options)
+                   for i, control_index in enumerate(splits)]
+    else:
+        # the workers attach to the cohort in shared memory, the jobs only carry the indices of the control records
+        print(f"Running {len(splits)} holdout splits in parallel.")
+        if memory_budget is not None:
+            split_options['memory_budget'] = memory_budget / min(len(splits), max_workers or os.cpu_count())
+        jobs = [(i, control_index, os.path.join(work_dir, f"split{i}"), split_options)
+                for i, control_index in enumerate(splits)]
+        with profiler.stage("risk_analysis_splits", full_dataset_cleaned):
+            with SharedDatasets({"cohort": full_dataset_cleaned}) as shared, \
+                    ProcessPoolExecutor(max_workers=max_workers, initializer=_share_cohort,
+                                        initargs=(shared.handles,)) as executor:
+                results = list(executor.map(_run_split_job, jobs))
 
     print("Evaluation finished.")
 
-    results_anonymeter = pd.concat([results_syn, results_anon, results_combined], axis=1)
-    results_holdout = pd.concat([holdout_res_syn, holdout_res_anon, holdout_res_combined], axis=1)
-    results_holdout.columns = ["Synthetic", "Anonymized", "Combined"]
+    prefix = f"{DATE_TODAY}_{medical_score.value}"
+    for i, (results_anonymeter, results_holdout, (risk_summary, risk_distribution)) in enumerate(results):
+        suffix = "" if len(results) == 1 else f"_split{i}"
+        results_anonymeter.to_csv(os.path.join(output_path, f"{prefix}_anonymeter{suffix}.csv"))
+        results_holdout.to_csv(os.path.join(output_path, f"{prefix}_holdout{suffix}.csv"))
+        risk_summary.to_csv(os.path.join(output_path, f"{prefix}_risk_profile{suffix}.csv"))
+        risk_distribution.to_csv(os.path.join(output_path, f"{prefix}_risk_distribution{suffix}.csv"))
+    if len(results) > 1:
+        anonymeter_summary, holdout_summary = aggregate_split_results(results)
+        print(anonymeter_summary.to_string())
+        print(holdout_summary.to_string())
+        anonymeter_summary.to_csv(os.path.join(output_path, f"{prefix}_anonymeter_summary.csv"))
+        holdout_summary.to_csv(os.path.join(output_path, f"{prefix}_holdout_summary.csv"))
 
-    results_anonymeter.to_csv(os.path.join(output_path, f"{DATE_TODAY}_{medical_score.value}_anonymeter.csv"))
-    results_holdout.to_csv(os.path.join(output_path, f"{DATE_TODAY}_{medical_score.value}_holdout.csv"))
+    profiler.write(output_path, f"{DATE_TODAY}_{medical_score.value}")
 
 
 if __name__ == "__main__":
@@ -138,12 +332,57 @@ if __name__ == "__main__":
     argparser.add_argument('--output', '-o', type=str,
                            default=OUTPUT_PATH,
                            help='relative output path')
+    argparser.add_argument('--arx_time_limit', type=float, default=None,
+                           help='wall-clock budget of the ARX anonymization in seconds, the best anonymization found '
+                                'within the budget is used')
+    argparser.add_argument('--model_selection', type=str, default="cached", choices=SELECTION_MODES,
+                           help='marginal distributions of the GaussianCopula model: "cached" uses the selection '
+                                'of synthetization.model_selection for the same data if available, "run" selects '
+                                'them if not, "off" uses the defaults')
+    argparser.add_argument('--chunk_size', type=int, default=None,
+                           help='run preprocessing, filtering and scoring of the original data in chunks of this '
+                                'many rows (requires pyarrow)')
+    argparser.add_argument('--memory_budget', type=float, default=None,
+                           help='memory budget in GB: larger cohorts are processed in chunks, the ARX JVM heap is '
+                                'limited and stages exceeding the budget are flagged in the run report')
+    argparser.add_argument('--score_every_row', action='store_true',
+                           help='score every row in R instead of every distinct combination of score inputs once')
+    argparser.add_argument('--splits', type=int, default=1,
+                           help='number of holdout splits, the risks are reported as mean and confidence interval '
+                                'over the splits')
+    argparser.add_argument('--split_mode', type=str, default="repeated", choices=SPLIT_MODES,
+                           help='"repeated" draws random halves as control, "kfold" uses every fold as control once')
+    argparser.add_argument('--seed', type=int, default=0,
+                           help='random seed of the splits')
+    argparser.add_argument('--workers', type=int, default=None,
+                           help='number of worker processes running the splits (default: number of CPUs)')
+    argparser.add_argument('--inference_workers', type=int, default=1,
+                           help='number of worker processes running the anonymeter inference attacks of the secrets '
+                                'in parallel on datasets in shared memory (default: 1, no worker processes)')
+    argparser.add_argument('--profile', action='store_true',
+                           help='write a run report and a Chrome trace with per-stage timing, memory and row counts')
+    argparser.add_argument('--all_columns', action='store_true',
+                           help='read and release all columns of the input (e.g. site, treatment, units) instead of '
+                                'only the features of the score')
     args = argparser.parse_args()
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * 2 ** 30)
 
     if not os.path.exists(args.output):
         os.makedirs(args.output)
         os.makedirs(os.path.join(args.output, "BIOHF"))
         os.makedirs(os.path.join(args.output, "MAGGIC"))
 
-    full_data_analysis(args.input_original, os.path.join(args.output, "BIOHF"), MEDICAL_SCORE.BIOHF)
-    full_data_analysis(args.input_original, os.path.join(args.output, "MAGGIC"), MEDICAL_SCORE.MAGGIC)
+    full_data_analysis(args.input_original, os.path.join(args.output, "BIOHF"), MEDICAL_SCORE.BIOHF,
+                       profiler=Profiler("risk_analysis_BIOHF", enabled=args.profile, memory_budget=memory_budget),
+                       chunk_size=args.chunk_size, arx_time_limit=args.arx_time_limit,
+                       model_selection=args.model_selection, score_every_row=args.score_every_row,
+                       n_splits=args.splits, split_mode=args.split_mode, seed=args.seed, max_workers=args.workers,
+                       memory_budget=memory_budget, all_columns=args.all_columns,
+                       inference_workers=args.inference_workers)
+    full_data_analysis(args.input_original, os.path.join(args.output, "MAGGIC"), MEDICAL_SCORE.MAGGIC,
+                       profiler=Profiler("risk_analysis_MAGGIC", enabled=args.profile, memory_budget=memory_budget),
+                       chunk_size=args.chunk_size, arx_time_limit=args.arx_time_limit,
+                       model_selection=args.model_selection, score_every_row=args.score_every_row,
+                       n_splits=args.splits, split_mode=args.split_mode, seed=args.seed, max_workers=args.workers,
+                       memory_budget=memory_budget, all_columns=args.all_columns,
+                       inference_workers=args.inference_workers)
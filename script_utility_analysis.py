@@ -21,6 +21,7 @@
 
 import os
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import warnings
@@ -30,10 +31,15 @@ import pandas as pd
 
 from anonymization.anonymization_script import anonymize_ucc_cardio_data
 from evaluation.evaluation_script import evaluate_datasets
-from evaluation.local_utils import MEDICAL_SCORE, FEATURE_SETS
+from evaluation.constants import MEDICAL_SCORE, FEATURE_SETS, required_columns, column_filter
+from evaluation.plot_summaries import SUMMARY_MODES
+from evaluation.plots import IMAGE_FORMATS
+from profiling.instrumentation import Profiler, remaining_memory
+from preprocessing.chunked_processing import stream_row_local_stages, chunk_size_for_budget
 from preprocessing.filtering import select_score_subsample
 from preprocessing.preprocess_UCC import preprocess, drop_score_columns, drop_column_cleanup
-from score_calculation.score_calculation import calculate_scores
+from score_calculation.score_calculation import calculate_scores, ScoreMemo
+from synthetization.model_selection import SELECTION_MODES
 from synthetization.synthetization_script import synthesize_ucc_cardio_data
 
 DATE_TODAY = datetime.now().strftime('%Y-%m-%d')
@@ -41,37 +47,73 @@ DATE_TODAY = datetime.now().strftime('%Y-%m-%d')
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
-def full_data_analysis(input_path, output_path, medical_score: MEDICAL_SCORE):
+def full_data_analysis(input_path, output_path, medical_score: MEDICAL_SCORE, image_format="eps", plot_workers=None,
+                       plot_summary_mode="auto", profiler=None, chunk_size=None,
+                       arx_time_limit=None, model_selection="cached", score_every_row=False, memory_budget=None,
+                       all_columns=False, plot_executor=None):
+    """The stages only read their input datasets and return new ones, so the
+    cohort is not copied defensively.  With a process pool PLOT_EXECUTOR
+    shared by the analyses of all scores, the plots are submitted to it and
+    the futures of the plot files are returned.  Only the columns the stages use for
+    MEDICAL_SCORE are read from INPUT_PATH, all of them with ALL_COLUMNS.
+    With a MEMORY_BUDGET in bytes, cohorts that do not fit are preprocessed,
+    filtered and scored in chunks, and the heap of the ARX JVM is limited to
+    the part of the budget not used here."""
+    if profiler is None:
+        profiler = Profiler(f"utility_analysis_{medical_score.value}", enabled=False)
+    # scores every combination of score inputs only once across the original and the released datasets
+    memo = None if score_every_row else ScoreMemo()
 
     if not os.path.exists(output_path):
         os.mkdir(output_path)
 
-    # general script overview:
-    full_dataset = pd.read_csv(input_path)
+    filename = Path(input_path).name
+    # columns of the input used by any stage, see required_columns
+    columns = None if all_columns else required_columns(medical_score, "input")
 
-    ## data preprocessing
-    print("Preprocessing started.")
-    full_dataset_cleaned = preprocess(full_dataset)
+    if memory_budget is not None and not chunk_size:
+        chunk_size = chunk_size_for_budget(input_path, memory_budget, columns=columns)
 
-    ## Filter subsample
-    print("Filtering started.")
-    full_dataset_cleaned = select_score_subsample(full_dataset_cleaned, medical_score)
-    full_dataset_cleaned = drop_column_cleanup(full_dataset_cleaned)
+    # general script overview:
+    if chunk_size:
+        ## row-local stages (preprocessing, filtering, scoring) chunk by chunk, only the result is loaded
+        print("Chunked preprocessing, filtering and scoring started.")
+        cleaned_file = os.path.join(output_path, f"{filename}_cleaned.parquet")
+        profiler.call("stream_row_local_stages", stream_row_local_stages,
+                      input_path, cleaned_file, medical_score, chunk_size=chunk_size, memo=memo, columns=columns)
+        full_dataset_cleaned = pd.read_parquet(cleaned_file)
+    else:
+        full_dataset = pd.read_csv(input_path, usecols=column_filter(columns))
+
+        ## data preprocessing
+        print("Preprocessing started.")
+        full_dataset_cleaned = profiler.call("preprocess", preprocess, full_dataset)
+        del full_dataset
+
+        ## Filter subsample
+        print("Filtering started.")
+        full_dataset_cleaned = profiler.call("select_score_subsample", select_score_subsample,
+                                             full_dataset_cleaned, medical_score)
+        full_dataset_cleaned = drop_column_cleanup(full_dataset_cleaned)
 
     ## anonymization (might take long!)
     print("Anonymization started.")
-    anonymized_dataset = anonymize_ucc_cardio_data(drop_score_columns(full_dataset_cleaned.copy()), anon_type=medical_score)
+    anonymized_dataset = profiler.call("anonymize_ucc_cardio_data", anonymize_ucc_cardio_data,
+                                       drop_score_columns(full_dataset_cleaned), anon_type=medical_score,
+                                       time_limit=arx_time_limit, max_heap=remaining_memory(memory_budget))
 
     ## synthetization (might take long!)
     print("Synthetization started.")
-    synthetic_dataset = synthesize_ucc_cardio_data(full_dataset_cleaned.copy())
+    synthetic_dataset = profiler.call("synthesize_ucc_cardio_data", synthesize_ucc_cardio_data,
+                                      full_dataset_cleaned, model_selection=model_selection)
 
     ## synthetization (might take long!)
     print("Synthetization of anonymized Data started.")
     anonymized_dataset = anonymized_dataset.replace("*", np.nan)
     anonymized_dataset['alias'] = np.arange(len(anonymized_dataset))
-    synthetic_anon_dataset = synthesize_ucc_cardio_data(anonymized_dataset.copy(),
-                                                        columns_spec=FEATURE_SETS[medical_score]['all'])
+    synthetic_anon_dataset = profiler.call("synthesize_ucc_cardio_data[anonymized]", synthesize_ucc_cardio_data,
+                                           anonymized_dataset, columns_spec=FEATURE_SETS[medical_score]['all'],
+                                           model_selection=model_selection)
 
     # synthetic_dataset is reduced to the columns in the used FEATURE_SET, missing columns are replaced by nan values
     columns = [c for c in synthetic_dataset.keys() if c not in FEATURE_SETS[medical_score]['all']]
@@ -79,14 +121,18 @@ def full_data_analysis(input_path, output_path, medical_score: MEDICAL_SCORE):
 
     ## scoring
     print("Scoring started.")
-    full_dataset_cleaned = calculate_scores(full_dataset_cleaned)
+    if not chunk_size:
+        full_dataset_cleaned = profiler.call("calculate_scores[original]", calculate_scores, full_dataset_cleaned,
+                                             memo=memo)
 
-    anonymized_dataset = calculate_scores(anonymized_dataset)
-    synthetic_dataset = calculate_scores(synthetic_dataset)
-    synthetic_anon_dataset = calculate_scores(synthetic_anon_dataset)
+    anonymized_dataset = profiler.call("calculate_scores[anonymized]", calculate_scores, anonymized_dataset, memo=memo)
+    synthetic_dataset = profiler.call("calculate_scores[synthetic]", calculate_scores, synthetic_dataset, memo=memo)
+    synthetic_anon_dataset = profiler.call("calculate_scores[combined]", calculate_scores, synthetic_anon_dataset,
+                                           memo=memo)
+    if memo is not None:
+        print(f"Score memo: {memo.stats()}")
 
     ## exporting
-    filename = Path(input_path).name
     anonymized_dataset.to_csv(os.path.join(output_path, f"{filename}_anonymized.csv"))
     synthetic_dataset.to_csv(os.path.join(output_path, f"{filename}_synthetic.csv"))
     synthetic_anon_dataset.to_csv(os.path.join(output_path, f"{filename}_synth_anon.csv"))
@@ -94,11 +140,16 @@ def full_data_analysis(input_path, output_path, medical_score: MEDICAL_SCORE):
     ## evaluation
     print("Evaluation started.")
 
-    anonymized_dataset[["alias", "site", "treatment"]] = \
-        anonymized_dataset[["alias", "site", "treatment"]].astype(object)
+    string_columns = [column for column in ["alias", "site", "treatment"] if column in anonymized_dataset]
+    anonymized_dataset[string_columns] = anonymized_dataset[string_columns].astype(object)
+
+    plots = profiler.call("evaluate_datasets", evaluate_datasets,
+                          full_dataset_cleaned, synthetic_dataset, anonymized_dataset, synthetic_anon_dataset,
+                          output_path, medical_score, image_format=image_format, max_workers=plot_workers,
+                          plot_summary_mode=plot_summary_mode, executor=plot_executor)
 
-    evaluate_datasets(full_dataset_cleaned, synthetic_dataset, anonymized_dataset, synthetic_anon_dataset,
-                      output_path, medical_score)
+    profiler.write(output_path, f"{DATE_TODAY}_{medical_score.value}")
+    return plots
 
 
 if __name__ == "__main__":
@@ -112,12 +163,61 @@ if __name__ == "__main__":
     argparser.add_argument('--output', '-o', type=str,
                            default=OUTPUT_PATH,
                            help='relative output path')
+    argparser.add_argument('--image_format', type=str,
+                           default="eps", choices=IMAGE_FORMATS,
+                           help='file format of the ecdf and violin plots')
+    argparser.add_argument('--plot_workers', type=int,
+                           default=None,
+                           help='number of worker processes rendering the plots (default: number of CPUs)')
+    argparser.add_argument('--plot_summary', type=str,
+                           default="auto", choices=SUMMARY_MODES,
+                           help='plot exact ECDFs/violins ("exact"), fixed-size summaries ("summary") '
+                                'or summaries only for large datasets ("auto")')
+    argparser.add_argument('--arx_time_limit', type=float, default=None,
+                           help='wall-clock budget of the ARX anonymization in seconds, the best anonymization found '
+                                'within the budget is used')
+    argparser.add_argument('--model_selection', type=str, default="cached", choices=SELECTION_MODES,
+                           help='marginal distributions of the GaussianCopula model: "cached" uses the selection '
+                                'of synthetization.model_selection for the same data if available, "run" selects '
+                                'them if not, "off" uses the defaults')
+    argparser.add_argument('--chunk_size', type=int, default=None,
+                           help='run preprocessing, filtering and scoring of the original data in chunks of this '
+                                'many rows (requires pyarrow)')
+    argparser.add_argument('--memory_budget', type=float, default=None,
+                           help='memory budget in GB: larger cohorts are processed in chunks, the ARX JVM heap is '
+                                'limited and stages exceeding the budget are flagged in the run report')
+    argparser.add_argument('--score_every_row', action='store_true',
+                           help='score every row in R instead of every distinct combination of score inputs once')
+    argparser.add_argument('--profile', action='store_true',
+                           help='write a run report and a Chrome trace with per-stage timing, memory and row counts')
+    argparser.add_argument('--all_columns', action='store_true',
+                           help='read and release all columns of the input (e.g. site, treatment, units) instead of '
+                                'only the features of the score')
     args = argparser.parse_args()
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * 2 ** 30)
 
     if not os.path.exists(args.output):
         os.makedirs(args.output)
         os.makedirs(os.path.join(args.output, "BIOHF"))
         os.makedirs(os.path.join(args.output, "MAGGIC"))
 
-    full_data_analysis(args.input_original, os.path.join(args.output, "BIOHF"), MEDICAL_SCORE.BIOHF)
-    full_data_analysis(args.input_original, os.path.join(args.output, "MAGGIC"), MEDICAL_SCORE.MAGGIC)
+    # one pool renders the plots of both scores, those of BIOHF while the MAGGIC datasets are generated
+    plot_executor = None if args.plot_workers == 1 else ProcessPoolExecutor(max_workers=args.plot_workers)
+    plots = []
+    try:
+        for medical_score in [MEDICAL_SCORE.BIOHF, MEDICAL_SCORE.MAGGIC]:
+            plots += full_data_analysis(args.input_original, os.path.join(args.output, medical_score.value),
+                                        medical_score, image_format=args.image_format, plot_workers=args.plot_workers,
+                                        plot_summary_mode=args.plot_summary,
+                                        profiler=Profiler(f"utility_analysis_{medical_score.value}",
+                                                          enabled=args.profile, memory_budget=memory_budget),
+                                        chunk_size=args.chunk_size, arx_time_limit=args.arx_time_limit,
+                                        model_selection=args.model_selection, score_every_row=args.score_every_row,
+                                        memory_budget=memory_budget, all_columns=args.all_columns,
+                                        plot_executor=plot_executor)
+        if plot_executor is not None:
+            # raises the first error of a plot
+            print(f"Rendered {len([plot.result() for plot in plots])} plots.")
+    finally:
+        if plot_executor is not None:
+            plot_executor.shutdown()
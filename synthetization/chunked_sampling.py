@@ -0,0 +1,188 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Large synthetic cohorts sampled in chunks to a Parquet dataset.
+
+run_synthetization samples as many records as the input has and keeps them in
+memory.  For load tests of downstream systems, sample_to_parquet draws any
+number of records from a fitted GaussianCopula model (IncrementalGaussianCopula)
+in chunks of a fixed number of rows and writes every chunk to its own part file
+of an output directory as soon as it is sampled, so the memory stays that of
+one chunk per worker:
+
+    python -m synthetization.chunked_sampling -i data/input.csv -o temp/synthetic -n 10000000 --workers 4
+    python -m synthetization.chunked_sampling -m temp/copula.json -o temp/synthetic -n 10000000
+
+The random numbers of chunk i come from the i-th child of the seed sequence of
+the seed, so the part files do not depend on the number of workers or on the
+order in which the chunks finish.  The part files keep the types of the
+cohort (model_schema): integers for the id, the integer and the binary
+columns, floats for measurements and strings for text.  The directory is read
+with pandas.read_parquet(output_dir) or any other Parquet reader.
+"""
+import glob
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from synthetization.incremental_copula import IncrementalGaussianCopula
+
+CHUNK_ROWS = 100000
+PART_FILE = "part-{:05d}.parquet"
+
+# model of this worker process, see _load_model
+_MODEL = None
+
+
+def chunk_bounds(num_rows, chunk_rows=CHUNK_ROWS):
+    """First row and number of rows of every chunk of NUM_ROWS rows."""
+    return [(start, min(chunk_rows, num_rows - start)) for start in range(0, num_rows, chunk_rows)]
+
+
+def chunk_seed(seed, chunk):
+    """Seed sequence of CHUNK, the same as SeedSequence(SEED).spawn(n)[CHUNK] for every n > CHUNK."""
+    return np.random.SeedSequence(seed, spawn_key=(chunk,))
+
+
+def _is_integer(category):
+    return isinstance(category, (int, np.integer, float, np.floating)) and not isinstance(category, bool) and \
+        float(category).is_integer()
+
+
+def model_schema(model):
+    """Parquet schema of the records of MODEL, with the types of the cohort:
+    int64 for the id, the integer columns and the categorical columns whose
+    categories are all integers (e.g. the binary flags, read as 0.0/1.0),
+    float64 for the other numbers and string only for text."""
+    import pyarrow as pa
+    fields = [] if model.id_column is None else [(model.id_column, pa.int64())]
+    for column in model.numerical:
+        fields.append((column, pa.int64() if column in model.integer else pa.float64()))
+    for column in model.categorical:
+        categories = [category for category in model.categories[column] if category is not None]
+        if categories and all(_is_integer(category) for category in categories):
+            fields.append((column, pa.int64()))
+        elif categories and all(isinstance(category, (bool, np.bool_)) for category in categories):
+            fields.append((column, pa.bool_()))
+        elif categories and all(isinstance(category, (int, float, np.number)) for category in categories):
+            fields.append((column, pa.float64()))
+        else:
+            fields.append((column, pa.string()))
+    return pa.schema(fields)
+
+
+def conform_to_model_schema(synthetic, schema):
+    """Table of the sampled records SYNTHETIC in the types of SCHEMA, missing values as nulls."""
+    import pyarrow as pa
+    columns = {}
+    for field in schema:
+        column = synthetic[field.name]
+        if field.type == pa.int64():
+            columns[field.name] = pd.array(pd.to_numeric(column), dtype='Int64')
+        elif field.type == pa.float64():
+            columns[field.name] = pd.to_numeric(column).astype('float64')
+        elif field.type == pa.bool_():
+            columns[field.name] = pd.array(column, dtype='boolean')
+        else:
+            columns[field.name] = column.astype(str).where(column.notna(), None)
+    return pa.Table.from_pandas(pd.DataFrame(columns), schema=schema, preserve_index=False)
+
+
+def _load_model(state):
+    global _MODEL
+    _MODEL = IncrementalGaussianCopula.from_dict(state)
+
+
+def sample_chunk(model, chunk, start, rows, seed, output_dir, schema):
+    """Sample ROWS records of CHUNK (starting at row START) with the seed
+    sequence of the chunk and write them to its part file in OUTPUT_DIR.
+    Returns the path of the part file."""
+    import pyarrow.parquet as pq
+    synthetic = model.sample(rows, seed=chunk_seed(seed, chunk))
+    if model.id_column is not None:
+        # unique over all chunks
+        synthetic[model.id_column] += start
+    path = os.path.join(output_dir, PART_FILE.format(chunk))
+    pq.write_table(conform_to_model_schema(synthetic, schema), path)
+    return path
+
+
+def _sample_chunk_job(chunk, start, rows, seed, output_dir, schema):
+    return sample_chunk(_MODEL, chunk, start, rows, seed, output_dir, schema)
+
+
+def sample_to_parquet(model, num_rows, output_dir, chunk_rows=CHUNK_ROWS, seed=0, max_workers=1):
+    """Sample NUM_ROWS records of MODEL in chunks of CHUNK_ROWS rows to the
+    part files of OUTPUT_DIR (part files of an earlier run are removed), in
+    MAX_WORKERS processes (in this process if 1, all CPUs if None).  Returns
+    the paths of the part files in the order of the chunks."""
+    os.makedirs(output_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(output_dir, "part-*.parquet")):
+        os.remove(path)
+    schema = model_schema(model)
+    chunks = chunk_bounds(num_rows, chunk_rows)
+    print(f"Sampling {num_rows} records in {len(chunks)} chunks of at most {chunk_rows} rows to {output_dir}.")
+
+    paths = [None] * len(chunks)
+    if max_workers == 1:
+        for chunk, (start, rows) in enumerate(chunks):
+            paths[chunk] = sample_chunk(model, chunk, start, rows, seed, output_dir, schema)
+            print(f"Chunk {chunk + 1}/{len(chunks)} written.")
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_load_model,
+                                 initargs=(model.to_dict(),)) as executor:
+            futures = {executor.submit(_sample_chunk_job, chunk, start, rows, seed, output_dir, schema): chunk
+                       for chunk, (start, rows) in enumerate(chunks)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                paths[futures[future]] = future.result()
+                print(f"Chunk {futures[future] + 1}/{len(chunks)} written ({done} done).")
+    return paths
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Sample a large synthetic cohort in chunks to a directory of Parquet '
+                                           'files.')
+    source = argparser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', '-i', type=str,
+                        help='input csv file to fit the GaussianCopula model on')
+    source.add_argument('--model', '-m', type=str,
+                        help='JSON file of a fitted incremental GaussianCopula model')
+    argparser.add_argument('--output', '-o', type=str, required=True,
+                           help='output directory of the Parquet part files')
+    argparser.add_argument('--rows', '-n', type=int, required=True,
+                           help='number of records to sample')
+    argparser.add_argument('--chunk_rows', type=int, default=CHUNK_ROWS,
+                           help='number of records per chunk and part file')
+    argparser.add_argument('--workers', type=int, default=1,
+                           help='number of worker processes sampling chunks in parallel (0: number of CPUs)')
+    argparser.add_argument('--model_selection', type=str, default="cached", choices=["cached", "run", "off"],
+                           help='choice of the marginal distributions when fitting on --input, see '
+                                'synthetization.model_selection')
+    argparser.add_argument('--seed', type=int, default=0,
+                           help='random seed')
+    args = argparser.parse_args()
+
+    if args.model is not None:
+        model = IncrementalGaussianCopula.load(args.model)
+    else:
+        from synthetization.incremental_copula import read_model_input
+        from synthetization.synthetization_script import fit_copula_model
+        model = fit_copula_model(read_model_input(args.input), model_selection=args.model_selection)
+    sample_to_parquet(model, args.rows, args.output, chunk_rows=args.chunk_rows, seed=args.seed,
+                      max_workers=args.workers or None)
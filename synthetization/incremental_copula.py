@@ -0,0 +1,444 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Incremental GaussianCopula model updated from mergeable sufficient statistics.
+
+run_synthetization refits the GaussianCopula model on the whole cohort.  When
+new patients are appended, IncrementalGaussianCopula updates the model from
+the new batch only: it keeps per column running moments (count, mean, second
+and third central moment, minimum, maximum), a histogram on a fixed grid and
+the share of missing values, per categorical column the category counts, and
+the sums of the normal scores and of their products from which the correlation
+matrix is computed.  All of these merge exactly, except that the normal scores
+of a batch are computed with the marginals known at the time of its update.
+check_against_full_refit compares the model with one fitted on the full data,
+which is also how a periodic full refit is done:
+
+    python -m synthetization.incremental_copula fit -i data/cohort.csv -m temp/copula.json
+    python -m synthetization.incremental_copula update -i data/new_patients.csv -m temp/copula.json
+    python -m synthetization.incremental_copula check -i data/cohort_all.csv -m temp/copula.json --refit
+    python -m synthetization.incremental_copula sample -n 1000 -m temp/copula.json -o temp/synthetic.csv
+
+The parametric marginals are estimated with the method of moments instead of
+maximum likelihood, and gaussian_kde is a binned kernel density estimate on
+the histogram, so the model is close to but not identical with the ASyH one.
+"""
+import json
+from argparse import ArgumentParser
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from ASyH_scripts.utility import get_metadata
+from preprocessing.preprocess_UCC import limiters
+
+# 2: deterministic normal scores and sorted categories, the score sums of version 1 models are not comparable
+MODEL_VERSION = 2
+HISTOGRAM_BINS = 1000
+# the cumulative distribution functions of the binned marginals are interpolated on this many points
+GRID_POINTS = 4096
+# fixed histogram ranges, given by the plausibility limits of the preprocessing
+HISTOGRAM_RANGES = {lim.key: lim.bounds for lim in limiters if lim.bounds is not None}
+# months of heart failure, at most 12 per year of the maximal age
+HISTOGRAM_RANGES['hf_duration'] = (0, 12 * HISTOGRAM_RANGES['age'][1])
+# correlation drift above which check_against_full_refit recommends a full refit.  Updates with random batches
+# of 1500 to 20000 records drift by at most 0.01 (0.001 for 20000), batches of shifted marginals (sorted by
+# age) by 0.03 to 0.045 for 2000 records
+REFIT_TOLERANCE = 0.02
+# keeps the normal scores finite
+EPSILON = 1e-6
+
+
+def category_key(category):
+    """Sort key of the categories: numbers, then strings, then missing values (None)."""
+    return category is None, isinstance(category, str), category if category is not None else 0
+
+
+def batch_moments(values):
+    """Sufficient statistics of the non-missing VALUES of one column."""
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {'n': 0, 'mean': 0.0, 'm2': 0.0, 'm3': 0.0, 'min': None, 'max': None}
+    mean = values.mean()
+    deviation = values - mean
+    return {'n': len(values), 'mean': float(mean), 'm2': float((deviation ** 2).sum()),
+            'm3': float((deviation ** 3).sum()), 'min': float(values.min()), 'max': float(values.max())}
+
+
+def merge_moments(a, b):
+    """Merge the moments of two batches (Chan et al., Pebay)."""
+    if a['n'] == 0:
+        return dict(b)
+    if b['n'] == 0:
+        return dict(a)
+    n = a['n'] + b['n']
+    delta = b['mean'] - a['mean']
+    return {'n': n,
+            'mean': a['mean'] + delta * b['n'] / n,
+            'm2': a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / n,
+            'm3': (a['m3'] + b['m3'] + delta ** 3 * a['n'] * b['n'] * (a['n'] - b['n']) / n ** 2 +
+                   3 * delta * (a['n'] * b['m2'] - b['n'] * a['m2']) / n),
+            'min': min(a['min'], b['min']),
+            'max': max(a['max'], b['max'])}
+
+
+class IncrementalGaussianCopula:
+    """GaussianCopula model of the columns in METADATA with the marginal
+    DISTRIBUTIONS of the numerical columns (see run_synthetization)."""
+
+    def __init__(self, metadata, distributions, default_distribution='uniform'):
+        self.numerical = [column for column, spec in metadata['columns'].items() if spec['sdtype'] == 'numerical']
+        self.categorical = [column for column, spec in metadata['columns'].items()
+                            if spec['sdtype'] in ('categorical', 'boolean')]
+        self.integer = [column for column in self.numerical
+                        if metadata['columns'][column].get('computer_representation') == 'Int64']
+        self.id_column = metadata.get('primary_key')
+        self.distributions = {column: distributions.get(column, default_distribution) for column in self.numerical}
+        self.reset()
+
+    def reset(self):
+        """Drop all records, keeping the columns and distributions."""
+        self.moments = {column: batch_moments(np.array([])) for column in self.numerical}
+        self.missing = {column: 0 for column in self.numerical}
+        self.ranges = {column: HISTOGRAM_RANGES.get(column) for column in self.numerical}
+        self.histograms = {column: np.zeros(HISTOGRAM_BINS) for column in self.numerical}
+        # categories sorted by category_key, missing values are a category of their own (None)
+        self.categories = {column: [] for column in self.categorical}
+        self.counts = {column: [] for column in self.categorical}
+        self.n_rows = 0
+        self.n_updates = 0
+        self.score_sum = np.zeros(len(self.columns))
+        self.score_products = np.zeros((len(self.columns), len(self.columns)))
+        self._marginals = {}
+
+    @property
+    def columns(self):
+        return self.numerical + self.categorical
+
+    @classmethod
+    def fit(cls, data, distributions, metadata=None):
+        """Model fitted on DATA in a single batch, i.e. a full refit."""
+        model = cls(get_metadata() if metadata is None else metadata, distributions)
+        model.update(data)
+        return model
+
+    def update(self, batch):
+        """Add the records of BATCH.  The marginals are updated first, the
+        normal scores of BATCH are then computed with the updated marginals."""
+        missing_columns = [column for column in self.columns if column not in batch]
+        if missing_columns:
+            raise ValueError(f"The batch lacks the columns {missing_columns} of the model.")
+        for column in self.numerical:
+            values = pd.to_numeric(batch[column], errors='coerce').to_numpy(dtype=float)
+            self._update_numerical(column, values)
+        for column in self.categorical:
+            self._update_categorical(column, batch[column])
+        self._marginals = {}
+
+        scores = self.normal_scores(batch)
+        self.score_sum += scores.sum(axis=0)
+        self.score_products += scores.T @ scores
+        self.n_rows += len(batch)
+        self.n_updates += 1
+        return self
+
+    def _update_numerical(self, column, values):
+        present = values[~np.isnan(values)]
+        self.missing[column] += len(values) - len(present)
+        self.moments[column] = merge_moments(self.moments[column], batch_moments(values))
+        if len(present) == 0:
+            return
+        if self.ranges[column] is None:
+            # no plausibility limits: fixed by the first batch, widened by its width on both sides
+            low, high = present.min(), present.max()
+            width = max(high - low, 1.0)
+            self.ranges[column] = (float(low - width), float(high + width))
+        low, high = self.ranges[column]
+        bins = np.clip(((present - low) / (high - low) * HISTOGRAM_BINS).astype(int), 0, HISTOGRAM_BINS - 1)
+        self.histograms[column] += np.bincount(bins, minlength=HISTOGRAM_BINS)
+
+    def _update_categorical(self, column, values):
+        for category, count in values.value_counts(dropna=False).items():
+            if pd.isna(category):
+                category = None
+            elif hasattr(category, 'item'):
+                category = category.item()
+            if category in self.categories[column]:
+                self.counts[column][self.categories[column].index(category)] += int(count)
+            else:
+                self.categories[column].append(category)
+                self.counts[column].append(int(count))
+        # the intervals of the categories do not depend on the order of the batches
+        order = sorted(range(len(self.categories[column])), key=lambda i: category_key(self.categories[column][i]))
+        self.categories[column] = [self.categories[column][i] for i in order]
+        self.counts[column] = [self.counts[column][i] for i in order]
+
+    def marginal(self, column):
+        """Frozen scipy distribution, or (grid, cdf) of a binned marginal."""
+        if column not in self._marginals:
+            self._marginals[column] = self._fit_marginal(column)
+        return self._marginals[column]
+
+    def _fit_marginal(self, column):
+        moments = self.moments[column]
+        distribution = self.distributions[column]
+        low, high = moments['min'], moments['max']
+        if moments['n'] < 2 or low == high:
+            return stats.uniform(low or 0.0, max((high or 0.0) - (low or 0.0), EPSILON))
+        mean, var = moments['mean'], moments['m2'] / moments['n']
+        std = np.sqrt(var)
+        if distribution == 'gamma':
+            skew = moments['m3'] / moments['n'] / std ** 3
+            if skew > 0:
+                a = 4 / skew ** 2
+                scale = std * skew / 2
+                return stats.gamma(a, mean - a * scale, scale)
+            # not right skewed, the gamma distribution degenerates to the normal one
+            distribution = 'norm'
+        if distribution == 'beta':
+            margin = EPSILON * (high - low)
+            loc, scale = low - margin, high - low + 2 * margin
+            m, v = (mean - loc) / scale, var / scale ** 2
+            common = m * (1 - m) / v - 1
+            if common > 0:
+                return stats.beta(m * common, (1 - m) * common, loc, scale)
+            distribution = 'uniform'
+        if distribution == 'norm':
+            return stats.norm(mean, std)
+        if distribution == 'truncnorm':
+            return stats.truncnorm((low - mean) / std, (high - mean) / std, mean, std)
+        if distribution == 'uniform':
+            return stats.uniform(low, high - low)
+        if distribution == 'gaussian_kde':
+            return self._binned_kde(column, std)
+        raise ValueError(f"Unknown distribution {distribution} of column {column}.")
+
+    def _binned_kde(self, column, std):
+        # Gaussian kernels at the bin centers, weighted by the counts, with Scott's bandwidth
+        low, high = self.ranges[column]
+        counts = self.histograms[column]
+        centers = low + (np.arange(HISTOGRAM_BINS) + 0.5) * (high - low) / HISTOGRAM_BINS
+        weights = counts[counts > 0] / counts.sum()
+        centers = centers[counts > 0]
+        bandwidth = max(std * counts.sum() ** (-1 / 5), (high - low) / HISTOGRAM_BINS)
+        grid = np.linspace(centers.min() - 4 * bandwidth, centers.max() + 4 * bandwidth, GRID_POINTS)
+        cdf = np.zeros(GRID_POINTS)
+        for start in range(0, len(centers), 256):
+            cdf += stats.norm.cdf((grid[:, None] - centers[None, start:start + 256]) / bandwidth) \
+                   @ weights[start:start + 256]
+        return grid, np.maximum.accumulate(cdf)
+
+    def cdf(self, column, values):
+        marginal = self.marginal(column)
+        if isinstance(marginal, tuple):
+            return np.interp(values, *marginal)
+        return marginal.cdf(values)
+
+    def ppf(self, column, quantiles):
+        marginal = self.marginal(column)
+        if isinstance(marginal, tuple):
+            grid, cdf = marginal
+            return np.interp(quantiles, cdf, grid)
+        return marginal.ppf(quantiles)
+
+    def category_bounds(self, column):
+        """Lower and upper bounds of the intervals of [0, 1] of the categories,
+        proportional to their counts."""
+        upper = np.cumsum(self.counts[column]) / sum(self.counts[column])
+        return np.concatenate([[0.0], upper[:-1]]), upper
+
+    def normal_scores(self, data):
+        """Normal scores of the COLUMNS of DATA under the current marginals.
+        Missing numerical values get the score 0, categories the score of the
+        middle of their interval.  The scores are deterministic, so that a
+        refit on the same data gives the same correlations."""
+        scores = np.zeros((len(data), len(self.columns)))
+        for i, column in enumerate(self.numerical):
+            values = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=float)
+            present = ~np.isnan(values)
+            quantiles = np.clip(self.cdf(column, values[present]), EPSILON, 1 - EPSILON)
+            scores[present, i] = stats.norm.ppf(quantiles)
+        for i, column in enumerate(self.categorical, start=len(self.numerical)):
+            lower, upper = self.category_bounds(column)
+            categories = self.categories[column]
+            # pandas does not reliably match missing values against a None in an index
+            index = pd.Index([np.nan if category is None else category for category in categories],
+                             dtype=object).get_indexer(data[column].astype(object))
+            missing = data[column].isna().to_numpy()
+            index[missing] = categories.index(None) if None in categories else -1
+            if (index < 0).any():
+                raise ValueError(f"Column {column} has categories that are not in the model.")
+            quantiles = (lower[index] + upper[index]) / 2
+            scores[:, i] = stats.norm.ppf(np.clip(quantiles, EPSILON, 1 - EPSILON))
+        return scores
+
+    def correlation(self):
+        """Correlation matrix of the normal scores, projected onto the positive
+        definite matrices."""
+        mean = self.score_sum / self.n_rows
+        covariance = self.score_products / self.n_rows - np.outer(mean, mean)
+        std = np.sqrt(np.maximum(np.diag(covariance), EPSILON))
+        correlation = covariance / np.outer(std, std)
+        eigenvalues, eigenvectors = np.linalg.eigh(correlation)
+        correlation = eigenvectors @ np.diag(np.maximum(eigenvalues, EPSILON)) @ eigenvectors.T
+        std = np.sqrt(np.diag(correlation))
+        return correlation / np.outer(std, std)
+
+    def sample(self, num_rows, seed=None):
+        """NUM_ROWS synthetic records."""
+        rng = np.random.default_rng(seed)
+        scores = rng.standard_normal((num_rows, len(self.columns))) @ np.linalg.cholesky(self.correlation()).T
+        quantiles = np.clip(stats.norm.cdf(scores), EPSILON, 1 - EPSILON)
+        synthetic = {}
+        if self.id_column is not None:
+            synthetic[self.id_column] = np.arange(num_rows)
+        for i, column in enumerate(self.numerical):
+            moments = self.moments[column]
+            values = np.clip(self.ppf(column, quantiles[:, i]), moments['min'], moments['max'])
+            if column in self.integer:
+                values = np.round(values)
+            n_total = moments['n'] + self.missing[column]
+            values[rng.random(num_rows) < self.missing[column] / n_total] = np.nan
+            synthetic[column] = pd.Series(values, dtype='Int64' if column in self.integer else 'float64')
+        for i, column in enumerate(self.categorical, start=len(self.numerical)):
+            _, upper = self.category_bounds(column)
+            index = np.minimum(np.searchsorted(upper, quantiles[:, i]), len(upper) - 1)
+            synthetic[column] = np.array(self.categories[column], dtype=object)[index]
+        return pd.DataFrame(synthetic)
+
+    def to_dict(self):
+        return {'version': MODEL_VERSION,
+                'updated': datetime.now().isoformat(timespec='seconds'),
+                'numerical': self.numerical, 'categorical': self.categorical, 'integer': self.integer,
+                'id_column': self.id_column, 'distributions': self.distributions,
+                'moments': self.moments, 'missing': self.missing, 'ranges': self.ranges,
+                'histograms': {column: histogram.astype(int).tolist() for column, histogram in self.histograms.items()},
+                'categories': self.categories, 'counts': self.counts,
+                'n_rows': self.n_rows, 'n_updates': self.n_updates,
+                'score_sum': self.score_sum.tolist(), 'score_products': self.score_products.tolist()}
+
+    @classmethod
+    def from_dict(cls, state):
+        if state.get('version') != MODEL_VERSION:
+            raise ValueError(f"Model version {state.get('version')} is not supported, refit the model.")
+        model = cls.__new__(cls)
+        for key, value in state.items():
+            if key not in ('version', 'updated'):
+                setattr(model, key, value)
+        model.ranges = {column: tuple(bounds) if bounds is not None else None
+                        for column, bounds in state['ranges'].items()}
+        model.histograms = {column: np.array(histogram, dtype=float)
+                            for column, histogram in state['histograms'].items()}
+        model.score_sum = np.array(state['score_sum'])
+        model.score_products = np.array(state['score_products'])
+        model._marginals = {}
+        return model
+
+    def save(self, model_file):
+        with open(model_file, 'w') as json_file:
+            json.dump(self.to_dict(), json_file)
+
+    @classmethod
+    def load(cls, model_file):
+        with open(model_file) as json_file:
+            return cls.from_dict(json.load(json_file))
+
+
+def check_against_full_refit(model, data):
+    """Compare MODEL with a model fitted on the full DATA in one batch.
+    Returns the maximal absolute difference of the correlation matrices, the
+    maximal Kolmogorov-Smirnov distance of the numerical marginals and the
+    maximal total variation distance of the categorical ones, and the refitted
+    model."""
+    refitted = IncrementalGaussianCopula.from_dict(model.to_dict())
+    refitted.reset()
+    refitted.update(data)
+    ks = 0.0
+    for column in model.numerical:
+        low, high = refitted.moments[column]['min'], refitted.moments[column]['max']
+        if low is None:
+            continue
+        grid = np.linspace(low, high, GRID_POINTS)
+        ks = max(ks, float(np.abs(model.cdf(column, grid) - refitted.cdf(column, grid)).max()))
+    tvd = 0.0
+    for column in model.categorical:
+        shares = pd.concat([pd.Series(m.counts[column], index=m.categories[column], dtype=float)
+                            .pipe(lambda counts: counts / counts.sum()) for m in (model, refitted)], axis=1)
+        tvd = max(tvd, 0.5 * shares.fillna(0).diff(axis=1).iloc[:, 1].abs().sum())
+    drift = {'n_rows': model.n_rows, 'n_rows_full': refitted.n_rows,
+             'correlation': float(np.abs(model.correlation() - refitted.correlation()).max()),
+             'marginal_ks': ks, 'categorical_tvd': tvd}
+    return drift, refitted
+
+
+def read_model_input(input_file, metadata=None):
+    """Preprocessed input csv file, reduced to the columns of the metadata."""
+    from preprocessing.preprocess_UCC import preprocess, drop_unused_columns
+    metadata = get_metadata() if metadata is None else metadata
+    data = drop_unused_columns(preprocess(pd.read_csv(input_file)))
+    return data[[column for column in metadata['columns'] if column in data]]
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description='Fit, update, check and sample an incremental GaussianCopula model.')
+    argparser.add_argument('command', choices=['fit', 'update', 'check', 'sample'],
+                           help='fit a new model, add a batch of records, compare with a full refit on all '
+                                'records, or sample synthetic records')
+    argparser.add_argument('--model', '-m', type=str, required=True,
+                           help='JSON file of the model')
+    argparser.add_argument('--input', '-i', type=str,
+                           help='input csv file: the records to fit, the new batch, or all records for check')
+    argparser.add_argument('--output', '-o', type=str,
+                           help='output csv file of sample')
+    argparser.add_argument('--rows', '-n', type=int,
+                           help='number of records to sample (default: number of records of the model)')
+    argparser.add_argument('--refit', action='store_true',
+                           help='check: replace the model by the full refit if the correlations drifted by more '
+                                f'than --tolerance')
+    argparser.add_argument('--tolerance', type=float, default=REFIT_TOLERANCE,
+                           help='maximal tolerated absolute difference of the correlations')
+    argparser.add_argument('--seed', type=int, default=0,
+                           help='random seed of sample')
+    args = argparser.parse_args()
+
+    if args.command in ('fit', 'update', 'check') and args.input is None:
+        argparser.error(f"{args.command} requires --input")
+    if args.command == 'fit':
+        from synthetization.model_selection import get_columns_distributions
+        from synthetization.synthetization_script import DEFAULT_COLUMNS_DISTRIBUTIONS
+        data = read_model_input(args.input)
+        distributions = get_columns_distributions(data, DEFAULT_COLUMNS_DISTRIBUTIONS)
+        IncrementalGaussianCopula.fit(data, distributions).save(args.model)
+        print(f"Fitted the model on {len(data)} records.")
+    elif args.command == 'update':
+        model = IncrementalGaussianCopula.load(args.model)
+        batch = read_model_input(args.input)
+        model.update(batch).save(args.model)
+        print(f"Added {len(batch)} records, the model is based on {model.n_rows} records in {model.n_updates} updates.")
+    elif args.command == 'check':
+        model = IncrementalGaussianCopula.load(args.model)
+        drift, refitted = check_against_full_refit(model, read_model_input(args.input))
+        print(f"Difference to the full refit: {drift}")
+        if args.refit and drift['correlation'] > args.tolerance:
+            refitted.save(args.model)
+            print("Replaced the model by the full refit.")
+    else:
+        if args.output is None:
+            argparser.error("sample requires --output")
+        model = IncrementalGaussianCopula.load(args.model)
+        model.sample(args.rows or model.n_rows, seed=args.seed).to_csv(args.output, index=False)
@@ -0,0 +1,256 @@
+# /**
+#  * Use Case Cardiology HiGHmed Data Anonymisation
+#  * Copyright (C) 2024 - Berlin Institute of Health
+#  * <p>
+#  * Licensed under the Academic Free License v3.0;
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  * <p>
+#  * https://license.md/licenses/academic-free-license-v3-0/
+#  * <p>
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+#  */
+"""Selection of the marginal distributions of the GaussianCopula model.
+
+For every numerical column, the candidate distributions supported by the
+GaussianCopula model are fitted concurrently and scored with the
+Kolmogorov-Smirnov statistic, as done by the ASyH/copulas model search.  The
+winning distribution of every column is stored in a versioned cache keyed by
+the column and a fingerprint of its values, from which run_synthetization
+picks it up per column, whichever other columns the synthesized data has
+(e.g. after the column projection of the score):
+
+    python -m synthetization.model_selection -i data/input.csv --score MAGGIC --check
+"""
+import hashlib
+import json
+import os
+import tempfile
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ASyH_scripts.utility import get_metadata
+
+# bump when the candidates or the scoring change, older cache entries are then ignored
+CACHE_VERSION = 2
+# in the repository, not the working directory, which the batch runner and the job service change per job
+CACHE_DIR = os.path.join(Path(__file__).parent.parent, "temp", "model_selection")
+CANDIDATE_DISTRIBUTIONS = ['norm', 'truncnorm', 'gamma', 'beta', 'uniform', 'gaussian_kde']
+# the distributions are fitted and scored on a random subsample of at most this many values
+MAX_FIT_ROWS = 5000
+SELECTION_MODES = ["cached", "run", "off"]
+
+
+def numerical_columns(metadata=None):
+    metadata = get_metadata() if metadata is None else metadata
+    return [column for column, spec in metadata['columns'].items() if spec['sdtype'] == 'numerical']
+
+
+def data_fingerprint(data, columns):
+    """Hash of the values of COLUMNS of DATA, independent of row order and of
+    the column dtypes (e.g. Int64 or float after a csv round trip)."""
+    digest = hashlib.sha256()
+    for column in sorted(columns):
+        values = np.sort(pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=float))
+        digest.update(column.encode())
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def fit_distribution(values, distribution):
+    """Fit DISTRIBUTION to VALUES, return its cumulative distribution function."""
+    # scipy.stats is imported here, the synthetization imports this module only for the cache lookup
+    from scipy import stats
+    low, high = values.min(), values.max()
+    if distribution == 'norm':
+        return stats.norm(*stats.norm.fit(values)).cdf
+    if distribution == 'uniform':
+        return stats.uniform(low, high - low).cdf
+    if distribution == 'truncnorm':
+        # truncated at the observed range, moments as starting values as in copulas
+        loc, scale = values.mean(), values.std()
+        return stats.truncnorm((low - loc) / scale, (high - loc) / scale, loc, scale).cdf
+    if distribution == 'gamma':
+        # maximum likelihood starting from the method of moments, which converges for skewed data
+        a, loc, scale = stats.gamma.fit(values, method='MM')
+        return stats.gamma(*stats.gamma.fit(values, a, loc=loc, scale=scale)).cdf
+    if distribution == 'beta':
+        # support fixed to the observed range as in copulas, slightly widened to include the extremes
+        margin = 1e-6 * (high - low)
+        loc, scale = low - margin, high - low + 2 * margin
+        a, b, _, _ = stats.beta.fit(values, floc=loc, fscale=scale)
+        return stats.beta(a, b, loc, scale).cdf
+    if distribution == 'gaussian_kde':
+        bandwidth = stats.gaussian_kde(values).factor * values.std(ddof=1)
+        return lambda x: stats.norm.cdf((np.asarray(x)[:, None] - values[None, :]) / bandwidth).mean(axis=1)
+    raise ValueError(f"Unknown distribution {distribution}, choose one of {CANDIDATE_DISTRIBUTIONS}.")
+
+
+def score_distribution(job):
+    """Kolmogorov-Smirnov statistic of a fit, lower is better.  JOB is a tuple
+    (column, distribution, values)."""
+    from scipy import stats
+    column, distribution, values = job
+    if len(values) < 2 or values.min() == values.max():
+        return column, distribution, np.inf
+    try:
+        with np.errstate(all='ignore'):
+            statistic = stats.kstest(values, fit_distribution(values, distribution)).statistic
+    except Exception as excpt:
+        print(f"Fitting {distribution} to {column} failed: {excpt}")
+        statistic = np.inf
+    return column, distribution, float(statistic) if np.isfinite(statistic) else np.inf
+
+
+def select_distributions(data, columns, candidates=CANDIDATE_DISTRIBUTIONS, max_workers=None, seed=0):
+    """Fit all CANDIDATES to all COLUMNS of DATA in a pool of MAX_WORKERS
+    processes.  Returns the best distribution per column and the table of
+    Kolmogorov-Smirnov statistics (columns x candidates)."""
+    rng = np.random.default_rng(seed)
+    jobs = []
+    for column in columns:
+        values = pd.to_numeric(data[column], errors='coerce').dropna().to_numpy(dtype=float)
+        if len(values) > MAX_FIT_ROWS:
+            values = rng.choice(values, MAX_FIT_ROWS, replace=False)
+        jobs += [(column, distribution, values) for distribution in candidates]
+
+    if max_workers == 1:
+        results = [score_distribution(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(score_distribution, jobs))
+
+    scores = pd.DataFrame(results, columns=['column', 'distribution', 'ks_statistic']) \
+        .pivot(index='column', columns='distribution', values='ks_statistic').loc[columns, candidates]
+    best = {column: scores.loc[column].idxmin() for column in columns if np.isfinite(scores.loc[column].min())}
+    return best, scores
+
+
+def cache_file(column, fingerprint, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"v{CACHE_VERSION}_{column}_{fingerprint}.json")
+
+
+def load_cached_distributions(data, columns, cache_dir=CACHE_DIR):
+    """Cached distributions of the COLUMNS of DATA, each looked up by the
+    fingerprint of its own values.  Columns without a cache entry are missing,
+    columns for which no candidate could be fitted are None."""
+    cached = {}
+    for column in columns:
+        path = cache_file(column, data_fingerprint(data, [column]), cache_dir)
+        if not os.path.exists(path):
+            continue
+        with open(path) as json_file:
+            entry = json.load(json_file)
+        if entry.get('version') == CACHE_VERSION:
+            cached[column] = entry['distribution']
+    return cached
+
+
+def run_model_selection(data, columns=None, cache_dir=CACHE_DIR, max_workers=None):
+    """Select the distributions of the COLUMNS of DATA and store them in the
+    cache, one entry per column.  Returns the selected distributions per
+    column."""
+    columns = [column for column in numerical_columns() if column in data] if columns is None else columns
+    best, scores = select_distributions(data, columns, max_workers=max_workers)
+    print("Kolmogorov-Smirnov statistics of the candidate distributions:")
+    print(scores.round(4).to_string())
+
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    for column in columns:
+        fingerprint = data_fingerprint(data, [column])
+        with open(cache_file(column, fingerprint, cache_dir), 'w') as json_file:
+            json.dump({'version': CACHE_VERSION,
+                       'column': column,
+                       'fingerprint': fingerprint,
+                       'created': datetime.now().isoformat(timespec='seconds'),
+                       'n_rows': len(data),
+                       'distribution': best.get(column),
+                       'ks_statistics': scores.loc[column].replace(np.inf, None).to_dict()},
+                      json_file, indent=2)
+    return best
+
+
+def check_cached_selection(data, cache_dir=CACHE_DIR):
+    """Columns of DATA (e.g. a score subsample) for which the synthesizer
+    would not find a cached selection: DATA goes through the input file of
+    run_synthetization and the lookup of select_distributions, as in
+    synthesize_ucc_cardio_data and fit_copula_model."""
+    from synthetization.synthetization_script import (DEFAULT_COLUMNS_DISTRIBUTIONS, read_synthetization_input,
+                                                      write_synthetization_input)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = os.path.join(temp_dir, "synth_input.csv")
+        write_synthetization_input(data, input_file)
+        real_data, _ = read_synthetization_input(input_file)
+    columns = [column for column in DEFAULT_COLUMNS_DISTRIBUTIONS if column in real_data]
+    cached = load_cached_distributions(real_data, columns, cache_dir)
+    return [column for column in columns if column not in cached]
+
+
+def get_columns_distributions(data, defaults, mode="cached", cache_dir=CACHE_DIR, max_workers=None):
+    """Distributions per column for the GaussianCopula model of DATA.
+
+    MODE 'cached' uses the cached selection for DATA if there is one and
+    DEFAULTS otherwise, 'run' runs the selection if there is no cached one and
+    'off' always uses DEFAULTS.
+    """
+    if mode not in SELECTION_MODES:
+        raise ValueError(f"Unknown model selection mode {mode}, choose one of {SELECTION_MODES}.")
+    if mode == "off":
+        return defaults
+    columns = list(defaults)
+    cached = load_cached_distributions(data, columns, cache_dir)
+    missing = [column for column in columns if column not in cached]
+    if missing and mode == "run":
+        cached.update(run_model_selection(data, missing, cache_dir, max_workers))
+    selected = {column: distribution for column, distribution in cached.items() if distribution is not None}
+    if not selected:
+        return defaults
+    print(f"Using selected distributions {selected}")
+    return {**defaults, **selected}
+
+
+if __name__ == "__main__":
+    from evaluation.constants import MEDICAL_SCORE, column_filter, required_columns
+    from preprocessing.filtering import select_score_subsample
+    from preprocessing.preprocess_UCC import preprocess, drop_column_cleanup
+
+    argparser = ArgumentParser(description='Select the marginal distributions of the GaussianCopula model and cache '
+                                           'them for the synthetization of the same data.')
+    argparser.add_argument('--input', '-i', type=str, required=True,
+                           help='input csv file, as passed to the analysis scripts')
+    argparser.add_argument('--score', type=str, nargs='+',
+                           default=[MEDICAL_SCORE.BIOHF.value, MEDICAL_SCORE.MAGGIC.value],
+                           choices=[MEDICAL_SCORE.MAGGIC.value, MEDICAL_SCORE.BIOHF.value],
+                           help='score subsamples to select the distributions for')
+    argparser.add_argument('--cache_dir', type=str, default=CACHE_DIR,
+                           help='directory of the cached selections')
+    argparser.add_argument('--workers', type=int, default=None,
+                           help='number of worker processes (default: number of CPUs)')
+    argparser.add_argument('--all_columns', action='store_true',
+                           help='read all columns of the input, as the analysis scripts with --all_columns')
+    argparser.add_argument('--check', action='store_true',
+                           help='check that the synthetization of the subsamples finds the cached selections')
+    args = argparser.parse_args()
+
+    missing_columns = {}
+    for score in args.score:
+        print(f"Model selection for the {score} subsample.")
+        columns = None if args.all_columns else required_columns(MEDICAL_SCORE(score), "input")
+        full_dataset = preprocess(pd.read_csv(args.input, usecols=column_filter(columns)))
+        subsample = drop_column_cleanup(select_score_subsample(full_dataset, MEDICAL_SCORE(score)))
+        run_model_selection(subsample, cache_dir=args.cache_dir, max_workers=args.workers)
+        if args.check:
+            missing_columns[score] = check_cached_selection(subsample, args.cache_dir)
+            print(f"Cached selection of the {score} subsample: "
+                  f"{'found' if not missing_columns[score] else 'missing for ' + ', '.join(missing_columns[score])}.")
+    if any(missing_columns.values()):
+        raise RuntimeError(f"The synthetization does not find the cached selection of the columns {missing_columns}.")
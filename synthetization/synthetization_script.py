@@ -1,57 +1,120 @@
 import os
 from argparse import ArgumentParser
 
-import ASyH
 import pandas as pd
 
 from ASyH_scripts.utility import get_metadata
-from evaluation.local_utils import read_data, MEDICAL_SCORE
+from evaluation.constants import MEDICAL_SCORE, column_filter
 from preprocessing.preprocess_UCC import preprocess, drop_unused_columns
+from synthetization.model_selection import get_columns_distributions
 
 DELETE_TEMP = False
 
+# as a shortcut, these are the results of the best scored ASyH pipeline,
+# GaussianCopulaModel.  The below settings were taken from the output model.
+# This model was generated by running:
+#   asyh = ASyH.Application()
+#   asyh.synthesize(synth_input_file, metadata=raw_metadata)
+# synthetization.model_selection selects them for the current data.
+DEFAULT_COLUMNS_DISTRIBUTIONS = {'age': 'gaussian_kde',
+                                 'bmi': 'gamma',
+                                 'sys_bp_m': 'gamma',
+                                 'hf_duration': 'truncnorm',
+                                 'lvef_m': 'gaussian_kde',
+                                 'creatinine_m': 'gaussian_kde',
+                                 'sodium_m': 'beta',
+                                 'hb_m': 'truncnorm',
+                                 'egfr_m': 'beta'}
+
+
+def select_distributions(real_data, model_selection="cached"):
+    """Marginal distributions of the numerical columns of REAL_DATA, see run_synthetization for MODEL_SELECTION."""
+    default_distributions = {col: distribution for col, distribution in DEFAULT_COLUMNS_DISTRIBUTIONS.items()
+                             if col in real_data}
+    return get_columns_distributions(real_data, default_distributions, mode=model_selection)
+
+
+def fit_copula_model(real_data, metadata=None, model_selection="cached"):
+    """
+    Fits an IncrementalGaussianCopula model on the data in a single batch
+    :param real_data: table with the columns of the metadata to synthesize
+    :param metadata: ASyH metadata, restricted to the columns of real_data (default: get_metadata())
+    :param model_selection: choice of the marginal distributions, see run_synthetization
+    """
+    from synthetization.incremental_copula import IncrementalGaussianCopula
+    metadata = get_metadata() if metadata is None else metadata
+    metadata = dict(metadata, columns={col: spec for col, spec in metadata['columns'].items() if col in real_data})
+    return IncrementalGaussianCopula.fit(real_data, select_distributions(real_data, model_selection), metadata=metadata)
+
+
+def read_synthetization_input(synth_input_file, columns_spec=None):
+    """
+    Reads the input of the synthesizer
+    :param synth_input_file: csv file written by write_synthetization_input
+    :param columns_spec: features to synthesize (besides 'alias'), all columns of the metadata if None
+    :return: the data and the ASyH metadata, both restricted to the columns of the metadata in the file
+    """
+    raw_metadata = get_metadata()
+    # only the columns of the metadata, restricted to a data subset (columns_spec), are read
+    columns = list(raw_metadata['columns'])
+    if columns_spec is not None:
+        # re-add 'alias'
+        columns_spec = ['alias'] + columns_spec
+        print(f'feature_set = {columns_spec}')
+        columns = [column for column in columns_spec if column in raw_metadata['columns']]
+    real_data = pd.read_csv(synth_input_file, usecols=column_filter(columns))
+    # the input may lack columns of the metadata, e.g. after a column projection
+    real_data = real_data[[column for column in columns if column in real_data]]
+    raw_metadata['columns'] = {col: raw_metadata['columns'][col] for col in real_data.columns}
+    return real_data, raw_metadata
+
 
-def run_synthetization(synth_input_file, synth_output_file, columns_spec=None):
+def write_synthetization_input(df, temp_file, columns_spec=None):
+    """
+    Writes the columns of the use case data to synthesize to the input file of run_synthetization
+    :param df: table with use case data, it is not modified
+    :param temp_file: filepath of the csv file
+    :param columns_spec: features to synthesize (besides 'alias'), all columns of df if None
+    """
+    unused_columns = ['Unnamed: 0', 'hstnt_m', 'hstnt_u', 'ntprobnp_m', 'ntprobnp_u']
+    columns = [column for column in df.columns if column not in unused_columns]
+    if columns_spec is not None:
+        # only the subset is synthesized, so only the subset is written
+        columns = [column for column in columns if column == 'alias' or column in columns_spec]
+    df.to_csv(temp_file, columns=columns, index=False, sep=",", na_rep='NULL')
+
+
+def run_synthetization(synth_input_file, synth_output_file, columns_spec=None, model_selection="cached",
+                       num_rows=None, chunk_rows=None, sample_workers=1, seed=0):
     """
     Executes the data synthetization using ASyH
     :param synth_input_file: filepath to the preprocessed highmed cardio dataset
-    :param synth_output_file: filepath to where the synthesized data should be saved to
+    :param synth_output_file: filepath to where the synthesized data should be saved to, the output directory
+        of the Parquet part files if num_rows is given
+    :param model_selection: 'cached' to use the distributions selected for this data by
+        synthetization.model_selection if available, 'run' to select them if not, 'off' for the defaults
+    :param num_rows: number of records to sample in chunks to Parquet files instead of one record per input record,
+        from an IncrementalGaussianCopula model fitted on the input; the paths of the part files are returned
+    :param chunk_rows: number of records per chunk (default: synthetization.chunked_sampling.CHUNK_ROWS)
+    :param sample_workers: number of processes sampling the chunks in parallel
+    :param seed: random seed of the chunked sampling
     """
     if not os.path.isabs(synth_input_file):
         synth_input_file = os.path.join(os.getcwd(), synth_input_file.lstrip("./"))
     if not os.path.isabs(synth_output_file):
         synth_output_file = os.path.join(os.getcwd(), synth_output_file.lstrip("./"))
 
-    real_data = pd.read_csv(synth_input_file)
-    raw_metadata = get_metadata()
-    # reducing the input data to the subset defined in the metadata:
-    real_data = real_data[raw_metadata['columns'].keys()]
-
-    # as a shortcut, these are the results of the best scored ASyH pipeline,
-    # GaussianCopulaModel.  The below settings were taken from the output model.
-    # This model was generated by running:
-    #   asyh = ASyH.Application()
-    #   asyh.synthesize(synth_input_file, metadata=raw_metadata)
-    columns_distributions = {'age': 'gaussian_kde',
-                             'bmi': 'gamma',
-                             'sys_bp_m': 'gamma',
-                             'hf_duration': 'truncnorm',
-                             'lvef_m': 'gaussian_kde',
-                             'creatinine_m': 'gaussian_kde',
-                             'sodium_m': 'beta',
-                             'hb_m': 'truncnorm',
-                             'egfr_m': 'beta'}
-
-    # if we need to restrict to a data subset (columns_spec):
-    if columns_spec is not None:
-        # re-add 'alias'
-        columns_spec = ['alias'] + columns_spec
-        print(f'feature_set = {columns_spec}')
-        real_data = real_data[columns_spec]
-        raw_metadata['columns'] = {col: raw_metadata['columns'][col] for col in columns_spec}
-        columns_distributions = {col: columns_distributions[col] for col in columns_distributions if
-                                 col in columns_spec}
+    real_data, raw_metadata = read_synthetization_input(synth_input_file, columns_spec)
+
+    if num_rows is not None:
+        # the records do not fit into memory: sampled chunk by chunk from a copula with a seedable sampler
+        from synthetization.chunked_sampling import CHUNK_ROWS, sample_to_parquet
+        model = fit_copula_model(real_data, raw_metadata, model_selection=model_selection)
+        return sample_to_parquet(model, num_rows, synth_output_file, chunk_rows=chunk_rows or CHUNK_ROWS, seed=seed,
+                                 max_workers=sample_workers)
+    columns_distributions = select_distributions(real_data, model_selection)
 
+    import ASyH
     metadata = ASyH.Metadata(raw_metadata)
     input_data = ASyH.Data(real_data, metadata=metadata)
 
@@ -68,18 +131,20 @@ def run_synthetization(synth_input_file, synth_output_file, columns_spec=None):
 
 def synthesize_ucc_cardio_data(df, columns_spec=None,
                                temp_file="./temp/anon_input.csv",
-                               output_file="./temp/anon_output.csv"):
+                               output_file="./temp/anon_output.csv",
+                               model_selection="cached"):
     """
     Method to synthesize the use case cardio dataset using the ASyH
-    :param df: table with use case data
+    :param df: table with use case data, it is not modified
+    :param columns_spec: features to synthesize (besides 'alias'), all columns of the metadata in df if None
     :param temp_file: filepath to a temporary file, that is preprocessed for the anonymization
     :param output_file: filepath to the anonymized use case cardio csv-file
+    :param model_selection: choice of the marginal distributions, see run_synthetization
     """
 
-    df.drop(['Unnamed: 0', 'hstnt_m', 'hstnt_u', 'ntprobnp_m', 'ntprobnp_u'],
-            axis=1, inplace=True, errors='ignore')
-    df.to_csv(temp_file, index=False, sep=",", na_rep='NULL')
-    synthesized_data = run_synthetization(temp_file, output_file, columns_spec=columns_spec)
+    write_synthetization_input(df, temp_file, columns_spec)
+    synthesized_data = run_synthetization(temp_file, output_file, columns_spec=columns_spec,
+                                          model_selection=model_selection)
 
     if DELETE_TEMP:
         os.remove(temp_file)